@@ -12,189 +12,314 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dwave_qbsolv import QBSolv
+#to run the delivery routing offline:> python ./Optimized_Routes.py
+#with the D-Wave QPU and inspector:> python ./Optimized_Routes.py --qpu --inspect
 
-#VGG from dwave.system import LeapHybridSampler
-import neal #VGG
-
-import numpy as np
-import matplotlib.pyplot as plt
-import re
-import pandas as pd
-import geopandas
+#API: cluster, build_route_qubo, solve_route, plot_route; main() is the CLI.
+#Heavy dependencies (dwave.system, dwave.inspector, and geopandas
+#and matplotlib through rendering) are only imported by the feature that needs them,
+#so importing this module is fast and everything but --qpu/--inspect works on an
+#air-gapped box.
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import math
+import os
 import random
+import time
 
-import dwavebinarycsp
-import dwave.inspector
-from dwave.system import EmbeddingComposite, DWaveSampler
+import numpy as np
 
-from utilities import get_groupings, visualize_groupings, visualize_scatterplot
+from distances import haversine, distance_matrix
+from route_qubo import route_bqm, decode_route, route_mileage
+from route_heuristics import solve_tour, tour_to_sample
+from instrumentation import stage, tracing
 
-Total_Number_Cities = 21
 Number_Deliveries = 3
-cd = (int)(Total_Number_Cities/Number_Deliveries)
 
 # Tunable parameters. 
 A = 8500
 B = 1
-chainstrength = 4500
-numruns = 100
 
-## Custering Preprocess
+# Route solver: 'anneal' (route QUBO from random states), 'heuristic' (2-opt/Or-opt
+# local search only, for large routes) or 'warm' (route QUBO annealing seeded
+# with the local-search tour)
+route_method = 'warm'
+warm_sweeps = 100
 
-class Coordinate:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+# Delivery groups (one per vehicle), named by the matplotlib colors they are plotted in
+GROUP_COLORS = ['r', 'g', 'b', 'c', 'm', 'y', 'k']
 
-        # coordinate labels for groups red, green, and blue
-        label = "{0},{1}_".format(x, y)
-        self.r = label + "r"
-        self.g = label + "g"
-        self.b = label + "b"
+## Custering Preprocess
+
+def group_names(num_groups):
+    """names of num_groups delivery groups: the GROUP_COLORS while they last, then numbers"""
+    return GROUP_COLORS[:num_groups] + [str(c) for c in range(len(GROUP_COLORS), num_groups)]
 
 def lat_lon_distance(a, b):
     """Calculates distance between two latitude-longitude coordinates."""
-    R = 3963  # radius of Earth (miles)
-    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
-    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
-    return math.acos(math.sin(lat1) * math.sin(lat2) +
-                     math.cos(lat1) * math.cos(lat2) * math.cos(lon1 - lon2)) * R
-
-def get_distance(a, b):
-    R = 3963  # radius of Earth (miles)
-    lat1, lon1 = math.radians(a.x), math.radians(b.x)
-    lat2, lon2 = math.radians(a.y), math.radians(b.y)
-    return math.acos(math.sin(lat1) * math.sin(lat2) +
-                     math.cos(lat1) * math.cos(lat2) * math.cos(lon1 - lon2)) * R
-
-
-def get_max_distance(coordinates):
-    max_distance = 0
-    for i, coord0 in enumerate(coordinates[:-1]):
-        for coord1 in coordinates[i+1:]:
-            distance = get_distance(coord0, coord1)
-            max_distance = max(max_distance, distance)
-
-    return max_distance
-
-
-def cluster_points(scattered_points, filename):
-    # Set up problem
-    # Note: max_distance gets used in division later on. Hence, the max(.., 1)
-    #   is used to prevent a division by zero
-    coordinates = [Coordinate(x, y) for x, y in scattered_points]
-    max_distance = max(get_max_distance(coordinates), 1)
-
-    # Build constraints
-    csp = dwavebinarycsp.ConstraintSatisfactionProblem(dwavebinarycsp.BINARY)
-
-    # Apply constraint: coordinate can only be in one colour group
-    choose_one_group = {(0, 0, 1), (0, 1, 0), (1, 0, 0)}
-    for coord in coordinates:
-        csp.add_constraint(choose_one_group, (coord.r, coord.g, coord.b))
-
-    # Build initial BQM
-    bqm = dwavebinarycsp.stitch(csp)
-
-    # Edit BQM to bias for close together points to share the same color
-    for i, coord0 in enumerate(coordinates[:-1]):
-        for coord1 in coordinates[i+1:]:
-            # Set up weight
-            d = get_distance(coord0, coord1) / max_distance  # rescale distance
-            weight = -math.cos(d*math.pi)
-
-            # Apply weights to BQM
-            bqm.add_interaction(coord0.r, coord1.r, weight)
-            bqm.add_interaction(coord0.g, coord1.g, weight)
-            bqm.add_interaction(coord0.b, coord1.b, weight)
-
-    # Edit BQM to bias for far away points to have different colors
-    for i, coord0 in enumerate(coordinates[:-1]):
-        for coord1 in coordinates[i+1:]:
-            # Set up weight
-            # Note: rescaled and applied square root so that far off distances
-            #   are all weighted approximately the same
-            d = math.sqrt(get_distance(coord0, coord1) / max_distance)
-            weight = -math.tanh(d) * 0.1
-
-            # Apply weights to BQM
-            bqm.add_interaction(coord0.r, coord1.b, weight)
-            bqm.add_interaction(coord0.r, coord1.g, weight)
-            bqm.add_interaction(coord0.b, coord1.r, weight)
-            bqm.add_interaction(coord0.b, coord1.g, weight)
-            bqm.add_interaction(coord0.g, coord1.r, weight)
-            bqm.add_interaction(coord0.g, coord1.b, weight)
-
-# Submit problem to D-Wave sampler
-    sampler = EmbeddingComposite(DWaveSampler(solver={'qpu': True}))
-    #sampler = neal.SimulatedAnnealingSampler()
-    sampleset = sampler.sample(bqm, chain_strength=4, num_reads=1000)
-    best_sample = sampleset.first.sample
+    return haversine(a, b)
+
+
+def cluster(scattered_points, use_qpu=False, num_reads=1000, inspect=False,
+            num_groups=Number_Deliveries, strength=None, balance=None, method='anneal',
+            capacity=None):
+    """
+    Groups the points into delivery groups (red, green and blue by default).
+    parameters:
+        scattered_points - list of (latitude, longitude) tuples
+        use_qpu - sample on the D-Wave QPU instead of the local simulated annealer
+        num_reads - number of samples to take
+        inspect - open the problem and sampleset in dwave.inspector
+        num_groups - number of groups (vehicles), see group_names
+        strength - one-group-per-point constraint strength, see clustering.cluster_qubo_vectors
+        balance - weight of equal group sizes, clustering.BALANCE by default; see
+                  clustering.cluster_qubo_vectors. Groups the annealer leaves empty
+                  are given a point each (clustering.fill_empty_clusters)
+        method - 'anneal' the clustering QUBO of all points, 'kmeans' for classical
+                 clustering of large networks (clustering.kmeans) or 'hierarchical' to
+                 split large regions by k-means and anneal the small ones
+                 (clustering.hierarchical_clusters); use_qpu, num_reads, inspect,
+                 strength and balance only apply to 'anneal'
+        capacity - largest number of points in a group, only for 'kmeans'
+    returns:
+        (dict) - key is a group name, value is a list of coordinate tuples
+    """
+    from clustering import (cluster_bqm, default_strength, sampleset_states, decode_clusters,
+                            repair_clusters, fill_empty_clusters, groupings, kmeans,
+                            hierarchical_clusters, BALANCE)
+
+    if num_groups < 1:
+        raise ValueError(f"num_groups must be at least 1, got {num_groups}")
+    if capacity is not None and method != 'kmeans':
+        raise ValueError("a group capacity requires method='kmeans'")
+
+    if method == 'kmeans':
+        with stage('cluster_kmeans', points=len(scattered_points), groups=num_groups):
+            assignment = kmeans(scattered_points, num_groups, capacity=capacity)
+        return groupings(scattered_points, assignment, group_names(num_groups))
+    if method == 'hierarchical':
+        with stage('cluster_hierarchical', points=len(scattered_points), groups=num_groups):
+            assignment = hierarchical_clusters(scattered_points, num_groups)
+        return groupings(scattered_points, assignment, group_names(num_groups))
+    if method != 'anneal':
+        raise ValueError(f"unknown clustering method {method!r}, expected 'anneal', 'kmeans' "
+                         "or 'hierarchical'")
+
+    # Set up problem: variable i*num_groups + c is point i in group c
+    distances = distance_matrix(scattered_points)
+    if strength is None:
+        strength = default_strength(distances)
+    if balance is None:
+        balance = BALANCE
+    with stage('cluster_bqm', points=len(scattered_points), groups=num_groups) as record:
+        bqm = cluster_bqm(distances, num_groups, strength, balance)
+        record['couplings'] = bqm.num_interactions
+
+    # Submit problem to D-Wave sampler
+    with stage('cluster_sample', reads=num_reads, variables=bqm.num_variables,
+               couplings=bqm.num_interactions, qpu=use_qpu):
+        if use_qpu:
+            from dwave.system import EmbeddingComposite, DWaveSampler
+            sampler = EmbeddingComposite(DWaveSampler(solver={'qpu': True}))
+            # chains twice as strong as the constraint, as the 4 used with strength 2
+            sampleset = sampler.sample(bqm, chain_strength=2 * strength, num_reads=num_reads)
+        else:
+            import neal
+            sampler = neal.SimulatedAnnealingSampler()
+            sampleset = sampler.sample(bqm, num_reads=num_reads)
 
     # Visualize graph problem
-    dwave.inspector.show(bqm, sampleset)
+    if inspect:
+        import dwave.inspector
+        dwave.inspector.show(bqm, sampleset)
+
+    # group of every point in the lowest energy sample; points in no or several
+    # groups join the group of their nearest neighbour, and every empty group gets
+    # a point, so that there is one group per vehicle
+    best = np.argmin(sampleset.record.energy)
+    states = sampleset_states(sampleset, bqm.num_variables)[best]
+    assignment = repair_clusters(decode_clusters(states, num_groups), distances)
+    assignment = fill_empty_clusters(assignment, distances, num_groups)
+    return groupings(scattered_points, assignment, group_names(num_groups))
+
+
+def cluster_points(scattered_points, filename, **kwargs):
+    """Groups the points (see cluster) and plots the groups into filename."""
+    with stage('cluster_points', points=len(scattered_points)):
+        groupings = cluster(scattered_points, **kwargs)
 
     # Visualize solution
-    groupings = get_groupings(best_sample)
-    visualize_groupings(groupings, filename)
+    if filename:
+        from utilities import visualize_groupings
+        with stage('plot_clusters', points=len(scattered_points)):
+            visualize_groupings(groupings, filename)
     return groupings
-    # Print solution onto terminal
-    # Note: This is simply a more compact version of 'best_sample'
-    #print(groupings)
 ## Clustering Preprocess End
 
+def build_route_qubo(D, penalty=None):
+    """
+    route QUBO (dimod BQM) through the cities of distance matrix D, see route_qubo
+    parameters:
+        penalty - constraint strength, the global A by default; 'auto' picks it by a
+                  short sweep of candidates (see penalty_tuning.tune_route_penalty)
+    """
+    if penalty == 'auto':
+        from penalty_tuning import tune_route_penalty
+        with stage('tune_route_penalty', stops=len(D)) as record:
+            # the sweep compares A at the fixed distance weight B
+            penalty, _ = tune_route_penalty(np.asarray(D) * B, num_workers=1)
+            record['penalty'] = penalty
+    with stage('route_qubo', stops=len(D)) as record:
+        bqm = route_bqm(D, A if penalty is None else penalty, B)
+        record['variables'] = bqm.num_variables
+        record['couplings'] = bqm.num_interactions
+    return bqm
+
+
+def solve_route(D, method=None, num_reads=1, penalty=None, time_limit=None):
+    """
+    Solves the route through the cities of distance matrix D.
+    parameters:
+        method - 'anneal', 'heuristic' or 'warm'; route_method by default
+        penalty - constraint strength of the route QUBO, see build_route_qubo
+        time_limit - wall-clock budget in seconds: anneal in batches until it is used
+                     up instead of taking num_reads reads (see solve_route_anytime)
+    returns:
+        (list, float) - city index at every position of the route (-1 where the
+                        annealer left a position empty) and the QUBO energy of the
+                        route (None for the 'heuristic' method)
+    """
+    method = method or route_method
+    n = len(D)
+    if method == 'heuristic':
+        with stage('route_heuristic', stops=n):
+            return solve_tour(D).tolist(), None
+    if time_limit is not None:
+        route, energy, _ = solve_route_anytime(D, time_limit, method=method, penalty=penalty)
+        return route, energy
+
+    # Run the QUBO using qbsolv (classically solving)
+    #resp = QBSolv().sample(bqm)
+
+    # Use LeapHybridSampler() for faster QPU access
+    #VGG sampler = LeapHybridSampler()
+    import neal
+    bqm = build_route_qubo(D, penalty)
+    variables = list(range(n*n))
+    sampler = neal.SimulatedAnnealingSampler()
+    if method == 'anneal':
+        with stage('route_sample', reads=num_reads, variables=n*n):
+            resp = sampler.sample(bqm, num_reads=num_reads)
+        sample = [resp.first.sample[node] for node in variables]
+        return decode_route(sample, n), resp.first.energy
+
+    if method != 'warm':
+        raise ValueError(f"unknown route method {method!r}, expected 'anneal', 'heuristic' or 'warm'")
+
+    with stage('route_heuristic', stops=n):
+        tour = solve_tour(D)
+    initial_states = np.tile(tour_to_sample(tour), (num_reads, 1))
+    beta_range = _warm_beta_range(D)
+    with stage('route_sample', reads=num_reads, variables=n*n):
+        resp = sampler.sample(bqm, num_reads=num_reads, num_sweeps=warm_sweeps, beta_range=beta_range,
+                              initial_states=(initial_states, variables))
+
+    # keep the annealed route only if it is a shorter permutation than the seed
+    best_route, best_energy = tour.tolist(), bqm.energy((tour_to_sample(tour), variables))
+    best_mileage = route_mileage(D, best_route)
+    columns = [resp.variables.index(node) for node in variables]
+    for sample, energy in zip(resp.record.sample[:, columns], resp.record.energy):
+        route = decode_route(sample, n)
+        if sorted(route) == variables[:n] and route_mileage(D, route) < best_mileage:
+            best_route, best_energy, best_mileage = route, energy, route_mileage(D, route)
+    return best_route, best_energy
+
+
+def _warm_beta_range(D):
+    # start cold enough that constraint-breaking flips (~A) are rejected while
+    # flips that lengthen the tour by a typical edge still pass half of the time
+    D = np.asarray(D, dtype=float)
+    edges = D[D > 0]
+    return (math.log(2) / np.median(edges), math.log(100) / edges.min()) if len(edges) else None
+
+
+def solve_route_anytime(D, time_limit, method=None, penalty=None):
+    """
+    Solves the route through the cities of distance matrix D within a wall-clock
+    budget: route QUBO annealing batches are taken until time_limit seconds (counted
+    from the call, so building the QUBO uses part of them) have passed, keeping the best route that visits every city once (see anytime.anneal_until).
+    parameters:
+        method - 'anneal' (random starts) or 'warm' (every read starts from the
+                 local-search tour, which is kept if nothing better is found);
+                 route_method by default
+        penalty - constraint strength of the route QUBO, see build_route_qubo
+    returns:
+        (list, float, list) - route and energy as in solve_route and the convergence
+                              trace of anytime.anneal_until
+    """
+    from anytime import anneal_until, ising_beta_range
+    import neal
+
+    method = method or route_method
+    if method not in ('anneal', 'warm'):
+        raise ValueError(f"unsupported route method {method!r} for a time limit, expected 'anneal' or 'warm'")
+    # building the QUBO and the local-search tour counts against the budget
+    start = time.perf_counter()
+    n = len(D)
+    bqm = build_route_qubo(D, penalty)
+    variables = list(range(n*n))
+    sampler = neal.SimulatedAnnealingSampler()
+    columns = []
+
+    options, num_sweeps = {}, 1000
+    if method == 'warm':
+        with stage('route_heuristic', stops=n):
+            tour = solve_tour(D)
+        options['beta_range'] = _warm_beta_range(D)
+        num_sweeps = warm_sweeps
+    else:
+        options['beta_range'] = ising_beta_range(bqm)
+
+    def sample(num_reads, num_sweeps):
+        if method == 'warm':
+            options['initial_states'] = (np.tile(tour_to_sample(tour), (num_reads, 1)), variables)
+        resp = sampler.sample(bqm, num_reads=num_reads, num_sweeps=num_sweeps, **options)
+        if not columns:
+            columns.extend(resp.variables.index(node) for node in variables)
+        states = resp.record.sample[:, columns]
+        feasible = [sorted(decode_route(state, n)) == variables[:n] for state in states]
+        return states, resp.record.energy, feasible
+
+    with stage('route_anytime', stops=n, method=method, time_limit=time_limit) as record:
+        states, energies, feasible, trace = anneal_until(sample, time_limit, num_sweeps=num_sweeps,
+                                                         keep=1, start=start)
+        record['reads'] = trace[-1]['reads']
+
+    route, energy = decode_route(states[0], n), energies[0]
+    if method == 'warm':
+        tour_energy = bqm.energy((tour_to_sample(tour), variables))
+        if not feasible[0] or tour_energy <= energy:
+            route, energy = tour.tolist(), tour_energy
+    return route, energy, trace
+
+
+def plot_route(route, cities, filename):
+    """
+    Plots the route on a map of the USA.
+    parameters:
+        route - city names in the order they are visited
+        cities - dict of city name to (latitude, longitude), longitude positive west
+        filename - name of the file to save the map in
+    """
+    import rendering
+    rendering.render_routes([route], cities, [filename])
+
+
 def plot_map(route,cities, cities_lookup,filename):
+    """plot_route for a route given as indices into cities_lookup"""
+    plot_route([cities_lookup[v] for v in route], cities, filename)
 
-    data_list=[[key, cities[key][0], - cities[key][1]] for key in cities.keys()]
-    df = pd.DataFrame(data_list)
-    data_list=[[cities_lookup[route[i]], cities[cities_lookup[route[i]]][0], - cities[cities_lookup[route[i]]][1]] for i in range(cd)]
-    df_visit = pd.DataFrame(data_list)
-    
-    #City,Latitude,Longitude
-    df.columns=['City','Latitude','Longitude']
-    df_visit.columns = ['City','Latitude','Longitude']
-    df_start = df_visit[df_visit['City'].isin([cities_lookup[route[0]]])]  
-    df_end = df_visit[df_visit['City'].isin([cities_lookup[route[0]]])]
-
-    gdf_all = geopandas.GeoDataFrame(
-        df, geometry=geopandas.points_from_xy(df.Longitude, df.Latitude))
-    gdf_visit = geopandas.GeoDataFrame(
-        df_visit, geometry=geopandas.points_from_xy(df_visit.Longitude, df_visit.Latitude))
-    gdf_start = geopandas.GeoDataFrame(
-        df_start, geometry=geopandas.points_from_xy(df_start.Longitude, df_start.Latitude))
-    gdf_end = geopandas.GeoDataFrame(
-        df_end, geometry=geopandas.points_from_xy(df_end.Longitude, df_end.Latitude))
-
-    world = geopandas.read_file(
-            geopandas.datasets.get_path('naturalearth_lowres'))
-
-    # Restrict to the USA only.
-    ax = world[world.name == 'United States of America'].plot(
-        color='white', edgecolor='black')
-
-    # plot the ``GeoDataFrame``
-    x_values=gdf_visit.values.T[2]
-    y_values=gdf_visit.values.T[1]
-    plt.plot(x_values,y_values)
-
-    gdf_all.plot(ax=ax, color='gray')
-    gdf_visit.plot(ax=ax, color='blue')
-    gdf_start.plot(ax=ax, color='green')
-    gdf_end.plot(ax=ax, color='red')
-
-    ax.set_xlim(xmin=-130, xmax=-65)
-    ax.set_ylim(ymin=20, ymax=55)
-    ax.set_yticks([])
-    ax.set_xticks([])
-    ax.set_aspect(1.2)
-
-    ax.legend(['Path','All cites', 'To Visit','Start','End'])
-
-    plt.savefig(filename)
-    #plt.show()
 
 cities = {
         'New York City': (40.72, 74.00),
@@ -244,136 +369,198 @@ cities_lookup = {
         20: 'Columbus',
     }
 
-cities_index = {
-        (40.72, 74.00) : 0,
-        (34.05, 118.25) : 1,
-        (41.88, 87.63) : 2,
-        (29.77, 95.38) : 3,
-        (33.45, 112.07): 4,
-        (39.95, 75.17): 5,
-        (29.53, 98.47): 6,
-        (32.78, 96.80): 7,
-        (32.78, 117.15): 8,
-        (37.30, 121.87): 9,
-        (42.33, 83.05): 10,
-        (37.78, 122.42): 11,
-        (30.32, 81.70): 12,
-        (39.78, 86.15): 13,
-        (30.27, 97.77): 14,
-        (39.98, 82.98): 15,
-        (32.75, 97.33): 16,
-        (35.23, 80.85): 17,
-        (35.12, 89.97): 18,
-        (39.28, 76.62): 19,
-        (39.96, 82.99): 20
-    }
 
-    # initial state, a randomly-ordered itinerary
-init_state = list(cities.values())
-random.shuffle(init_state)
-
-#print("Init State")
-#print(init_state)
-
-clustered_filename = "twentyone_cities_clustered.png"
-citygroups = cluster_points(init_state, clustered_filename)
-citygroup_count = 0
-
-for color, points in citygroups.items():
-        
-        # Ignore items that do not contain any coordinates
-        if not points:
-            continue
-
-        pcount = 0
-
-        points_array = np.array(points)
-        points_len = len(points_array)
-       
-
-        D = [[0 for z in range(Total_Number_Cities)] for y in range(Total_Number_Cities)]
-
-        for i in range(len(points_array)):
-            if(i+1 < len(points_array)):
-                x = points_array[i]
-                y = points_array[i+1]
-                citya = tuple(x.tolist())
-                cityb = tuple(y.tolist())
-                namea = cities_index[citya]
-                nameb = cities_index[cityb]
-                pcount = pcount + 1
-                D[namea][nameb] = D[nameb][namea] = lat_lon_distance(citya,cityb)
-
-        # Function to compute index in QUBO for variable 
-        def return_QUBO_Index(a, b):
-            return (a)*cd+(b)
-
-        ## Creating the QUBO
-        # Start with an empty QUBO
-        Q = {}
-        for i in range(cd*cd):
-            for j in range(cd*cd):
-                Q.update({(i,j): 0})
-
-        # Constraint that each row has exactly one 1, constant = N*A
-        for v in range(cd):
-            for j in range(cd):
-                Q[(return_QUBO_Index(v,j), return_QUBO_Index(v,j))] += -1*A
-                for k in range(j+1, cd):
-                    Q[(return_QUBO_Index(v,j), return_QUBO_Index(v,k))] += 2*A
-                    Q[(return_QUBO_Index(v,k), return_QUBO_Index(v,j))] += 2*A
-
-        # Constraint that each col has exactly one 1
-        for j in range(cd):
-            for v in range(cd):
-                Q[(return_QUBO_Index(v,j), return_QUBO_Index(v,j))] += -1*A
-                for w in range(v+1,cd):
-                    Q[(return_QUBO_Index(v,j), return_QUBO_Index(w,j))] += 2*A
-                    Q[(return_QUBO_Index(w,j), return_QUBO_Index(v,j))] += 2*A
-
-        # Objective that minimizes distance
-        for u in range(cd):
-            for v in range(cd):
-                if u!=v:
-                    for j in range(cd):
-                        Q[(return_QUBO_Index(u,j), return_QUBO_Index(v,(j+1)%cd))] += B*D[u][v]
-
-        # Run the QUBO using qbsolv (classically solving)
-        #resp = QBSolv().sample_qubo(Q)
-
-        # Use LeapHybridSampler() for faster QPU access
-        #VGG sampler = LeapHybridSampler()
-        sampler = neal.SimulatedAnnealingSampler()
-        resp = sampler.sample_qubo(Q)
-
-        # First solution is the lowest energy solution found
-        sample = next(iter(resp))
+def load_cities(path):
+    """
+    cities of a City,Latitude,Longitude csv file (see geocoding), longitude positive west
+    returns:
+        (dict) - city name to (latitude, longitude), like cities
+    """
+    import pandas as pd
+    table = pd.read_csv(path, dtype={'City': str})
+    return dict(zip(table['City'], zip(table['Latitude'].tolist(), table['Longitude'].tolist())))
+
+
+def route_group(points, method=None, num_reads=1, penalty=None, time_limit=None):
+    """
+    Solves the route through one delivery group.
+    parameters:
+        points - list of (latitude, longitude) tuples of the group
+        method, num_reads, penalty, time_limit - see solve_route
+    returns:
+        (list, float, float) - indices into points in visiting order, mileage and energy
+    """
+    # distances between the cities of this group only; the route below
+    # indexes them by position in points
+    D = distance_matrix(points)
+
+    # Route for the best solution found, as indices into points
+    route, energy = solve_route(D, method=method, num_reads=num_reads, penalty=penalty,
+                                time_limit=time_limit)
+
+    # Compute total mileage
+    mileage = route_mileage(D, route)
+    return [v for v in route if v >= 0], mileage, energy
+
+
+def iter_routes(citygroups, method=None, num_reads=1, num_workers=1, penalty=None,
+                time_limit=None):
+    """
+    Solves one route per delivery group, in num_workers processes.
+    parameters:
+        citygroups - dict of group to list of (latitude, longitude) tuples, as returned by cluster
+        method, num_reads, penalty, time_limit - see solve_route; time_limit is per route
+        num_workers - number of processes the groups are spread over; 1 solves them
+                      one after another in this process, None uses all cores
+    yields:
+        (str, list, float, float) - group, route (indices into its points), mileage and
+                                    energy, in the order the routes are finished
+    """
+    # Ignore items that do not contain any coordinates
+    groups = [(color, points) for color, points in citygroups.items() if points]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(groups)))
+
+    if num_workers == 1:
+        for color, points in groups:
+            with stage('route', group=color, stops=len(points), method=method or route_method):
+                yield (color,) + route_group(points, method, num_reads, penalty, time_limit)
+        return
+
+    # the groups are independent: solve them all at once and hand out each
+    # route as soon as it is done
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(route_group, points, method, num_reads, penalty, time_limit): color
+                   for color, points in groups}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+
+
+def route_deliveries(citygroups, cities, method=None, num_reads=1, plot=True,
+                     filename_prefix="Hackathon_Route_Map_", background=False, num_workers=1,
+                     penalty=None, time_limit=None):
+    """
+    Solves one route per delivery group.
+    parameters:
+        citygroups - dict of group to list of (latitude, longitude) tuples, as returned by cluster
+        cities - dict of city name to (latitude, longitude)
+        method, num_reads, penalty, time_limit - see iter_routes
+        plot - save a map of every route as filename_prefix + group number
+        background - render the maps in a background process, each one as soon as its
+                     route is solved; rendering.wait_for_renders waits for them.
+                     Otherwise all maps are rendered after the last route is solved
+        num_workers - see iter_routes
+    returns:
+        (list) - one dictionary per group with the route (city names), mileage and
+                 energy, in the order of citygroups
+    """
+    names = {coordinates: name for name, coordinates in cities.items()}
+    numbers = {color: k for k, color in enumerate(color for color, points in citygroups.items() if points)}
+
+    if plot:
+        import rendering
+
+    results = {}
+    with stage('route_deliveries', groups=len(numbers), workers=num_workers):
+        for color, route, mileage, energy in iter_routes(citygroups, method, num_reads, num_workers,
+                                                         penalty, time_limit):
+            points = citygroups[color]
+            route = [names[tuple(points[v])] for v in route]
+            results[color] = {'group': color, 'route': route, 'mileage': mileage, 'energy': energy}
+            if plot and background:
+                rendering.render_async([route], cities, [filename_prefix + str(numbers[color])])
+    results = [results[color] for color in numbers]
+
+    if plot and results and not background:
+        routes = [result['route'] for result in results]
+        filenames = [filename_prefix + str(k) for k in range(len(results))]
+        with stage('plot_routes', routes=len(routes)):
+            rendering.render_routes(routes, cities, filenames)
+
+    return results
+
+
+def _penalty(text):
+    return text if text == 'auto' else float(text)
+
+
+def main():
+    """ CLI
+    """
+    description = "Cluster the cities into delivery groups and find the shortest route for each group"
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--qpu', action='store_true',
+                        help="Cluster on the D-Wave QPU instead of the local simulated annealer")
+    parser.add_argument('--inspect', action='store_true',
+                        help="Show the clustering problem in dwave.inspector")
+    parser.add_argument('--cluster-reads', type=int, default=1000,
+                        help="Number of samples for the clustering problem")
+    parser.add_argument('--route-method', choices=['anneal', 'heuristic', 'warm'], default=route_method,
+                        help="Route solver, see solve_route")
+    parser.add_argument('--num-reads', '-n', type=int, default=1,
+                        help="Number of samples per route")
+    parser.add_argument('--time-limit', type=float,
+                        help="Seconds per route: anneal in batches until they are used up "
+                             "instead of taking --num-reads reads")
+    parser.add_argument('--no-plot', action='store_true',
+                        help="Skip the clustering plot and the route maps")
+    parser.add_argument('--seed', type=int,
+                        help="Seed for the random order of the cities")
+    parser.add_argument('--trace',
+                        help="Record the time, CPU time and memory of every stage to this file; "
+                             "Chrome trace format for *.json, JSON lines otherwise")
+    parser.add_argument('--route-penalty', type=_penalty,
+                        help=f"Constraint strength A of the route QUBO (default {A}), or 'auto' to "
+                             "pick it per route by a short sweep of candidates")
+    parser.add_argument('--vehicles', type=int, default=Number_Deliveries,
+                        help="Number of delivery groups, one route each")
+    parser.add_argument('--cluster-method', choices=['anneal', 'kmeans', 'hierarchical'],
+                        default='anneal',
+                        help="Clustering: the QUBO of all cities, classical k-means for large "
+                             "networks, or k-means regions with annealed leaves")
+    parser.add_argument('--vehicle-capacity', type=int,
+                        help="Largest number of cities per delivery group (--cluster-method kmeans)")
+    parser.add_argument('--balance', type=float,
+                        help="Weight of equal group sizes in the clustering (default 0.3); "
+                             "with 0 most cities end up in two groups")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help="Number of processes the routes are solved in; 0 uses all cores")
+    parser.add_argument('--cities',
+                        help="City,Latitude,Longitude csv (as written by geocoding.py) to route "
+                             "instead of the built-in cities")
+
+    args = parser.parse_args()
+    route_cities = load_cities(args.cities) if args.cities else cities
 
+    # initial state, a randomly-ordered itinerary
+    random.seed(args.seed)
+    init_state = list(route_cities.values())
+    random.shuffle(init_state)
+
+    clustered_filename = None if args.no_plot else "twentyone_cities_clustered.png"
+    with tracing(args.trace):
+        citygroups = cluster_points(init_state, clustered_filename, use_qpu=args.qpu,
+                                    num_reads=args.cluster_reads, inspect=args.inspect,
+                                    num_groups=args.vehicles, balance=args.balance,
+                                    method=args.cluster_method, capacity=args.vehicle_capacity)
+
+        results = route_deliveries(citygroups, route_cities, method=args.route_method,
+                                   num_reads=args.num_reads, plot=not args.no_plot,
+                                   background=True, num_workers=args.workers or None,
+                                   penalty=args.route_penalty, time_limit=args.time_limit)
+    for result in results:
         # Display energy for best solution found
-        print('Energy: ', next(iter(resp.data())).energy)
-
-        # Print route for solution found
-        route = [-1]*cd
-        for node in sample:
-            if sample[node]>0:
-                j = node%cd
-                v = (node-j)/cd
-                route[j] = int(v)
-
-        # Compute and display total mileage
-        mileage = 0
-        for i in range(cd):
-            mileage+=D[route[i]][route[(i+1)%cd]]
-
-        print('Mileage: ', mileage)
-
-        filename = "Hackathon_Route_Map_" + str(citygroup_count)
-        citygroup_count = citygroup_count + 1
-        plot_map(route,cities, cities_lookup, filename)
+        if result['energy'] is not None:
+            print('Energy: ', result['energy'])
+        print('Mileage: ', result['mileage'])
+        print('Route: ', ' -> '.join(result['route']))
 
-        # Print route:
+    if not args.no_plot:
+        import rendering
+        rendering.wait_for_renders()
 
-        #for i in range(Total_Number_Cities):
-            #print(cities_lookup[route[i]]+'\n')
 
-        
+if __name__ == '__main__':
+    main()
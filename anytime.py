@@ -0,0 +1,124 @@
+#anytime annealing under a wall-clock budget
+
+#anneal_until keeps taking batches of annealing reads until the time limit is used
+#up and keeps the best states seen so far, feasible ones first. The budget starts when
+#the caller says so, before the model is built, so that building counts against it.
+#The first batch is a single read of MIN_SWEEPS sweeps; it measures the time per sweep
+#without spending a whole read of the full schedule on a large problem. Every later
+#batch anneals with the asked for sweeps per read, halved while one read would take
+#more than SWEEP_FRACTION of the budget, and is sized to use at most BATCH_FRACTION of
+#the remaining time, so the loop ends at the deadline instead of overrunning it by a
+#whole batch. Every batch adds an entry to the convergence trace.
+#
+#neal recomputes its default beta range in pure Python on every call, which takes
+#longer than the sweeps themselves for a short batch of a dense problem (0.7 s for the
+#half million couplings of 1000 knapsack nodes); ising_beta_range computes the same
+#range once with numpy so it can be passed to every batch.
+
+from math import log
+import time
+
+import numpy as np
+
+from instrumentation import stage
+
+# share of the remaining time a batch may use
+BATCH_FRACTION = 0.5
+
+# largest share of the budget a single read may take before the sweeps are halved
+SWEEP_FRACTION = 0.1
+
+# fewest sweeps per read
+MIN_SWEEPS = 10
+
+
+def ising_beta_range(bqm, excitation_rate=0.01):
+    """
+    the default (hot, cold) beta range of neal.SimulatedAnnealingSampler for bqm: a flip
+    against the largest effective field is accepted with probability 50% at the start,
+    and the smallest gaps are excited with probability excitation_rate at the end
+    """
+    h, (row, col, J), _ = bqm.change_vartype('SPIN', inplace=False).to_numpy_vectors()
+    h, J = np.abs(h), np.abs(J)
+    n = len(h)
+
+    field = h + np.bincount(row, J, n) + np.bincount(col, J, n)
+    hot = log(2) / (2 * float(field.max())) if n and field.max() > 0 else 1.0
+
+    # smallest nonzero bias of every variable
+    smallest = np.where(h > 0, h, np.inf)
+    nonzero = J > 0
+    np.minimum.at(smallest, row[nonzero], J[nonzero])
+    np.minimum.at(smallest, col[nonzero], J[nonzero])
+    smallest = smallest[np.isfinite(smallest)]
+    if not len(smallest):
+        # all biases are zero, the range neal falls back to
+        return 0.1, 1.0
+    gap = smallest.min()
+    cold = log(np.count_nonzero(smallest == gap) / excitation_rate) / (2 * gap)
+    return hot, float(cold)
+
+
+def anneal_until(sample, time_limit, num_sweeps=1000, keep=10, max_batch_reads=1000, start=None):
+    """
+    anneal in batches until time_limit seconds have passed
+    parameters:
+        sample - function(num_reads, num_sweeps) returning the states (reads x variables),
+                 energies and feasibility (bool per read) of one batch
+        time_limit - wall-clock budget in seconds
+        num_sweeps - sweeps per read, fewer if a read would take too long
+        keep - number of best states returned
+        start - time.perf_counter() at which the budget started, e.g. before the model
+                was built; now by default
+    returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray, list) - the kept states, their
+            energies and feasibility, best (feasible, then lowest energy) first, and the
+            convergence trace: one dict per batch with the elapsed time, the reads so
+            far, the sweeps per read, the lowest energy of the batch and the best
+            feasible energy so far (None while there is none)
+    """
+    if start is None:
+        start = time.perf_counter()
+    deadline = start + time_limit
+    states = energies = feasible = None
+    trace = []
+    reads = 0
+    batch, sweeps = 1, min(num_sweeps, MIN_SWEEPS)
+    best = None
+
+    while True:
+        batch_start = time.perf_counter()
+        with stage('anytime_batch', reads=batch, sweeps=sweeps):
+            batch_states, batch_energies, batch_feasible = sample(batch, sweeps)
+        now = time.perf_counter()
+        per_sweep = (now - batch_start) / (batch * sweeps)
+        reads += batch
+
+        batch_states = np.asarray(batch_states)
+        batch_energies = np.asarray(batch_energies, dtype=float)
+        batch_feasible = np.asarray(batch_feasible, dtype=bool)
+        if states is None:
+            states, energies, feasible = batch_states, batch_energies, batch_feasible
+        else:
+            states = np.concatenate((states, batch_states))
+            energies = np.concatenate((energies, batch_energies))
+            feasible = np.concatenate((feasible, batch_feasible))
+        # feasible states first, each by energy
+        order = np.lexsort((energies, ~feasible))[:keep]
+        states, energies, feasible = states[order], energies[order], feasible[order]
+
+        if feasible[0] and (best is None or energies[0] < best):
+            best = float(energies[0])
+        trace.append({'time': now - start, 'reads': reads, 'sweeps': sweeps,
+                      'energy': float(batch_energies.min()), 'best_feasible': best})
+
+        remaining = deadline - now
+        sweeps = num_sweeps
+        while sweeps > MIN_SWEEPS and sweeps * per_sweep > SWEEP_FRACTION * time_limit:
+            sweeps = max(MIN_SWEEPS, sweeps // 2)
+        per_read = sweeps * per_sweep
+        if remaining < per_read:
+            break
+        batch = int(min(max_batch_reads, max(1, BATCH_FRACTION * remaining / per_read)))
+
+    return states, energies, feasible, trace
@@ -0,0 +1 @@
+#benchmarks and synthetic data generator, see benchmarks/run.py
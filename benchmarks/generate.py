@@ -0,0 +1,101 @@
+#synthetic input data for the benchmarks
+
+#hospital files follow the H_Beds.csv schema ("City","State","Total","Available",
+#"ICUs","Available_ICU") with bed counts drawn from log-normal distributions
+#fitted to that file; city coordinate sets are (latitude, longitude) pairs in the
+#continental US with longitudes positive west, as in Optimized_Routes.cities.
+#Everything is seeded, so a size and seed always give the same instance.
+#
+#python -m benchmarks.generate hospitals 5000 H_Beds_5000.csv
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ingest import node_status_value
+
+STATES = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA', 'HI', 'IA',
+          'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS',
+          'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR', 'PA',
+          'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY']
+
+# continental US bounding box
+LATITUDE_RANGE = (25.0, 49.0)
+LONGITUDE_RANGE = (67.0, 124.0)
+
+
+def hospital_data(n, seed=0):
+    """
+    n rows in the H_Beds.csv schema
+    returns:
+        (pandas.DataFrame) - columns City, State, Total, Available, ICUs, Available_ICU
+    """
+    rng = np.random.default_rng(seed)
+
+    total = np.maximum(rng.lognormal(7.4, 0.75, n), 200).astype(int)
+    available = (total * rng.uniform(0.2, 0.55, n)).astype(int)
+    icus = np.maximum((total * rng.uniform(0.05, 0.2, n)).astype(int), 10)
+    available_icu = (icus * rng.uniform(0.2, 0.6, n)).astype(int)
+
+    return pd.DataFrame({
+        'City': ['City {}'.format(k) for k in range(n)],
+        # leading space as in H_Beds.csv
+        'State': [' ' + state for state in rng.choice(STATES, n)],
+        'Total': total,
+        'Available': available,
+        'ICUs': icus,
+        'Available_ICU': available_icu,
+    })
+
+
+def write_hospital_csv(path, n, seed=0):
+    """write hospital_data(n, seed) to path with the quoting of H_Beds.csv"""
+    hospital_data(n, seed).to_csv(path, index=False, quoting=2)  # csv.QUOTE_NONNUMERIC
+    return path
+
+
+def hospital_capacity(df, fraction=0.25):
+    """total capacity covering about fraction of the status of ingest.node_status_value"""
+    status, _ = node_status_value(df['Total'], df['Available'], df['ICUs'])
+    return int(status.sum() * fraction)
+
+
+def city_coordinates(n, seed=0):
+    """
+    n distinct cities
+    returns:
+        (dict) - city name to (latitude, longitude), rounded to two decimals
+    """
+    rng = np.random.default_rng(seed)
+    # dict keeps the draw order while dropping repeated coordinates
+    coordinates = {}
+    while len(coordinates) < n:
+        latitude = rng.uniform(*LATITUDE_RANGE, n).round(2)
+        longitude = rng.uniform(*LONGITUDE_RANGE, n).round(2)
+        coordinates.update(dict.fromkeys(zip(latitude.tolist(), longitude.tolist())))
+
+    return {'City {}'.format(k): point for k, point in zip(range(n), coordinates)}
+
+
+def main():
+    """ CLI
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark inputs")
+    parser.add_argument('kind', choices=['hospitals', 'cities'])
+    parser.add_argument('size', type=int, help="Number of rows or cities")
+    parser.add_argument('output', help="Path of the csv file to write")
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.kind == 'hospitals':
+        write_hospital_csv(args.output, args.size, args.seed)
+    else:
+        cities = city_coordinates(args.size, args.seed)
+        pd.DataFrame([(name, lat, lon) for name, (lat, lon) in cities.items()],
+                     columns=['City', 'Latitude', 'Longitude']).to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#benchmark runner
+
+#times every benchmark of benchmarks.suite at each of its sizes and stores the
+#results as benchmarks/results/<commit>.json, so runs on different commits can be
+#compared. A benchmark is repeated until it has run `repeat` times or for about
+#min_time seconds; the minimum and the median are recorded.
+#
+#python -m benchmarks.run                    all benchmarks, all sizes
+#python -m benchmarks.run --quick -k route   smallest sizes, benchmarks matching "route"
+#python -m benchmarks.run --compare 705fee2  compare this commit with a stored run
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# slowdowns beyond this ratio are reported as regressions
+REGRESSION_RATIO = 1.2
+
+
+def git_commit():
+    """short hash of HEAD, with a '+dirty' suffix when the tree has uncommitted changes"""
+    def git(*args):
+        return subprocess.run(['git'] + list(args), capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        commit += '+dirty'
+    return commit
+
+
+def time_callable(function, repeat=5, min_time=1.0):
+    """
+    run function up to repeat times, stopping early once min_time seconds are spent
+    returns:
+        (dict) - min, median and number of runs (seconds)
+    """
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat:
+        t = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t)
+        if time.perf_counter() - start > min_time:
+            break
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def run(pattern=None, quick=False, repeat=5, min_time=1.0, verbose=True):
+    """
+    run the matching benchmarks
+    parameters:
+        pattern - only run benchmarks whose name contains pattern
+        quick - only the quick sizes of every benchmark
+    returns:
+        (dict) - benchmark name to size (as a string) to timing
+    """
+    from benchmarks.suite import BENCHMARKS
+
+    results = {}
+    for name, (setup, params, quick_params) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        for size in (quick_params if quick else params):
+            timing = time_callable(setup(size), repeat=repeat, min_time=min_time)
+            results.setdefault(name, {})[str(size)] = timing
+            if verbose:
+                print(f"{name:36s} {size:>6} {timing['min']:10.4f} s  "
+                      f"(median {timing['median']:.4f} s, {timing['runs']} runs)")
+    return results
+
+
+def save(results, commit=None):
+    """store results under benchmarks/results/<commit>.json, merged with earlier runs of that commit"""
+    commit = commit or git_commit()
+    path = os.path.join(RESULTS_DIR, commit + '.json')
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    stored = load(commit) if os.path.exists(path) else {'benchmarks': {}}
+    for name, sizes in results.items():
+        stored['benchmarks'].setdefault(name, {}).update(sizes)
+    stored.update({
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'processor': platform.processor(), 'cpus': os.cpu_count()},
+    })
+
+    with open(path, 'w') as f:
+        json.dump(stored, f, indent=1, sort_keys=True)
+    return path
+
+
+def load(commit):
+    """stored results of commit"""
+    with open(os.path.join(RESULTS_DIR, commit + '.json')) as f:
+        return json.load(f)
+
+
+def compare(baseline, current):
+    """
+    print the ratio current/baseline of the minimum time of every benchmark run in both
+    returns:
+        (list) - (name, size, ratio) of the regressions
+    """
+    regressions = []
+    print(f"{'benchmark':36s} {'size':>6} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, sizes in sorted(current['benchmarks'].items()):
+        for size, timing in sorted(sizes.items(), key=lambda item: int(item[0])):
+            before = baseline['benchmarks'].get(name, {}).get(size)
+            if before is None:
+                continue
+            ratio = timing['min'] / before['min']
+            flag = ''
+            if ratio > REGRESSION_RATIO:
+                flag = '  REGRESSION'
+                regressions.append((name, size, ratio))
+            elif ratio < 1 / REGRESSION_RATIO:
+                flag = '  faster'
+            print(f"{name:36s} {size:>6} {before['min']:10.4f} {timing['min']:10.4f} "
+                  f"{ratio:7.2f}{flag}")
+    return regressions
+
+
+def main():
+    """ CLI
+    """
+    parser = argparse.ArgumentParser(description="Run the knapsack and routing benchmarks")
+    parser.add_argument('-k', dest='pattern', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--quick', action='store_true', help="Only the smallest sizes")
+    parser.add_argument('--repeat', type=int, default=5, help="Largest number of runs per size")
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help="Stop repeating a size after this many seconds")
+    parser.add_argument('--compare', metavar='COMMIT',
+                        help="Compare with the stored results of COMMIT instead of only saving")
+    parser.add_argument('--no-save', action='store_true', help="Do not store the results")
+
+    args = parser.parse_args()
+
+    results = run(args.pattern, quick=args.quick, repeat=args.repeat, min_time=args.min_time)
+    current = {'benchmarks': results}
+    if not args.no_save:
+        path = save(results)
+        print(f"\nresults stored in {path}")
+
+    if args.compare:
+        print()
+        regressions = compare(load(args.compare), current)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} regression(s) beyond {REGRESSION_RATIO}x")
+
+
+if __name__ == '__main__':
+    main()
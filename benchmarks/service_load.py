@@ -0,0 +1,191 @@
+#load test of the solver service (service.py)
+
+#concurrency clients on keep-alive connections send requests back to back: a mix
+#of /solve_nodes and /routes problems drawn from `distinct` synthetic instances
+#(see benchmarks.generate), so identical requests overlap and are coalesced, and
+#repeated knapsack problems hit the solution cache of the workers. The client side
+#latency of every request is recorded; for /routes also the time to the first route
+#line of the stream. Without --url a service is started in this process.
+#
+#python -m benchmarks.service_load --requests 200 --concurrency 16
+#python -m benchmarks.service_load --url http://127.0.0.1:8080 --routes 0
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from ingest import node_status_value
+
+from benchmarks.generate import hospital_data, hospital_capacity, city_coordinates
+
+
+def knapsack_requests(distinct, n, num_reads=10):
+    """request bodies of /solve_nodes for distinct hospital instances of n nodes"""
+    requests = []
+    for seed in range(distinct):
+        df = hospital_data(n, seed)
+        status, values = node_status_value(df['Total'], df['Available'], df['ICUs'])
+        requests.append({'nodes': list(df['City']), 'values': values.tolist(),
+                         'status': status.tolist(), 'total_capacity': hospital_capacity(df),
+                         'value_r': 0.01, 'weight_r': 0.02, 'num_reads': num_reads})
+    return requests
+
+
+def route_requests(distinct, n, vehicles=3):
+    """request bodies of /routes for distinct city sets of n cities"""
+    return [{'points': [list(point) for point in city_coordinates(n, seed).values()],
+             'vehicles': vehicles, 'cluster_method': 'kmeans', 'method': 'warm'}
+            for seed in range(distinct)]
+
+
+async def _request(reader, writer, host, method, path, payload=None):
+    """
+    send one request on a keep-alive connection
+    returns:
+        (int, list, float) - status, the response as a list of JSON values (one per
+                             line of a stream) and the seconds to its first line
+    """
+    start = time.perf_counter()
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write((f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        lines, first = [], None
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            data = await reader.readexactly(size + 2)
+            if not size:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            lines.append(json.loads(data))
+        return status, lines, first
+    data = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, [json.loads(data)] if data else [], time.perf_counter() - start
+
+
+async def _client(url, queue, results):
+    address = urlsplit(url)
+    reader, writer = await asyncio.open_connection(address.hostname, address.port)
+    try:
+        while True:
+            try:
+                path, payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            status, lines, first = await _request(reader, writer, address.netloc, 'POST', path,
+                                                  payload)
+            results.append({'path': path, 'status': status, 'latency': time.perf_counter() - start,
+                            'first': first})
+    finally:
+        writer.close()
+
+
+def summary(results, elapsed):
+    """count, errors, p50/p99 latency and throughput per endpoint and over all requests"""
+    report = {}
+    for path in sorted({result['path'] for result in results}) + ['all']:
+        selected = [result for result in results if path in ('all', result['path'])]
+        latency = np.array([result['latency'] for result in selected])
+        first = np.array([result['first'] for result in selected])
+        report[path] = {
+            'requests': len(selected),
+            'errors': sum(result['status'] != 200 for result in selected),
+            'p50': float(np.percentile(latency, 50)),
+            'p99': float(np.percentile(latency, 99)),
+            'first_p50': float(np.percentile(first, 50)),
+            'throughput': len(selected) / elapsed,
+        }
+    return report
+
+
+async def load_test(url, requests, concurrency=16):
+    """
+    send requests, (path, payload) pairs, over concurrency connections
+    returns:
+        (dict, float) - summary of the latencies and the wall-clock seconds
+    """
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(url, queue, results) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summary(results, elapsed), elapsed
+
+
+async def _run(args):
+    rng = random.Random(args.seed)
+    problems = ([('/solve_nodes', body) for body in knapsack_requests(args.distinct, args.nodes)]
+                + [('/routes', body) for body in route_requests(args.distinct, args.cities)])
+    weights = [1 - args.routes] * args.distinct + [args.routes] * args.distinct
+    requests = rng.choices(problems, weights, k=args.requests)
+
+    service = None
+    url = args.url
+    if url is None:
+        from service import SolverService
+        service = SolverService(args.workers or None)
+        start = time.perf_counter()
+        host, port = await service.start(port=0)
+        url = f'http://{host}:{port}'
+        print(f"service started with {service.num_workers} warm workers in "
+              f"{time.perf_counter() - start:.2f} s")
+
+    try:
+        report, elapsed = await load_test(url, requests, args.concurrency)
+    finally:
+        if service is not None:
+            coalesced = service.stats()['coalesced']
+            await service.close()
+
+    print(f"{len(requests)} requests, {args.concurrency} connections, {elapsed:.2f} s")
+    print(f"{'endpoint':14s} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'first p50':>9} {'req/s':>8}")
+    for path, row in report.items():
+        print(f"{path:14s} {row['requests']:8d} {row['errors']:6d} {1000 * row['p50']:9.1f} "
+              f"{1000 * row['p99']:9.1f} {1000 * row['first_p50']:9.1f} {row['throughput']:8.2f}")
+    if service is not None:
+        print(f"coalesced requests: {coalesced}")
+    return report
+
+
+def main():
+    """ CLI
+    """
+    parser = argparse.ArgumentParser(description="Load test of the solver service")
+    parser.add_argument('--url', help="Running service to test; by default one is started here")
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help="Solver processes of the started service (0 for all cores)")
+    parser.add_argument('--requests', '-n', type=int, default=200, help="Number of requests")
+    parser.add_argument('--concurrency', '-c', type=int, default=16, help="Number of connections")
+    parser.add_argument('--distinct', type=int, default=8,
+                        help="Number of distinct problems of each kind")
+    parser.add_argument('--routes', type=float, default=0.25, help="Share of /routes requests")
+    parser.add_argument('--nodes', type=int, default=100, help="Nodes per knapsack problem")
+    parser.add_argument('--cities', type=int, default=21, help="Cities per routing problem")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the request mix")
+
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#benchmarks of the knapsack and routing hot paths
+
+#every benchmark is a setup function that builds its input for one size and
+#returns the zero-argument callable to time; setup time is not measured.
+#Sizes are the params of the @benchmark decorator, the quick sizes are used by
+#python -m benchmarks.run --quick.
+
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import dimod
+import neal
+
+import knapsack
+import Optimized_Routes
+from distances import distance_matrix, clear_cache
+from route_qubo import route_bqm
+from clustering import cluster_bqm, kmeans
+from ingest import node_status_value
+
+from benchmarks.generate import (hospital_data, hospital_capacity, write_hospital_csv,
+                                 city_coordinates)
+
+BENCHMARKS = {}
+
+
+def benchmark(params, quick=None):
+    """register the decorated setup function under its name"""
+    def register(setup):
+        BENCHMARKS[setup.__name__] = (setup, list(params), list(quick or params[:1]))
+        return setup
+    return register
+
+
+def _knapsack_inputs(n, seed=0):
+    df = hospital_data(n, seed)
+    status, values = node_status_value(df['Total'], df['Available'], df['ICUs'])
+    return list(df['City']), values.tolist(), status.tolist(), hospital_capacity(df)
+
+
+@benchmark(params=[100, 300, 1000], quick=[100])
+def knapsack_bqm_build(n):
+    nodes, values, status, capacity = _knapsack_inputs(n)
+    return lambda: knapsack.knapsack_bqm(nodes, values, status, capacity,
+                                         value_r=0.01, weight_r=0.02)
+
+
+@benchmark(params=[50, 100, 200], quick=[50])
+def solve_nodes_neal(n):
+    nodes, values, status, capacity = _knapsack_inputs(n)
+    return lambda: knapsack.solve_nodes(nodes, values, status, capacity, value_r=0.01,
+                                        weight_r=0.02, num_reads=10, cache=False)
+
+
+@benchmark(params=[100, 1000, 5000], quick=[100])
+def solve_nodes_implicit(n):
+    nodes, values, status, capacity = _knapsack_inputs(n)
+    return lambda: knapsack.solve_nodes(nodes, values, status, capacity, value_r=0.01,
+                                        weight_r=0.02, num_reads=1, backend='implicit',
+                                        cache=False)
+
+
+@benchmark(params=[300, 3000], quick=[300])
+def solve_nodes_using_csv_decomposed(n):
+    # the callable owns the directory, which is removed with it (or at exit)
+    directory = tempfile.TemporaryDirectory()
+    write_hospital_csv(os.path.join(directory.name, 'H_Beds_{}.csv'.format(n)), n)
+    capacity = hospital_capacity(hospital_data(n))
+
+    def run():
+        path = os.path.join(directory.name, 'H_Beds_{}.csv'.format(n))
+        return knapsack.solve_nodes_using_csv(path, capacity, value_r=0.01, weight_r=0.02,
+                                              max_nodes=None, decompose='state', num_workers=1)
+    return run
+
+
+@benchmark(params=[100, 1000], quick=[100])
+def decode_sampleset(n, num_reads=100):
+    nodes, values, status, _ = _knapsack_inputs(n)
+    rng = np.random.default_rng(0)
+    samples = rng.integers(0, 2, size=(num_reads, n), dtype=np.int8)
+    sampleset = dimod.SampleSet.from_samples((samples, nodes), dimod.Vartype.BINARY,
+                                             rng.normal(size=num_reads))
+    return lambda: knapsack.decode_sampleset(sampleset, nodes, values, status, value_r=0.01)
+
+
+@benchmark(params=[1000, 5000], quick=[1000])
+def solution_set_pickle(n, num_reads=1000):
+    # the round trip of a solution set from a worker process
+    nodes, values, status, _ = _knapsack_inputs(n)
+    rng = np.random.default_rng(0)
+    samples = rng.integers(0, 2, size=(num_reads, n), dtype=np.int8)
+    sampleset = dimod.SampleSet.from_samples((samples, nodes), dimod.Vartype.BINARY,
+                                             rng.normal(size=num_reads))
+    solution_set = knapsack.decode_sampleset(sampleset, nodes, values, status, value_r=0.01)
+    return lambda: pickle.loads(pickle.dumps(solution_set))
+
+
+@benchmark(params=[21, 50], quick=[21])
+def cluster_points(n):
+    points = list(city_coordinates(n).values())
+    # cluster imports dimod and neal on first use, keep that out of the timing
+    import neal
+    return lambda: Optimized_Routes.cluster_points(points, None, num_reads=100)
+
+
+@benchmark(params=[100, 300], quick=[100])
+def cluster_bqm_build(n, k=5):
+    D = distance_matrix(list(city_coordinates(n).values()))
+    return lambda: cluster_bqm(D, k)
+
+
+@benchmark(params=[1000, 5000], quick=[1000])
+def cluster_kmeans(n, k=20):
+    points = list(city_coordinates(n).values())
+    return lambda: kmeans(points, k, capacity=1.1 * n / k, seed=0)
+
+
+@benchmark(params=[10, 25, 50], quick=[10])
+def route_qubo_build(n):
+    D = distance_matrix(list(city_coordinates(n).values()))
+    return lambda: route_bqm(D, Optimized_Routes.A, Optimized_Routes.B)
+
+
+@benchmark(params=[7, 15], quick=[7])
+def route_anneal(n):
+    D = distance_matrix(list(city_coordinates(n).values()))
+    bqm = route_bqm(D, Optimized_Routes.A, Optimized_Routes.B)
+    sampler = neal.SimulatedAnnealingSampler()
+    return lambda: sampler.sample(bqm, num_reads=1, seed=0)
+
+
+@benchmark(params=[21, 50], quick=[21])
+def route_solve_warm(n):
+    D = distance_matrix(list(city_coordinates(n).values()))
+    return lambda: Optimized_Routes.solve_route(D, method='warm')
+
+
+@benchmark(params=[100, 1000], quick=[100])
+def distance_matrix_uncached(n):
+    coordinates = list(city_coordinates(n).values())
+    clear_cache()
+    return lambda: distance_matrix(coordinates, cache=False)
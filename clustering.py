@@ -0,0 +1,353 @@
+#k-way clustering QUBO for the delivery groups
+
+#variable i*k + c is 1 when point i is in cluster c. The biases are computed in bulk
+#from the distance matrix as COO arrays (see route_qubo): a one-hot penalty per point,
+#an attraction -cos(pi*d/max_d) between two points in the same cluster (close points
+#attract, far ones repel) and a weak reward -0.1*tanh(sqrt(d/max_d)) for two points
+#in different clusters. A balance term balance*(size of cluster - n/k)**2 (BALANCE by
+#default) spreads the points over all k clusters; without it the attraction alone
+#tends to fill only two. Samples are decoded straight to an array of cluster indices,
+#and fill_empty_clusters makes sure that all k clusters are used.
+#
+#The one-hot strength defaults to the largest total reward a point can collect by
+#joining a second cluster, so breaking the constraint never pays; the strength 2 of
+#the dwavebinarycsp constraint the r/g/b version used is far below that for more
+#than a handful of points.
+#
+#Networks of hundreds or thousands of stops are clustered classically: kmeans is
+#k-means on the unit sphere (squared chord distance, a monotone function of the
+#haversine distance, see spatial_index), optionally with a capacity per cluster, in
+#O(n*k) per iteration and without a distance matrix. hierarchical_clusters splits
+#large regions with kmeans and anneals only the small leaf regions with the QUBO;
+#when even one cluster is larger than a leaf, the points are first grouped into
+#leaves and the leaf centers are clustered instead.
+
+import math
+
+import numpy as np
+import dimod
+
+from spatial_index import unit_vectors
+
+# default weight of equal cluster sizes in the clustering QUBO
+BALANCE = 0.3
+
+
+def cluster_weights(D):
+    """
+    same-cluster and different-cluster pair weights of the points of distance matrix D
+    returns:
+        (numpy.ndarray, numpy.ndarray) - n x n matrices, zero on the diagonal
+    """
+    D = np.asarray(D, dtype=float)
+    # Note: max_distance gets used in division later on. Hence, the max(.., 1)
+    #   is used to prevent a division by zero
+    d = D / max(D.max(initial=0), 1)
+    same = -np.cos(d * np.pi)
+    # Note: rescaled and applied square root so that far off distances
+    #   are all weighted approximately the same
+    different = -np.tanh(np.sqrt(d)) * 0.1
+    np.fill_diagonal(same, 0)
+    np.fill_diagonal(different, 0)
+    return same, different
+
+
+def default_strength(D):
+    """one-hot strength above which no point gains from being in two clusters"""
+    same, different = cluster_weights(D)
+    gain = np.clip(-same, 0, None).sum(axis=1) + np.abs(different).sum(axis=1)
+    return max(2.0, float(gain.max(initial=0)))
+
+
+def cluster_qubo_vectors(D, k, strength=None, balance=BALANCE):
+    """
+    build the clustering QUBO as numpy vectors
+    parameters:
+        D - n x n distance matrix of the points
+        k - number of clusters
+        strength - weight of the one-cluster-per-point constraint, default_strength(D) by default
+        balance - weight of the squared deviation of every cluster size from n/k
+    returns:
+        (linear, (row, col, quadratic), offset) - as accepted by
+        dimod.BinaryQuadraticModel.from_numpy_vectors
+    """
+    D = np.asarray(D, dtype=float)
+    n = len(D)
+    if strength is None:
+        strength = default_strength(D)
+    same, different = cluster_weights(D)
+
+    # one-hot: strength*(sum_c x[i, c] - 1)**2 for every point, and
+    # balance*(sum_i x[i, c] - n/k)**2 for every cluster
+    linear = np.full(n * k, -float(strength) + balance * (1 - 2 * n / k))
+    c0, c1 = np.triu_indices(k, k=1)
+    points = np.arange(n)[:, None] * k
+    onehot_row = (points + c0).ravel()
+    onehot_col = (points + c1).ravel()
+    onehot = np.full(len(onehot_row), 2.0 * strength)
+
+    # every pair of points i < j in every pair of clusters (a, b)
+    i, j = np.triu_indices(n, k=1)
+    a, b = (grid.ravel() for grid in np.meshgrid(np.arange(k), np.arange(k), indexing='ij'))
+    pair_row = (i[:, None] * k + a).ravel()
+    pair_col = (j[:, None] * k + b).ravel()
+    pair = np.where(a == b, same[i, j][:, None] + 2 * balance, different[i, j][:, None]).ravel()
+
+    row = np.concatenate((onehot_row, pair_row))
+    col = np.concatenate((onehot_col, pair_col))
+    quadratic = np.concatenate((onehot, pair))
+    return linear, (row, col, quadratic), float(strength) * n + balance * n**2 / k
+
+
+def cluster_bqm(D, k, strength=None, balance=BALANCE):
+    """clustering QUBO of cluster_qubo_vectors as a dimod BQM with variables 0 .. n*k-1"""
+    linear, quadratic, offset = cluster_qubo_vectors(D, k, strength, balance)
+    return dimod.BinaryQuadraticModel.from_numpy_vectors(linear, quadratic, offset, dimod.BINARY)
+
+
+def sampleset_states(sampleset, num_variables):
+    """samples of a sampleset of cluster_bqm as an array with columns 0 .. num_variables-1"""
+    columns = [sampleset.variables.index(v) for v in range(num_variables)]
+    return sampleset.record.sample[:, columns]
+
+
+def decode_clusters(samples, k):
+    """
+    cluster of every point
+    parameters:
+        samples - one sample (n*k values) or an array of them
+    returns:
+        (numpy.ndarray) - cluster index per point (per sample and point for an array
+                          of samples), -1 where a point is in no or several clusters
+    """
+    samples = np.asarray(samples)
+    onehot = samples.reshape(samples.shape[:-1] + (-1, k)) == 1
+    return np.where(onehot.sum(axis=-1) == 1, onehot.argmax(axis=-1), -1)
+
+
+def repair_clusters(assignment, D):
+    """
+    put the points decode_clusters left at -1 in the cluster of their nearest assigned point
+    (cluster 0 if no point is assigned)
+    """
+    assignment = np.array(assignment)
+    missing = np.flatnonzero(assignment < 0)
+    assigned = np.flatnonzero(assignment >= 0)
+    if not len(missing):
+        return assignment
+    if not len(assigned):
+        assignment[missing] = 0
+        return assignment
+    D = np.asarray(D, dtype=float)
+    nearest = assigned[np.argmin(D[np.ix_(missing, assigned)], axis=1)]
+    assignment[missing] = assignment[nearest]
+    return assignment
+
+
+def fill_empty_clusters(assignment, D, k):
+    """
+    move points into the clusters of assignment that are empty, so that all k clusters are
+    used when there are at least k points: every empty cluster takes the point of the
+    largest cluster that is farthest from the other points of that cluster
+    """
+    assignment = np.array(assignment)
+    D = np.asarray(D, dtype=float)
+    sizes = np.bincount(assignment[assignment >= 0], minlength=k)
+    for empty in np.flatnonzero(sizes == 0).tolist():
+        largest = int(np.argmax(sizes))
+        if sizes[largest] < 2:
+            break
+        members = np.flatnonzero(assignment == largest)
+        moved = members[np.argmax(D[np.ix_(members, members)].sum(axis=1))]
+        assignment[moved] = empty
+        sizes[largest] -= 1
+        sizes[empty] += 1
+    return assignment
+
+
+def groupings(points, assignment, names):
+    """
+    dict of cluster name to its points, as returned by Optimized_Routes.cluster
+    parameters:
+        points - the clustered points, e.g. (latitude, longitude) tuples
+        assignment - cluster index per point, see decode_clusters
+        names - name of every cluster index
+    """
+    groups = {}
+    for point, c in zip(points, np.asarray(assignment).tolist()):
+        if c >= 0:
+            groups.setdefault(names[c], []).append(tuple(point))
+    return groups
+
+
+def _kmeans_init(vectors, k, weights, rng):
+    """k-means++ seeding"""
+    centers = [vectors[rng.choice(len(vectors), p=weights / weights.sum())]]
+    closest = np.full(len(vectors), np.inf)
+    for _ in range(1, k):
+        closest = np.minimum(closest, 2 - 2 * vectors @ centers[-1])
+        p = weights * np.clip(closest, 0, None)
+        if p.sum() <= 0:
+            p = weights
+        centers.append(vectors[rng.choice(len(vectors), p=p / p.sum())])
+    return np.array(centers)
+
+
+def _assign(cost, weights, capacity):
+    """cluster of every point with the least cost that keeps the cluster loads within capacity"""
+    assignment = np.argmin(cost, axis=1)
+    if capacity is None:
+        return assignment
+    k = cost.shape[1]
+    loads = np.bincount(assignment, weights, k)
+    if np.all(loads <= capacity):
+        return assignment
+
+    # regret: what a point loses when it has to move to its next best cluster
+    ranked = np.sort(cost, axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if k > 1 else ranked[:, 0]
+
+    # the members of an over-full cluster with the most regret stay, the others are
+    # moved; points in clusters within capacity are not touched
+    remaining = capacity - np.where(loads <= capacity, loads, 0)
+    moved = []
+    for c in np.flatnonzero(loads > capacity).tolist():
+        members = np.flatnonzero(assignment == c)
+        members = members[np.argsort(-regret[members], kind='stable')]
+        stay = np.cumsum(weights[members]) <= capacity[c]
+        remaining[c] -= weights[members[stay]].sum()
+        moved.append(members[~stay])
+    moved = np.concatenate(moved)
+
+    for i in moved[np.argsort(-regret[moved], kind='stable')].tolist():
+        for c in np.argsort(cost[i]).tolist():
+            if remaining[c] >= weights[i]:
+                assignment[i] = c
+                remaining[c] -= weights[i]
+                break
+        else:
+            raise ValueError(f"point {i} (weight {weights[i]}) fits in no cluster")
+    return assignment
+
+
+def kmeans(points, k, weights=None, capacity=None, max_iter=100, seed=None):
+    """
+    k-means clusters of (latitude, longitude) points by great-circle distance
+    parameters:
+        points - (latitude, longitude) pairs
+        k - number of clusters
+        weights - weight (e.g. demand) of every point, 1 by default
+        capacity - largest total weight of a cluster, one value for all clusters or one
+                   per cluster; None for no limit
+        seed - seed of the k-means++ initialisation
+    returns:
+        (numpy.ndarray) - cluster index of every point
+    """
+    vectors = unit_vectors(points)
+    n = len(vectors)
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    clusters, k = k, min(k, n)
+    if capacity is not None:
+        # with fewer points than clusters only the first n clusters are used
+        capacity = np.broadcast_to(np.asarray(capacity, dtype=float), (clusters,))[:k]
+        if capacity.sum() < weights.sum():
+            raise ValueError(f"total capacity {capacity.sum()} is less than the total weight "
+                             f"{weights.sum()}")
+    if n == 0:
+        return np.zeros(0, dtype=int)
+
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_init(vectors, k, weights, rng)
+    assignment = None
+    for _ in range(max_iter):
+        # squared chord distance of every point to every center
+        cost = 2 - 2 * vectors @ centers.T
+        previous, assignment = assignment, _assign(cost, weights, capacity)
+        if previous is not None and np.array_equal(previous, assignment):
+            break
+
+        sums = np.zeros((k, 3))
+        np.add.at(sums, assignment, vectors * weights[:, None])
+        norms = np.linalg.norm(sums, axis=1)
+        # a cluster that lost all its points keeps its center
+        moved = norms > 0
+        centers[moved] = sums[moved] / norms[moved, None]
+    return assignment
+
+
+def _centers(points, assignment, k):
+    """(latitude, longitude) of the center of every one of the k clusters of the points"""
+    sums = np.zeros((k, 3))
+    np.add.at(sums, assignment, unit_vectors(points))
+    x, y, z = (sums / np.linalg.norm(sums, axis=1, keepdims=True)).T
+    return np.column_stack((np.degrees(np.arcsin(np.clip(z, -1, 1))), np.degrees(np.arctan2(y, x))))
+
+
+def _shares(sizes, k):
+    """k clusters shared out over regions of sizes, at least one each, by largest remainder"""
+    sizes = np.asarray(sizes, dtype=float)
+    exact = 1 + (k - len(sizes)) * sizes / sizes.sum()
+    shares = np.floor(exact).astype(int)
+    for r in np.argsort(-(exact - shares), kind='stable')[:k - shares.sum()]:
+        shares[r] += 1
+    return shares
+
+
+def hierarchical_clusters(points, k, leaf_size=40, balance=BALANCE, num_reads=10, seed=None):
+    """
+    k clusters of many (latitude, longitude) points: regions larger than leaf_size are
+    split by kmeans into at most k regions, the k clusters are shared out over the regions
+    by size and every region is clustered the same way until it is small enough for the
+    QUBO of cluster_bqm, which is annealed. When there are more than k * leaf_size points,
+    so that a cluster cannot be a leaf, the points are grouped by kmeans into leaves of at
+    most leaf_size points and the leaf centers are clustered, each point joining the
+    cluster of its leaf
+    parameters:
+        leaf_size - largest region clustered with the QUBO
+        balance - see cluster_qubo_vectors; the share of clusters of a region is only
+                  met if the annealer uses all of them
+        num_reads - reads per leaf region
+    returns:
+        (numpy.ndarray) - cluster index of every point
+    """
+    from distances import compute_distance_matrix
+    import neal
+
+    if leaf_size < 2:
+        raise ValueError(f"leaf_size must be at least 2, got {leaf_size}")
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    n = len(points)
+    if k <= 1 or n <= 1:
+        return np.zeros(n, dtype=int)
+
+    if n <= leaf_size:
+        k = min(k, n)
+        D = compute_distance_matrix(points)
+        sampleset = neal.SimulatedAnnealingSampler().sample(cluster_bqm(D, k, balance=balance),
+                                                            num_reads=num_reads, seed=seed)
+        states = sampleset_states(sampleset, n * k)[np.argmin(sampleset.record.energy)]
+        return fill_empty_clusters(repair_clusters(decode_clusters(states, k), D), D, k)
+
+    regions = math.ceil(n / leaf_size)
+    if regions >= k:
+        # renumbered so that leaves kmeans left empty get no center
+        leaf = np.unique(kmeans(points, regions, capacity=leaf_size, seed=seed),
+                         return_inverse=True)[1].reshape(-1)
+        centers = _centers(points, leaf, leaf.max() + 1)
+        return hierarchical_clusters(centers, k, leaf_size, balance, num_reads, seed)[leaf]
+
+    # renumbered so that regions kmeans left empty get no share of the clusters
+    split = np.unique(kmeans(points, regions, seed=seed), return_inverse=True)[1].reshape(-1)
+    if not split.any():
+        # coincident points kmeans cannot separate are split in order instead
+        split = np.arange(n) * regions // n
+
+    assignment = np.empty(n, dtype=int)
+    offset = 0
+    for r, share in enumerate(_shares(np.bincount(split), k)):
+        members = np.flatnonzero(split == r)
+        sub_seed = None if seed is None else seed + r + 1
+        assignment[members] = offset + hierarchical_clusters(points[members], share, leaf_size,
+                                                             balance, num_reads, sub_seed)
+        offset += share
+    return assignment
@@ -1,4 +1,4 @@
-import React, {Component} from "react";
+import React, {Component, useEffect, useState} from "react";
 import {Link} from 'react-router-dom';
 
 
@@ -14,6 +14,43 @@ const points = [
     { lat: 38.4404, lng: -122.7141 },
   ];
   
+  // local solver service (service.py in the repository root)
+  const SOLVER_URL = process.env.REACT_APP_SOLVER_URL || "http://localhost:8080";
+
+  // the solvers take longitudes positive west
+  const toSolver = ({ lat, lng }) => [lat, -lng];
+  const fromSolver = ([lat, lon]) => ({ lat, lng: -lon });
+
+  // calls onRoute with every route of the /routes stream as soon as it is solved
+  async function streamRoutes(stops, vehicles, onRoute) {
+    const response = await fetch(SOLVER_URL + "/routes", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ points: stops.map(toSolver), vehicles }),
+    });
+    if (!response.ok) {
+      throw new Error((await response.json()).error);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      for (const line of lines.filter(Boolean)) {
+        const message = JSON.parse(line);
+        if (message.type === "route") {
+          onRoute({ group: message.group, points: message.points.map(fromSolver) });
+        } else if (message.type === "error") {
+          throw new Error(message.error);
+        }
+      }
+    }
+  }
+
   const circleOptions = {
     style: {
       strokeColor: "rgba(55, 85, 170, 0.6)", // Color of the perimeter
@@ -77,6 +114,17 @@ const points = [
     );
   };
 export function Maps() {
+    // solved routes by group; the stops are joined in the given order until they arrive
+    const [routes, setRoutes] = useState({});
+    useEffect(() => {
+      let active = true;
+      streamRoutes(points, 2, (route) => {
+        if (active) setRoutes((previous) => ({ ...previous, [route.group]: route.points }));
+      }).catch((error) => console.warn("solver service unavailable:", error.message));
+      return () => { active = false; };
+    }, []);
+    const lines = Object.keys(routes).length ? Object.values(routes) : [points];
+
     return (
         <div style={{margin:-10}}>
             <div style={{position:'absolute', height:'98vh', backgroundColor:'#000', width:'20vw', float:'left'}}>
@@ -104,7 +152,7 @@ export function Maps() {
       }}
       mapOptions={{ center: { lat:37.7749, lng: -122.4194 }, zoom: 2 }}
     >
-      <HMapPolyLine points={points} />
+      {lines.map((line, k) => <HMapPolyLine key={k} points={line} />)}
       <HMapCircle coords={points[0]} radius={10000} options={circleOptions}  />
       <HMapCircle coords={points[1]} radius={10000} options={circleOptions2} />
       <HMapCircle coords={points[2]} radius={10000} options={circleOptions2} />
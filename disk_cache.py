@@ -0,0 +1,130 @@
+#shared pieces of the result caches
+
+#every cache keeps its entries in a bounded in-memory LRU and, where it persists
+#them, as files in its own subdirectory of $QUANTUM_CHAIN_CACHE (~/.cache/quantum-chain
+#by default). Files are written under a temporary name and then renamed, so a
+#concurrent reader never sees a partial file. Caching is only an optimization: a
+#read-only or full disk makes the writes fail silently and the in-memory cache
+#still applies.
+
+from collections import OrderedDict
+import os
+
+ROOT = os.environ.get('QUANTUM_CHAIN_CACHE',
+                      os.path.join(os.path.expanduser('~'), '.cache', 'quantum-chain'))
+
+
+def cache_dir(name):
+    """directory of the cache called name"""
+    return os.path.join(ROOT, name)
+
+
+class LRUCache:
+    """
+    mapping of at most maxsize entries that drops the least recently used one
+    parameters:
+        maxsize - number of entries kept
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """value of key (now the most recently used one), or default"""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._trim()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._trim()
+
+    def clear(self):
+        self._entries.clear()
+
+    def _trim(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+def write_atomic(path, write):
+    """
+    create the file path by write(temporary_path) and a rename
+    parameters:
+        write - function that writes the whole file to the path it is given; the
+                temporary path keeps the extension of path (numpy.savez appends .npz
+                to names without it)
+    returns:
+        (bool) - whether the file was written; False on a read-only or full disk
+    """
+    root, extension = os.path.splitext(path)
+    tmp_path = '{}.{}.tmp{}'.format(root, os.getpid(), extension)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def touch(path):
+    """mark path as just used, for prune"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _files(directory, extension):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in names if name.endswith(extension)]
+
+
+def prune(directory, extension, max_bytes):
+    """remove the least recently used (see touch) files of directory until they take at most max_bytes"""
+    files = []
+    for path in _files(directory, extension):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def clear_dir(directory, extension):
+    """remove the files of directory ending in extension"""
+    for path in _files(directory, extension):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,167 @@
+#great-circle distances between latitude-longitude coordinates
+
+#distance matrices are computed with NumPy haversine in row blocks and cached
+#by the coordinate set they were computed for: in memory (LRU) and on disk as
+#.npy files that are memory-mapped when loaded, so repeated route runs over the
+#same depots and hospitals skip the computation entirely. On disk the coordinates
+#are sorted (by latitude, then longitude) before they are hashed and the matrix is
+#stored in that order, so the same cities in another order (the CLI shuffles them)
+#share one file; the rows and columns are put back into the caller's order on load.
+#The cache directory is $QUANTUM_CHAIN_CACHE/distances (~/.cache/quantum-chain by default);
+#the least recently used files are removed once it exceeds DISK_CACHE_BYTES.
+
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from disk_cache import LRUCache, cache_dir, clear_dir, prune, touch, write_atomic
+
+R = 3963  # radius of Earth (miles)
+
+CACHE_DIR = cache_dir('distances')
+
+# number of matrices kept in memory
+MEMORY_CACHE_SIZE = 32
+
+# size the .npy files of CACHE_DIR are pruned to
+DISK_CACHE_BYTES = 256 * 2**20
+
+# rows computed at once, bounds the temporaries to BLOCK_ROWS * len(coords_b) floats
+BLOCK_ROWS = 1024
+
+_memory_cache = LRUCache(MEMORY_CACHE_SIZE)
+
+
+def haversine(a, b):
+    """Calculates distance between two latitude-longitude coordinates."""
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = (math.sin((lat2 - lat1) / 2)**2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2)
+    return 2 * R * math.asin(math.sqrt(min(h, 1.0)))
+
+
+def _haversine_block(lat_a, lon_a, lat_b, lon_b):
+    h = (np.sin((lat_b[None, :] - lat_a[:, None]) / 2)**2 +
+         np.cos(lat_a)[:, None] * np.cos(lat_b)[None, :] *
+         np.sin((lon_b[None, :] - lon_a[:, None]) / 2)**2)
+    return 2 * R * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _as_coordinates(coords):
+    return np.ascontiguousarray(coords, dtype=float).reshape(-1, 2)
+
+
+def _sorted_order(coords):
+    """order of the coordinates by latitude, then longitude"""
+    return np.lexsort((coords[:, 1], coords[:, 0]))
+
+
+def _key(coords_a, coords_b):
+    digest = hashlib.sha1()
+    for coords in (coords_a, coords_b):
+        digest.update(str(coords.shape).encode())
+        digest.update(coords.tobytes())
+    digest.update(str(R).encode())
+    return digest.hexdigest()
+
+
+def compute_distance_matrix(coords_a, coords_b=None, out=None):
+    """
+    haversine distances (miles) between every row of coords_a and every row of coords_b
+    parameters:
+        coords_a, coords_b - sequences of (latitude, longitude) pairs;
+                             coords_b defaults to coords_a
+        out - optional array (e.g. a memory map) of shape (len(a), len(b)) to fill
+    """
+    coords_a = np.radians(_as_coordinates(coords_a))
+    coords_b = coords_a if coords_b is None else np.radians(_as_coordinates(coords_b))
+    if out is None:
+        out = np.empty((len(coords_a), len(coords_b)))
+
+    lat_b, lon_b = coords_b[:, 0], coords_b[:, 1]
+    for start in range(0, len(coords_a), BLOCK_ROWS):
+        block = coords_a[start:start + BLOCK_ROWS]
+        out[start:start + len(block)] = _haversine_block(block[:, 0], block[:, 1], lat_b, lon_b)
+
+    return out
+
+
+def distance_matrix(coords_a, coords_b=None, cache=True):
+    """
+    cached haversine distance matrix, see compute_distance_matrix
+    parameters:
+        cache - look up and store the matrix in the memory and disk caches;
+                cached matrices are read-only
+    returns:
+        (numpy.ndarray) - len(coords_a) x len(coords_b) distances in miles
+    """
+    coords_a = _as_coordinates(coords_a)
+    symmetric = coords_b is None
+    coords_b = coords_a if symmetric else _as_coordinates(coords_b)
+    if not cache:
+        return compute_distance_matrix(coords_a, coords_b)
+
+    key = _key(coords_a, coords_b)
+    matrix = _memory_cache.get(key)
+    if matrix is None:
+        matrix = _disk_matrix(coords_a, coords_b, symmetric)
+        _memory_cache.put(key, matrix)
+    return matrix
+
+
+def _disk_matrix(coords_a, coords_b, symmetric):
+    """the matrix of the sorted coordinates from CACHE_DIR (computed if missing), in the given order"""
+    order_a = _sorted_order(coords_a)
+    order_b = order_a if symmetric else _sorted_order(coords_b)
+    sorted_a, sorted_b = coords_a[order_a], coords_b[order_b]
+    path = os.path.join(CACHE_DIR, _key(sorted_a, sorted_b) + '.npy')
+    try:
+        matrix = np.load(path, mmap_mode='r')
+        touch(path)
+    except (OSError, ValueError):
+        matrix = _compute_to_disk(sorted_a, sorted_b, path)
+
+    if np.array_equal(order_a, np.arange(len(order_a))) and \
+            np.array_equal(order_b, np.arange(len(order_b))):
+        return matrix
+    matrix = np.asarray(matrix)[np.ix_(np.argsort(order_a), np.argsort(order_b))]
+    matrix.flags.writeable = False
+    return matrix
+
+
+def _compute_to_disk(coords_a, coords_b, path):
+    def write(tmp_path):
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', shape=(len(coords_a), len(coords_b)))
+        compute_distance_matrix(coords_a, coords_b, out=out)
+        out.flush()
+
+    if write_atomic(path, write):
+        try:
+            matrix = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        else:
+            # a mapped file stays readable after it is removed
+            prune(CACHE_DIR, '.npy', DISK_CACHE_BYTES)
+            return matrix
+    # read-only or full disk: the in-memory cache still applies
+    matrix = compute_distance_matrix(coords_a, coords_b)
+    matrix.flags.writeable = False
+    return matrix
+
+
+def max_distance(coords):
+    """largest distance between any two of the coordinates"""
+    if len(coords) < 2:
+        return 0.0
+    return float(np.max(distance_matrix(coords)))
+
+
+def clear_cache(disk=False):
+    """empty the in-memory cache and, with disk=True, remove the cached .npy files"""
+    _memory_cache.clear()
+    if disk:
+        clear_dir(CACHE_DIR, '.npy')
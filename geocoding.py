@@ -0,0 +1,153 @@
+#coordinates of hospital cities by an indexed (city, state) join
+
+#the city table is the simplemaps US cities file (https://simplemaps.com/data/us-cities,
+#columns city_ascii, state_id, lat, lng, population). It is read once into an index on
+#a normalized "city|ST" key and stored as a compact .npz (keys plus float32 lat/lng)
+#under $QUANTUM_CHAIN_CACHE/geocoding, keyed by the path, size and modification time of
+#the source, so later runs skip the csv parse. A whole node list is then resolved with
+#one vectorized lookup. Longitudes are returned positive west, the convention of
+#Optimized_Routes.cities.
+#
+#python geocoding.py H_Beds.csv uscities.csv H_Beds_coordinates.csv
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from disk_cache import cache_dir, write_atomic
+
+CACHE_DIR = cache_dir('geocoding')
+
+
+def normalize_key(cities, states):
+    """
+    "city|ST" keys that ignore case, surrounding and repeated whitespace and periods
+    (so "St. Louis", "st louis" and "ST LOUIS " match)
+    """
+    cities = (pd.Series(cities, dtype=object).astype(str).str.casefold()
+              .str.replace('.', '', regex=False)
+              .str.replace(r'\s+', ' ', regex=True).str.strip())
+    states = pd.Series(states, dtype=object).astype(str).str.strip().str.upper()
+    return (cities.to_numpy() + '|' + states.to_numpy()).astype(str)
+
+
+class GeocodingIndex:
+    """
+    coordinates by normalized (city, state) key
+    parameters:
+        keys - unique keys of normalize_key
+        latitude, longitude - coordinates of every key, longitude positive east as in uscities.csv
+    """
+
+    def __init__(self, keys, latitude, longitude):
+        self.keys = pd.Index(np.asarray(keys, dtype=str))
+        self.latitude = np.asarray(latitude, dtype=np.float32)
+        self.longitude = np.asarray(longitude, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_csv(cls, path):
+        """index of a uscities.csv file; of several rows with the same key the most populous wins"""
+        columns = ['city_ascii', 'state_id', 'lat', 'lng']
+        header = pd.read_csv(path, nrows=0).columns
+        if 'population' in header:
+            columns.append('population')
+        table = pd.read_csv(path, usecols=columns,
+                            dtype={'city_ascii': str, 'state_id': str, 'lat': 'float32', 'lng': 'float32'})
+        if 'population' in table:
+            table = table.sort_values('population', ascending=False, kind='stable')
+
+        keys = normalize_key(table['city_ascii'], table['state_id'])
+        first = ~pd.Index(keys).duplicated(keep='first')
+        return cls(keys[first], table['lat'].to_numpy()[first], table['lng'].to_numpy()[first])
+
+    def save(self, path):
+        np.savez(path, keys=self.keys.to_numpy(dtype=str), latitude=self.latitude,
+                 longitude=self.longitude)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['keys'], data['latitude'], data['longitude'])
+
+    def lookup(self, cities, states, positive_west=True):
+        """
+        coordinates of every (city, state) pair
+        returns:
+            (numpy.ndarray, numpy.ndarray) - latitude and longitude (float64), NaN where
+                                             the pair is not in the index
+        """
+        position = self.keys.get_indexer(normalize_key(cities, states))
+        found = position >= 0
+        latitude = np.full(len(position), np.nan)
+        longitude = np.full(len(position), np.nan)
+        latitude[found] = self.latitude[position[found]]
+        longitude[found] = self.longitude[position[found]]
+        if positive_west:
+            longitude = -longitude
+        return latitude, longitude
+
+
+def load_index(path, cache=True):
+    """
+    GeocodingIndex of a uscities.csv file, read from the .npz cache when the file is unchanged
+    """
+    if not cache:
+        return GeocodingIndex.from_csv(path)
+
+    stat = os.stat(path)
+    source = '{}|{}|{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    cache_path = os.path.join(CACHE_DIR, hashlib.sha1(source.encode()).hexdigest() + '.npz')
+    try:
+        return GeocodingIndex.load(cache_path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = GeocodingIndex.from_csv(path)
+    write_atomic(cache_path, index.save)
+    return index
+
+
+def geocode_nodes(nodes, index):
+    """
+    coordinates of the knapsack nodes of ingest.read_hospital_nodes
+    parameters:
+        nodes - DataFrame with node, city and state columns
+        index - GeocodingIndex
+    returns:
+        (dict) - node label to (latitude, longitude), longitude positive west,
+                 for every node that was found
+    """
+    latitude, longitude = index.lookup(nodes['city'], nodes['state'])
+    found = ~np.isnan(latitude)
+    labels = np.asarray(nodes['node'], dtype=object)[found]
+    return dict(zip(labels.tolist(), zip(latitude[found].round(4).tolist(),
+                                         longitude[found].round(4).tolist())))
+
+
+def main():
+    """ CLI
+    """
+    from ingest import read_hospital_nodes
+
+    parser = argparse.ArgumentParser(description="Attach coordinates to the cities of a hospital file")
+    parser.add_argument('data', help="hospital file in the H_Beds.csv schema (see ingest)")
+    parser.add_argument('uscities', help="simplemaps uscities.csv")
+    parser.add_argument('output', help="csv file to write: City,Latitude,Longitude (positive west)")
+
+    args = parser.parse_args()
+
+    nodes = read_hospital_nodes(args.data)
+    coordinates = geocode_nodes(nodes, load_index(args.uscities))
+    pd.DataFrame([(node, lat, lon) for node, (lat, lon) in coordinates.items()],
+                 columns=['City', 'Latitude', 'Longitude']).to_csv(args.output, index=False)
+    print(f"{len(coordinates)} of {len(nodes)} nodes geocoded into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
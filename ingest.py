@@ -0,0 +1,188 @@
+#streaming ingestion of hospital capacity data for knapsack.solve_nodes_using_csv
+
+#hospital files have the H_Beds.csv schema: "City","State","Total","Available",
+#"ICUs","Available_ICU", one row per hospital (or per city). CSV files are read in
+#chunks with narrow (nullable) dtypes; every chunk is turned into the knapsack status and value
+#of its rows and summed per City/State at once, and only those sums are kept, so
+#memory depends on the number of cities and not on the number of rows.
+#Parquet and Arrow (Feather) files are read batch by batch the same way. A file of
+#aggregated nodes written by save_nodes is loaded as is, without any parsing.
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+HOSPITAL_DTYPES = {
+    'City': 'category',
+    'State': 'category',
+    'Total': 'Int32',
+    'Available': 'Int32',
+    'ICUs': 'Int32',
+    'Available_ICU': 'Int32',
+}
+
+NODE_COLUMNS = ['node', 'city', 'state', 'status', 'value']
+
+# rows per CSV chunk / Arrow batch
+CHUNK_ROWS = 1_000_000
+
+
+def node_status_value(total, available, icus):
+    """
+    knapsack status (people to serve) and impact value of hospital rows
+    returns:
+        (numpy.ndarray, numpy.ndarray) - int64 status and value of every row
+    """
+    total = np.asarray(total, dtype=np.int64)
+    available = np.asarray(available, dtype=np.int64)
+    icus = np.asarray(icus, dtype=np.int64)
+
+    #status = abs(ICUs - Available_ICU) would be the number of sick people in the ICU
+    status = 5*icus//5 + 10*np.abs(total - icus)//10
+    #assume medical team of 5 and  vaccine efficiency 85%
+    value = (5*(icus//5 + np.abs(total - available - icus)//10)*85)//100
+    return status, value
+
+
+def _aggregate_chunk(chunk):
+    """status and value of one chunk of hospital rows, summed per City/State"""
+    # a missing bed count counts as no beds
+    counts = chunk[['Total', 'Available', 'ICUs']].fillna(0)
+    status, value = node_status_value(counts['Total'], counts['Available'], counts['ICUs'])
+    sums = pd.DataFrame({'City': chunk['City'], 'State': chunk['State'],
+                         'status': status, 'value': value})
+    sums = sums.groupby(['City', 'State'], observed=True, sort=False).sum().reset_index()
+
+    # plain strings, so chunks with different categories combine; the State
+    # column of H_Beds.csv has a leading space
+    sums['City'] = sums['City'].astype(str)
+    sums['State'] = sums['State'].astype(str).str.strip()
+    return sums
+
+
+def _combine(aggregate, sums):
+    if aggregate is None:
+        return sums.groupby(['City', 'State'], sort=False).sum().reset_index()
+    both = pd.concat((aggregate, sums), ignore_index=True)
+    # first appearance order is kept, so the nodes come in the order of the file
+    return both.groupby(['City', 'State'], sort=False).sum().reset_index()
+
+
+def _chunks(path, chunk_rows):
+    """hospital rows of path as DataFrames of at most chunk_rows rows"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq', '.arrow', '.feather', '.ipc'):
+        yield from _arrow_chunks(path, extension, chunk_rows)
+        return
+
+    reader = pd.read_csv(path, dtype=HOSPITAL_DTYPES, usecols=list(HOSPITAL_DTYPES),
+                         chunksize=chunk_rows)
+    with reader:
+        yield from reader
+
+
+def _arrow_chunks(path, extension, chunk_rows):
+    try:
+        import pyarrow.parquet as pq
+        import pyarrow.ipc as ipc
+    except ImportError:
+        raise ImportError("reading Parquet and Arrow files requires pyarrow") from None
+
+    if extension in ('.parquet', '.pq'):
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in parquet.schema_arrow.names if c in HOSPITAL_DTYPES or c in NODE_COLUMNS]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        with ipc.open_file(path) as reader:
+            for k in range(reader.num_record_batches):
+                yield reader.get_batch(k).to_pandas()
+
+
+def read_hospital_nodes(path, chunk_rows=CHUNK_ROWS):
+    """
+    knapsack nodes of a hospital capacity file
+    parameters:
+        path - .csv, .parquet or .arrow/.feather file in the H_Beds.csv schema,
+               or a file written by save_nodes
+        chunk_rows - rows read at once
+    returns:
+        (pandas.DataFrame) - columns node (unique label), city, state, status and value,
+                             one row per City/State in order of first appearance
+    """
+    aggregate = None
+    for chunk in _chunks(path, chunk_rows):
+        if 'node' in chunk.columns:
+            # aggregated nodes from save_nodes
+            aggregate = chunk if aggregate is None else pd.concat((aggregate, chunk), ignore_index=True)
+            continue
+        aggregate = _combine(aggregate, _aggregate_chunk(chunk))
+
+    if aggregate is None:
+        return pd.DataFrame({column: [] for column in NODE_COLUMNS})
+    if 'node' in aggregate.columns:
+        return aggregate[NODE_COLUMNS].reset_index(drop=True)
+    return pd.DataFrame({
+        'node': node_labels(aggregate['City'], aggregate['State']),
+        'city': aggregate['City'],
+        'state': aggregate['State'],
+        'status': aggregate['status'],
+        'value': aggregate['value'],
+    })
+
+
+def node_labels(cities, states):
+    """city names, with the state appended to names used in several states so labels are unique"""
+    cities = pd.Series(cities, dtype=object).reset_index(drop=True)
+    states = pd.Series(states, dtype=object).reset_index(drop=True)
+    duplicated = cities.duplicated(keep=False)
+    labels = cities.copy()
+    labels[duplicated] = cities[duplicated] + ', ' + states[duplicated]
+    return labels.tolist()
+
+
+def save_nodes(nodes, path):
+    """
+    write the nodes of read_hospital_nodes to a .parquet or .arrow/.feather file,
+    which read_hospital_nodes loads without parsing or aggregating
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.ipc as ipc
+    except ImportError:
+        raise ImportError("writing Parquet and Arrow files requires pyarrow") from None
+
+    table = pa.Table.from_pandas(nodes[NODE_COLUMNS], preserve_index=False)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        pq.write_table(table, path)
+    elif extension in ('.arrow', '.feather', '.ipc'):
+        with ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"unknown node file type {extension!r}, expected .parquet or .arrow")
+    return path
+
+
+def main():
+    """ CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Aggregate a hospital capacity file into knapsack nodes for fast reloads")
+    parser.add_argument('data', help="csv, Parquet or Arrow file in the H_Beds.csv schema")
+    parser.add_argument('output', help=".parquet or .arrow file to write the nodes to")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="Rows read at once")
+
+    args = parser.parse_args()
+
+    nodes = read_hospital_nodes(args.data, chunk_rows=args.chunk_rows)
+    save_nodes(nodes, args.output)
+    print(f"{len(nodes)} nodes written to {args.output}")
+
+#to convert a daily extract:> python ./ingest.py H_Beds.csv H_Beds_nodes.parquet
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#per-stage timing and memory instrumentation for the allocation and routing pipelines
+
+#wrap a pipeline stage in `with stage('name', counter=...) as record:` to record its
+#wall time, CPU time and the peak RSS of the process when it ends, plus any counters
+#(variables, couplings, reads, ...) set on the record. Stages nest; every record
+#carries its parent's name. Recording is off until enable() is called, and a
+#disabled stage costs one function call, so the instrumentation stays in place.
+#
+#Traces are written as JSON lines (one record per stage, appended as it ends) or in
+#the Chrome trace format (chrome://tracing, https://ui.perfetto.dev) when the trace
+#is closed. Worker processes forked while a JSON lines trace is open append their
+#stages to the same file; Chrome traces only hold the stages of the main process.
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_trace = None
+
+
+def peak_rss_mb():
+    """peak resident set size of this process so far, in MB (None where unknown)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class _Trace:
+    def __init__(self, path, format):
+        self.path = path
+        self.format = format
+        self.stack = threading.local()
+        self.events = []
+        self.origin = time.perf_counter()
+        self.file = open(path, 'a', buffering=1) if format == 'jsonl' else None
+
+    def parents(self):
+        if not hasattr(self.stack, 'names'):
+            self.stack.names = []
+        return self.stack.names
+
+    def write(self, record):
+        if self.format == 'jsonl':
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            self.events.append(record)
+
+    def close(self):
+        if self.format == 'jsonl':
+            self.file.close()
+            return
+        events = [{
+            'name': record['stage'], 'cat': record['parent'] or 'pipeline', 'ph': 'X',
+            'ts': record['start'] * 1e6, 'dur': record['wall'] * 1e6,
+            'pid': record['pid'], 'tid': record['tid'],
+            'args': {key: value for key, value in record.items()
+                     if key not in ('stage', 'parent', 'start', 'wall', 'pid', 'tid')},
+        } for record in self.events]
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def enable(path, format=None):
+    """
+    start recording stages to path
+    parameters:
+        format - 'jsonl' or 'chrome'; by default 'chrome' for *.json files, 'jsonl' otherwise
+    """
+    global _trace
+    disable()
+    if format is None:
+        format = 'chrome' if path.endswith('.json') else 'jsonl'
+    if format not in ('jsonl', 'chrome'):
+        raise ValueError(f"unknown trace format {format!r}, expected 'jsonl' or 'chrome'")
+    _trace = _Trace(path, format)
+
+
+def disable():
+    """stop recording and write out the trace"""
+    global _trace
+    if _trace is not None:
+        trace, _trace = _trace, None
+        trace.close()
+
+
+def enabled():
+    return _trace is not None
+
+
+@contextmanager
+def tracing(path, format=None):
+    """record the stages run inside the block to path, see enable"""
+    if path is None:
+        yield
+        return
+    enable(path, format)
+    try:
+        yield
+    finally:
+        disable()
+
+
+@contextmanager
+def stage(name, **counters):
+    """
+    record one pipeline stage
+    parameters:
+        name - stage name
+        counters - initial counters, more can be set on the yielded dict
+    yields:
+        (dict) - the counters of the stage; a 'reads' counter also gets reads_per_second
+    """
+    trace = _trace
+    if trace is None:
+        yield counters
+        return
+
+    parents = trace.parents()
+    parent = parents[-1] if parents else None
+    parents.append(name)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield counters
+    finally:
+        wall_end = time.perf_counter()
+        record = {
+            'stage': name,
+            'parent': parent,
+            'start': wall - trace.origin,
+            'wall': wall_end - wall,
+            'cpu': time.process_time() - cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        record.update(counters)
+        if 'reads' in counters and record['wall'] > 0:
+            record['reads_per_second'] = counters['reads'] / record['wall']
+        parents.pop()
+        trace.write(record)
@@ -12,18 +12,117 @@
 
 
 from pprint import pprint
-from typing import List, Dict
+from typing import List
 from math import log, ceil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import argparse
+import os
+import time
 
-import pandas as pd
+import numpy as np
 #from dwave.system import LeapHybridSampler
 import dimod
 import neal
 
+from knapsack_implicit import ImplicitKnapsackModel, RankOneAnnealingSampler
+from knapsack_exact import solve_knapsack_exact
+from instrumentation import stage, tracing
+from ingest import read_hospital_nodes
+import penalty_tuning
+import solution_cache
+from solution_set import SolutionSet
 
 
-def knapsack_bqm(cities, values, weights, total_capacity, value_r=0, weight_r=0):
+def knapsack_implicit_model(cities, values, weights, total_capacity, value_r=0, weight_r=0,
+                            formulation='slack', lagrange=None):
+    """
+    build the knapsack hamiltonian of knapsack_bqm in its implicit rank-1 form
+    (see knapsack_implicit.ImplicitKnapsackModel); memory is linear in the number of nodes
+    """
+
+    # Lagrangian multiplier
+    # First guess as suggested in Lucas's paper
+    if lagrange is None and formulation != 'unbalanced':
+        lagrange = max(values)
+
+    weights = np.asarray(weights, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    # Q-Alpha - calculate the extra constant in second part of problem hamiltonian
+    C = weights.sum() * weight_r
+
+    # Q-Alpha - change weights to weight*(1-weight_r)
+    weights = weights * (1 - weight_r)
+
+    # Q-Alpha - change values to value*(1-value_r)
+    values = values * (1 - value_r)
+
+    if formulation == 'unbalanced':
+        return _unbalanced_model(cities, values, weights, total_capacity - C / 2, lagrange)
+
+    # Lucas's algorithm introduces additional slack variables to handle
+    # the inequality. max_y_index indicates the maximum index in the y
+    # sum; hence the number of slack variables.
+    if formulation == 'slack':
+        max_y_index = ceil(log(total_capacity))
+    elif formulation == 'binary':
+        # base-2 slack bounded by the capacity: every total 0..total_capacity
+        # is representable, which the natural-log count above does not guarantee
+        max_y_index = int(total_capacity).bit_length()
+    else:
+        raise ValueError(f"unknown formulation {formulation!r}, "
+                         "expected 'slack', 'binary' or 'unbalanced'")
+
+    # Slack variable list for Lucas's algorithm. The last variable has
+    # a special value because it terminates the sequence.
+    y = [2**n for n in range(max_y_index - 1)]
+    y.append(total_capacity + 1 - 2**(max_y_index - 1))
+
+    # Every quadratic term of the Hamiltonian (x-x, y-y and x-y) is
+    # 2*lagrange*a_i*a_j for the combined vector a = (weights, -y), so the
+    # Hamiltonian is lagrange*S**2 - values.x with S = a.z
+    a = np.concatenate((weights, -np.asarray(y, dtype=float)))
+    labels = list(cities) + ['y' + str(k) for k in range(max_y_index)]
+
+    # Q-Alpha add final term lagrange * C * weights[k] (-lagrange * C * y[k]),
+    # i.e. lagrange * C * S
+    return ImplicitKnapsackModel(
+        labels, a, np.concatenate((values, np.zeros(max_y_index))), lagrange,
+        penalty_linear=lagrange * C)
+
+
+def _unbalanced_model(cities, values, weights, capacity, lagrange=None):
+    """
+    slack-free knapsack hamiltonian with the unbalanced penalization of
+    Montanez-Barrera et al., arXiv:2211.13914 (2022):
+
+        H = -values.x + lagrange * h**2 - penalty * h,   h = capacity - weights.x
+
+    The penalty is asymmetric: filling the knapsack costs penalty - 2*lagrange*h per
+    unit of weight, so an item is only added while its value density exceeds that,
+    and every unit above capacity costs more than the densest item returns.
+    """
+    density = values[weights > 0] / weights[weights > 0]
+    if not len(density):
+        density = np.ones(1)
+
+    # the densest item is never worth a capacity violation
+    penalty = density.max()
+    # and the least dense item still fits once about one mean weight is free
+    if lagrange is None:
+        spread = density.max() - density.min() or density.max()
+        lagrange = spread / (2 * max(weights.mean(), 1e-12))
+
+    # expand in S = weights.x: lagrange*S**2 + (penalty - 2*lagrange*capacity)*S + const
+    return ImplicitKnapsackModel(
+        cities, weights, values, lagrange,
+        penalty_linear=penalty - 2 * lagrange * capacity,
+        offset=lagrange * capacity**2 - penalty * capacity)
+
+
+def knapsack_bqm(cities, values, weights, total_capacity, value_r=0, weight_r=0,
+                 formulation='slack', lagrange=None):
     """
     build the knapsack binary quadratic model
     
@@ -44,75 +143,102 @@ def knapsack_bqm(cities, values, weights, total_capacity, value_r=0, weight_r=0)
                 but in the case of sick people we might consider that a closed city
                 retains some % of its sick people over time;
                 or for health problems it may contribute negative value (-1)
+
+        formulation: how the capacity inequality is encoded.
+                'slack' - Lucas's ceil(log(total_capacity)) slack variables (default);
+                'binary' - base-2 slack variables that represent every total up to
+                total_capacity;
+                'unbalanced' - no slack variables, an asymmetric quadratic penalty
+                on the unused capacity (see _unbalanced_model).
+
+        lagrange: penalty strength, max(values) for the slack formulations by default.
    
     """
 
-    # Initialize BQM - use large-capacity BQM so that the problem can be
-    # scaled by the user.
-    bqm = dimod.AdjVectorBQM(dimod.Vartype.BINARY)
+    with stage('knapsack_bqm', nodes=len(cities)) as record:
+        bqm = knapsack_implicit_model(cities, values, weights, total_capacity,
+                                      value_r=value_r, weight_r=weight_r,
+                                      formulation=formulation, lagrange=lagrange).to_bqm()
+        record['variables'] = bqm.num_variables
+        record['couplings'] = bqm.num_interactions
 
-    # Lagrangian multiplier
-    # First guess as suggested in Lucas's paper
-    lagrange = max(values)
+    return bqm
 
-    # Number of objects
-    x_size = len(values)
 
-    # Lucas's algorithm introduces additional slack variables to handle
-    # the inequality. max_y_index indicates the maximum index in the y
-    # sum; hence the number of slack variables.
-    max_y_index = ceil(log(total_capacity))
+def _sample_chunk(sampler, bqm, num_reads, seed):
+    return sampler.sample(bqm, num_reads=num_reads, seed=seed)
 
-    # Slack variable list for Lucas's algorithm. The last variable has
-    # a special value because it terminates the sequence.
-    y = [2**n for n in range(max_y_index - 1)]
-    y.append(total_capacity + 1 - 2**(max_y_index - 1))
 
-    # Q-Alpha - calculate the extra constant in second part of problem hamiltonian
-    C = sum([weight * weight_r for weight in weights])
-    
-    # Q-Alpha - change weights to weight*(1-weight_r)
-    weights = [weight*(1-weight_r) for weight in weights]
+def sample_reads(sampler, bqm, num_reads, num_workers=1):
+    """
+    take num_reads samples of bqm in a single sampleset
+    parameters:
+        sampler - dimod-style sampler accepting num_reads (neal or RankOneAnnealingSampler)
+        bqm - model accepted by the sampler
+        num_workers - 1 issues all reads in one call, otherwise the reads are split into
+                      one call per worker process; None uses all cores
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, num_reads))
 
-    # Q-Alpha - change values to value*(1-value_r)
-    values = [value*(1-value_r) for value in values]
-
-    # Hamiltonian xi-xi terms
-    for k in range(x_size):
-        # Q-Alpha add final term lagrange * C * weights[k]
-        bqm.set_linear(
-            cities[k],
-            lagrange * (weights[k] ** 2) - values[k] + lagrange * C * weights[k])
-
-    # Hamiltonian xi-xj terms
-    for i in range(x_size):
-        for j in range(i + 1, x_size):
-            key = (cities[i], cities[j])
-            bqm.quadratic[key] = 2 * lagrange * weights[i] * weights[j]
-
-    # Hamiltonian y-y terms
-    for k in range(max_y_index):
-        # Q-Alpha add final term -lagrange * C * y[k]
-        bqm.set_linear('y' + str(k), lagrange *
-                       (y[k]**2) - lagrange * C * y[k])
-
-    # Hamiltonian yi-yj terms
-    for i in range(max_y_index):
-        for j in range(i + 1, max_y_index):
-            key = ('y' + str(i), 'y' + str(j))
-            bqm.quadratic[key] = 2 * lagrange * y[i] * y[j]
-
-    # Hamiltonian x-y terms
-    for i in range(x_size):
-        for j in range(max_y_index):
-            key = (cities[i], 'y' + str(j))
-            bqm.quadratic[key] = -2 * lagrange * weights[i] * y[j]
+    if num_workers == 1:
+        return sampler.sample(bqm, num_reads=num_reads)
 
-    return bqm
+    chunks = [len(chunk) for chunk in np.array_split(np.arange(num_reads), num_workers)]
+    # forked workers inherit the parent's random state, so give each its own
+    # seed (31 bits, the range neal accepts)
+    seeds = [int(seed) >> 1 for seed in np.random.SeedSequence().generate_state(num_workers)]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        samplesets = list(executor.map(_sample_chunk, repeat(sampler), repeat(bqm), chunks, seeds))
+
+    return dimod.concatenate(samplesets)
+
+
+def _with_slack(model, in_knapsack):
+    """
+    complete the node assignment in_knapsack with the slack variables of model
+    that come closest to balancing it, so the sample has a comparable energy
+    """
+    x_size = len(in_knapsack)
+    slack = -model.weights[x_size:]
+    # the penalty lagrange*(S**2 + C*S) is smallest at S = -C/2
+    target = model.weights[:x_size] @ in_knapsack + model.penalty_linear / model.lagrange / 2
+
+    # largest slack coefficients first
+    y = np.zeros(len(slack), dtype=bool)
+    for k in np.argsort(-slack, kind='stable'):
+        if slack[k] <= target:
+            y[k] = True
+            target -= slack[k]
+
+    return np.concatenate((in_knapsack, y)).astype(np.int8)
+
+
+def _mask_sampleset(model, in_knapsack):
+    """single-sample sampleset of the node assignment in_knapsack under model"""
+    sample = _with_slack(model, in_knapsack)
+    return dimod.SampleSet.from_samples(
+        (sample, model.variables), dimod.Vartype.BINARY, model.energies(sample))
+
+
+def decode_sampleset(sampleset, nodes: List, values: List, status: List, value_r=0) -> SolutionSet:
+    """
+    decode every read of a knapsack sampleset
+    returns:
+        (SolutionSet) - the reads in order of least energy (maximum value) first; every
+                        item is a dictionary with the open/closed nodes, energy, value
+                        and used capacity
+    """
+    columns = [sampleset.variables.index(node) for node in nodes]
+    return SolutionSet.from_samples(sampleset.record.sample[:, columns], sampleset.record.energy,
+                                    nodes, values, status, value_r=value_r)
 
 
 def solve_nodes(nodes: List, values: List, status: List, total_capacity: int,
-                 value_r=0, weight_r=0, num_reads=1, verbose=False) -> Dict:
+                 value_r=0, weight_r=0, num_reads=1, verbose=False, backend='neal',
+                 num_workers=1, formulation='slack', cache=True, lagrange=None,
+                 time_limit=None) -> SolutionSet:
     """
     Solves problem: "Which cities should should be shut down in order to stay
     within healthcare resources constraints while maximizing overall GDP"
@@ -123,9 +249,25 @@ def solve_nodes(nodes: List, values: List, status: List, total_capacity: int,
         total_capacity - max capacity for sick people summed over all cities
         num_reads - number of samples to take
         verbose - whether to print out best result
+        backend - 'neal' to anneal the BQM of knapsack_bqm,
+                  'implicit' to anneal the rank-1 model of knapsack_implicit_model
+                  without materializing the n**2 couplings,
+                  'exact' for the proven optimum by dynamic programming or branch and bound
+        num_workers - number of processes the reads are spread over;
+                      1 issues all reads in one sampler call, None uses all cores
+        formulation - 'slack', 'binary' or 'unbalanced' encoding of the capacity
+                      constraint, see knapsack_bqm
+        cache - return the stored result of an identical earlier call, if any, and
+                store this one (see solution_cache); False always samples anew
+        lagrange - penalty strength, see knapsack_bqm; 'auto' picks it by a short sweep
+                   of candidate strengths (see penalty_tuning.tune_knapsack_lagrange)
+        time_limit - wall-clock budget in seconds: anneal in batches until it is used up
+                     instead of taking num_reads reads (see solve_nodes_anytime); such
+                     results are not cached
     returns:
-        (dict) - list of dictionaries with individual results and selected attributes
-                    sorted in order of least energy (maximum value) first
+        (SolutionSet) - the individual results, in order of least energy (maximum value)
+                        first; indexing or iterating it gives one dictionary per result
+                        with the open/closed nodes and the selected attributes
     """
     sum_status=sum(status)
     if sum_status < total_capacity:
@@ -133,106 +275,279 @@ def solve_nodes(nodes: List, values: List, status: List, total_capacity: int,
         print(f"Warning while solveing: Total utilized capacity needed {sum_status} is less ",
               f"than total capacity {total_capacity}. There's no knapsack problem to solve!")
 
-    bqm = knapsack_bqm(nodes, values, status, total_capacity, value_r=value_r, weight_r=weight_r)
-
-    #VGG sampler = LeapHybridSampler()
-    sampler = neal.SimulatedAnnealingSampler()
-    samplesets = [sampler.sample(bqm) for _ in range(num_reads)]
-
-    df = pd.DataFrame({'node': nodes, 'value': values, 'status': status})
-    df = df.set_index('node')
-
-    solution_set = []
-    for sampleset in samplesets:
-        open_cities = []
-        closed_cities = []
-        for k, v in sampleset.first.sample.items():
-            if k in nodes:
-                if v == 1:
-                    open_cities.append(k)
-                else:
-                    closed_cities.append(k)
-        solution_set.append({
-            'open_cities': open_cities,
-            'closed_cities': closed_cities,
-            'solution_indicator': sampleset.first.energy,
-            'total_value': sum(df.loc[open_cities]['value']) + sum(df.loc[closed_cities]['value']) * value_r,
-            'used_capacity': int(round(sum(df.loc[open_cities]['status'])))
-        })
-
-    # do sorting from lowest to highest energy (solution_indicator)
-    if num_reads > 1:
-        energies = [solution['solution_indicator'] for solution in solution_set]
-        solution_set = [x for _, x in sorted(zip(energies, solution_set))]
+    if time_limit is not None:
+        solution_set, _ = solve_nodes_anytime(
+            nodes, values, status, total_capacity, value_r=value_r, weight_r=weight_r,
+            time_limit=time_limit, verbose=verbose, backend=backend, formulation=formulation,
+            lagrange=lagrange, keep=max(num_reads, 2))
+        return solution_set
+
+    with stage('solve_nodes', nodes=len(nodes), backend=backend) as record:
+        solution_set = None
+        if cache:
+            key = solution_cache.solution_key(nodes, values, status, total_capacity, value_r, weight_r,
+                                              backend=backend, num_reads=num_reads,
+                                              formulation=formulation, lagrange=lagrange)
+            solution_set = solution_cache.get(key)
+            record['cache'] = 'miss' if solution_set is None else 'hit'
+
+        if solution_set is None:
+            lagrange = _resolve_lagrange(lagrange, nodes, values, status, total_capacity, value_r,
+                                         weight_r, formulation, backend, num_workers, cache)
+            solution_set = _sample_solution_set(nodes, values, status, total_capacity, value_r,
+                                                weight_r, num_reads, backend, num_workers, formulation,
+                                                lagrange)
+            if cache:
+                solution_cache.put(key, solution_set)
 
     if verbose:
-        print('\nBEST SOLUTION\n')
+        print_solutions(solution_set, values, total_capacity)
+
+    return solution_set
+
+
+def _resolve_lagrange(lagrange, nodes, values, status, total_capacity, value_r, weight_r,
+                      formulation, backend, num_workers=1, cache=True):
+    """lagrange as given, or the one picked by penalty_tuning for 'auto'"""
+    if lagrange != 'auto':
+        return lagrange
+    if backend == 'exact':
+        return None
+
+    from penalty_tuning import tune_knapsack_lagrange
+    with stage('tune_lagrange', nodes=len(nodes)) as record:
+        lagrange, _ = tune_knapsack_lagrange(
+            nodes, values, status, total_capacity, value_r=value_r, weight_r=weight_r,
+            formulation=formulation, backend=backend, num_workers=num_workers, cache=cache)
+        record['lagrange'] = lagrange
+    return lagrange
+
+
+def capacity_limit(status, total_capacity, weight_r=0):
+    """
+    the limit on sum(status*x) that knapsack_bqm encodes: with weight_r the constraint
+    is sum(status*(1-weight_r)*x) <= total_capacity - C/2, C = weight_r*sum(status)
+    (see knapsack_exact.solve_knapsack_exact)
+    """
+    if weight_r >= 1:
+        raise ValueError("the capacity limit requires weight_r < 1")
+    C = sum(status) * weight_r
+    return (total_capacity - C / 2) / (1 - weight_r)
+
+
+def _sample_solution_set(nodes, values, status, total_capacity, value_r, weight_r, num_reads,
+                         backend, num_workers, formulation, lagrange=None):
+    """build and sample the model of solve_nodes with backend and decode the samples"""
+    if backend == 'neal':
+        bqm = knapsack_bqm(nodes, values, status, total_capacity, value_r=value_r, weight_r=weight_r,
+                           formulation=formulation, lagrange=lagrange)
+        #VGG sampler = LeapHybridSampler()
+        sampler = neal.SimulatedAnnealingSampler()
+        with stage('sample', reads=num_reads, variables=len(bqm), workers=num_workers):
+            sampleset = sample_reads(sampler, bqm, num_reads, num_workers=num_workers)
+    elif backend == 'implicit':
+        with stage('knapsack_implicit_model', nodes=len(nodes)) as record:
+            bqm = knapsack_implicit_model(nodes, values, status, total_capacity,
+                                          value_r=value_r, weight_r=weight_r, formulation=formulation,
+                                          lagrange=lagrange)
+            record['variables'] = len(bqm)
+        sampler = RankOneAnnealingSampler()
+        with stage('sample', reads=num_reads, variables=len(bqm), workers=num_workers):
+            sampleset = sample_reads(sampler, bqm, num_reads, num_workers=num_workers)
+    elif backend == 'exact':
+        bqm = knapsack_implicit_model(nodes, values, status, total_capacity,
+                                      value_r=value_r, weight_r=weight_r, formulation=formulation)
+        with stage('solve_exact', variables=len(nodes)):
+            in_knapsack = solve_knapsack_exact(values, status, total_capacity,
+                                               value_r=value_r, weight_r=weight_r)
+        sampleset = _mask_sampleset(bqm, in_knapsack)
+    else:
+        raise ValueError(f"unknown backend {backend!r}, expected 'neal', 'implicit' or 'exact'")
+
+    with stage('decode', reads=len(sampleset), variables=len(nodes)):
+        solution_set = decode_sampleset(sampleset, nodes, values, status, value_r=value_r)
+
+    return solution_set
+
+
+def solve_nodes_anytime(nodes: List, values: List, status: List, total_capacity: int,
+                        value_r=0, weight_r=0, time_limit=2.0, verbose=False, backend='neal',
+                        formulation='slack', lagrange=None, keep=10):
+    """
+    solve_nodes within a wall-clock budget: annealing batches are taken until time_limit
+    seconds have passed (see anytime.anneal_until), keeping the best reads that stay
+    within the capacity
+    parameters:
+        time_limit - budget in seconds, including building the model
+        keep - number of solutions returned
+        other parameters as in solve_nodes; backend is 'neal' or 'implicit'
+    returns:
+        (SolutionSet, list) - solution set as returned by solve_nodes (reads over the
+                              capacity only if there are not enough feasible ones) and
+                              the convergence trace of anytime.anneal_until
+    """
+    from anytime import anneal_until, ising_beta_range
+
+    if backend not in ('neal', 'implicit'):
+        raise ValueError(f"unsupported backend {backend!r} for a time limit, expected 'neal' or 'implicit'")
+    # building the model counts against the budget
+    start = time.perf_counter()
+
+    lagrange = _resolve_lagrange(lagrange, nodes, values, status, total_capacity, value_r,
+                                 weight_r, formulation, backend)
+    model = knapsack_implicit_model(nodes, values, status, total_capacity, value_r=value_r,
+                                    weight_r=weight_r, formulation=formulation, lagrange=lagrange)
+    if backend == 'neal':
+        sampler, problem = neal.SimulatedAnnealingSampler(), model.to_bqm()
+        options = {'beta_range': ising_beta_range(problem)}
+    else:
+        sampler, problem = RankOneAnnealingSampler(), model
+        options = {}
+
+    n = len(nodes)
+    status_vector = np.asarray(status, dtype=float)
+    limit = capacity_limit(status, total_capacity, weight_r)
+    columns = []
+
+    def sample(num_reads, num_sweeps):
+        sampleset = sampler.sample(problem, num_reads=num_reads, num_sweeps=num_sweeps, **options)
+        if not columns:
+            columns.extend(sampleset.variables.index(v) for v in model.variables)
+        states = sampleset.record.sample[:, columns]
+        return states, sampleset.record.energy, states[:, :n] @ status_vector <= limit + 1e-9
+
+    with stage('solve_nodes_anytime', nodes=n, backend=backend, time_limit=time_limit) as record:
+        states, energies, _, trace = anneal_until(sample, time_limit, keep=keep, start=start)
+        record['reads'] = trace[-1]['reads']
+
+    with stage('decode', reads=len(states), variables=n):
+        solution_set = SolutionSet.from_samples(states[:, :n], energies, nodes, values, status,
+                                                value_r=value_r)
+    if verbose:
+        print_solutions(solution_set, values, total_capacity)
+
+    return solution_set, trace
+
+
+def print_solutions(solution_set: SolutionSet, values: List, total_capacity: int):
+    """print the best and, when there is one, the next best solution of solution_set"""
+    print('\nBEST SOLUTION\n')
+    print('nodes in the knapsack:')
+    print(solution_set[0]['open_cities'])
+    print('\n')
+    print('nodes outside the knapsack:')
+    print(solution_set[0]['closed_cities'])
+    print('\n')
+    total_value = sum(values)
+    solutin_value = solution_set[0]['total_value']
+    print(
+          f'Total Impact Value: {solutin_value} of {total_value} ({(100*solutin_value/total_value):.1f}%)')
+    used_capacity = solution_set[0]['used_capacity']
+    print(
+        f'Used up capacity: {used_capacity:d} of {total_capacity} ({(100*used_capacity/total_capacity):.1f}%)')
+
+    if len(solution_set) > 1:
+        print('\nNEXT BEST SOLUTION\n')
         print('nodes in the knapsack:')
-        print(solution_set[0]['open_cities'])
+        print(solution_set[1]['open_cities'])
         print('\n')
         print('nodes outside the knapsack:')
-        print(solution_set[0]['closed_cities'])
+        print(solution_set[1]['closed_cities'])
         print('\n')
-        total_value = sum(df['value'])
-        solutin_value = solution_set[0]['total_value']
+        total_value = sum(values)
+        solutin_value = solution_set[1]['total_value']
         print(
-              f'Total Impact Value: {solutin_value} of {total_value} ({(100*solutin_value/total_value):.1f}%)')
-        used_capacity = solution_set[0]['used_capacity']
+            f'Total Impact Value: {solutin_value} of {total_value} ({(100*solutin_value/total_value):.1f}%)')
+        used_capacity = solution_set[1]['used_capacity']
         print(
             f'Used up capacity: {used_capacity:d} of {total_capacity} ({(100*used_capacity/total_capacity):.1f}%)')
 
-        if num_reads > 1:
-            print('\nNEXT BEST SOLUTION\n')
-            print('nodes in the knapsack:')
-            print(solution_set[1]['open_cities'])
-            print('\n')
-            print('nodes outside the knapsack:')
-            print(solution_set[1]['closed_cities'])
-            print('\n')
-            total_value = sum(df['value'])
-            solutin_value = solution_set[1]['total_value']
-            print(
-                f'Total Impact Value: {solutin_value} of {total_value} ({(100*solutin_value/total_value):.1f}%)')
-            used_capacity = solution_set[1]['used_capacity']
-            print(
-                f'Used up capacity: {used_capacity:d} of {total_capacity} ({(100*used_capacity/total_capacity):.1f}%)')
+
+def solve_nodes_decomposed(nodes: List, values: List, status: List, total_capacity: int,
+                           value_r=0, weight_r=0, num_reads=1, verbose=False, backend='neal',
+                           num_workers=None, formulation='slack', groups: List = None,
+                           block_size=100, max_rounds=10) -> SolutionSet:
+    """
+    solve_nodes for instances too large for a single BQM: sub-problems of at most
+    block_size nodes are solved with backend in num_workers processes and merged
+    under the total capacity (see knapsack_decompose.solve_decomposed)
+    parameters:
+        groups - group label per node (e.g. State) to split by; None splits by impact
+        other parameters as in solve_nodes
+    returns:
+        (SolutionSet) - a single result, as returned by solve_nodes
+    """
+    from knapsack_decompose import solve_decomposed
+
+    if weight_r >= 1:
+        raise ValueError("decomposition requires weight_r < 1")
+
+    # the constraint encoded by knapsack_bqm on the unscaled weights; value_r does
+    # not change the allocation
+    capacity = capacity_limit(status, total_capacity, weight_r)
+
+    with stage('solve_decomposed', nodes=len(nodes), backend=backend, block_size=block_size) as record:
+        in_knapsack, history = solve_decomposed(
+            values, status, capacity, groups=groups, block_size=block_size, backend=backend,
+            num_reads=num_reads, num_workers=num_workers, formulation=formulation,
+            max_rounds=max_rounds)
+        record['rounds'] = len(history) - 1
+
+    model = knapsack_implicit_model(nodes, values, status, total_capacity,
+                                    value_r=value_r, weight_r=weight_r, formulation=formulation)
+    with stage('decode', reads=1, variables=len(nodes)):
+        solution_set = decode_sampleset(_mask_sampleset(model, in_knapsack), nodes, values, status,
+                                        value_r=value_r)
+
+    if verbose:
+        print_solutions(solution_set, values, total_capacity)
 
     return solution_set
 
 
 def solve_nodes_using_csv(filepath: str, total_capacity: int, value_r=0, weight_r=0,
-                          num_reads=1, verbose=False) -> Dict:
+                          num_reads=1, verbose=False, max_nodes=100, decompose=None,
+                          **kwargs) -> SolutionSet:
     """
     Example: to solve for cities as nodes the given a csv file must be in the format:
     cities, gdps, and sick people where the cvs file needs to have the header: city, gdp, sick;
     In general the format will be: nodes,capacity,value,status; #VGG
+    The file is read with ingest.read_hospital_nodes: csv, Parquet or Arrow in the
+    H_Beds.csv schema, or nodes saved by ingest.save_nodes.
+    max_nodes - number of nodes (City/State pairs) considered, None for all of them
+    decompose - None solves a single BQM with solve_nodes; 'state' or 'impact' uses
+                solve_nodes_decomposed, split by the State column or by impact
+    Other keyword arguments (e.g. backend) are passed on to solve_nodes.
     """
-    df0 = pd.read_csv(filepath)
-    
-    #VGG update to the new data format of node, capacity, status
-    #assert ','.join(df.columns) == 'node,value,status', "Ensure csv header is node,value,status"
-
-    #assert ','.join(df.columns) == 'city,gdp,sick', "Ensure csv header is city,gdp,sick"
-    #solution_set = solve_cities(list(df['city']), list(df['gdp']), list(df['sick']), total_capacity, 
-    
-    #"City","State","Total","Available","ICUs","Available_ICU"
-    df1 = pd.DataFrame()
-    df1['node']=df0['City']
-    #df1['status']=abs(df0['ICUs']-df0['Available_ICU']) #number of sick people in the ICU
-    df1['status']=(5*df0['ICUs']//5 +10*abs(df0['Total']-df0['ICUs'])//10) 
-    #assume medical team of 5 and  vaccine efficiency 85%
-    df1['value']=(5*(df0['ICUs']//5 +abs(df0['Total']-df0['Available']-df0['ICUs'])//10)*85)//100 
+    with stage('read_csv', path=filepath) as record:
+        #"City","State","Total","Available","ICUs","Available_ICU", streamed in chunks
+        #and aggregated per City/State into node, state, status and value
+        df1 = read_hospital_nodes(filepath)
+        record['nodes'] = len(df1)
 	
-    df=df1[0:100] #consider 100 cities
+    df=df1[0:max_nodes] #consider 100 cities by default
 
     #VGG note the weight_r has to be selected so that the over all number of sick people is under the max. value
     
-    solution_set = solve_nodes(list(df['node']), list(df['value']), list(df['status']), #list(df['capacity']),
-        total_capacity, value_r=value_r, weight_r=weight_r, num_reads=num_reads, verbose=verbose)
+    if decompose is None:
+        solution_set = solve_nodes(list(df['node']), list(df['value']), list(df['status']), #list(df['capacity']),
+            total_capacity, value_r=value_r, weight_r=weight_r, num_reads=num_reads, verbose=verbose,
+            **kwargs)
+    elif decompose in ('state', 'impact'):
+        groups = list(df['state']) if decompose == 'state' else None
+        solution_set = solve_nodes_decomposed(list(df['node']), list(df['value']), list(df['status']),
+            total_capacity, value_r=value_r, weight_r=weight_r, num_reads=num_reads, verbose=verbose,
+            groups=groups, **kwargs)
+    else:
+        raise ValueError(f"unknown decomposition {decompose!r}, expected 'state' or 'impact'")
     
     return solution_set
 
 
+def _lagrange(text):
+    return text if text == 'auto' else float(text)
+
+
 def main():
     """ CLI
     """
@@ -247,12 +562,55 @@ def main():
                         help="Maximum capacity for all nodes combined.")
     parser.add_argument('--num-reads', '-n', type=int, default=1,
                         help="Number of sample solutines to return")
+    parser.add_argument('--backend', '-b', choices=['neal', 'implicit', 'exact'], default='neal',
+                        help="Sampler backend; 'implicit' keeps memory linear in the number of nodes, "
+                             "'exact' returns the proven optimum")
+    parser.add_argument('--formulation', '-f', choices=['slack', 'binary', 'unbalanced'],
+                        default='slack', help="Encoding of the capacity constraint in the BQM")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help="Number of processes to spread the reads (or, with --decompose, "
+                             "the sub-problems) over (0 for all cores)")
+    parser.add_argument('--decompose', choices=['state', 'impact'],
+                        help="Split the nodes into sub-problems by State or by impact, solve them "
+                             "in parallel and merge them; considers every node unless --max-nodes is given")
+    parser.add_argument('--block-size', type=int, default=100,
+                        help="Largest number of nodes in a sub-problem of --decompose")
+    parser.add_argument('--max-nodes', type=int,
+                        help="Number of nodes read from the csv file (0 for all); "
+                             "100 by default without --decompose")
+    parser.add_argument('--trace',
+                        help="Record the time, CPU time and memory of every stage to this file; "
+                             "Chrome trace format for *.json, JSON lines otherwise")
+    parser.add_argument('--lagrange', type=_lagrange,
+                        help="Penalty strength of the capacity constraint, or 'auto' to pick it by "
+                             "a short sweep of candidates (cached per problem); not used with --decompose")
+    parser.add_argument('--time-limit', type=float,
+                        help="Anneal in batches for this many seconds instead of taking "
+                             "--num-reads reads (--trace records every batch); not used with --decompose")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always anneal, even when an identical problem was solved before")
+    parser.add_argument('--disk-cache', action='store_true',
+                        help="Keep solutions and --lagrange auto sweeps on disk (under $QUANTUM_CHAIN_CACHE) "
+                             "across runs")
                         
     args = parser.parse_args()
+
+    max_nodes = args.max_nodes
+    if max_nodes is None:
+        max_nodes = None if args.decompose else 100
+    # the decomposition solves its sub-problems uncached
+    options = ({'block_size': args.block_size} if args.decompose
+               else {'cache': not args.no_cache, 'lagrange': args.lagrange,
+                     'time_limit': args.time_limit})
+    solution_cache.configure(disk=args.disk_cache)
+    penalty_tuning.configure(disk=args.disk_cache)
     
-    solution_set = solve_nodes_using_csv(
-        args.data, args.total_capacity, value_r=0.01, weight_r=0.02, 
-        num_reads=args.num_reads, verbose=True) 
+    with tracing(args.trace):
+        solution_set = solve_nodes_using_csv(
+            args.data, args.total_capacity, value_r=0.01, weight_r=0.02, 
+            num_reads=args.num_reads, verbose=True, backend=args.backend,
+            num_workers=args.workers or None, formulation=args.formulation,
+            max_nodes=max_nodes or None, decompose=args.decompose, **options) 
         #see the function knapsack_bqm for details 
         #for GDP use value_r=.8, weight_r=0.2
         #VGG note the weight_r has to be selected so that the over all number of sick people is under the max. value
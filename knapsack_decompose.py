@@ -0,0 +1,209 @@
+#decomposition solver for knapsack instances too large for a single BQM
+
+#in the spirit of qbsolv: start from a greedy allocation, cut the nodes into
+#sub-problems of at most block_size nodes (per State, or the nodes whose decision
+#is least certain), give every sub-problem a share of the capacity, solve them in
+#parallel worker processes with any knapsack.solve_nodes backend and merge the
+#results under the global capacity constraint. Rounds repeat while they improve
+#the total value. Only block_size**2 couplings exist at any time in any worker.
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+import knapsack
+
+
+def greedy_fill(values, weights, capacity, in_knapsack=None):
+    """
+    add nodes by decreasing value density while they fit
+    parameters:
+        values, weights - node values and weights
+        capacity - capacity available to all nodes together
+        in_knapsack - boolean mask of nodes already in the knapsack
+    returns:
+        (numpy.ndarray) - boolean mask of the nodes in the knapsack
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    if in_knapsack is None:
+        in_knapsack = np.zeros(len(values), dtype=bool)
+    in_knapsack = np.array(in_knapsack, dtype=bool)
+
+    room = capacity - weights @ in_knapsack
+    for i in _by_density(values, weights, ~in_knapsack & (values > 0)):
+        if weights[i] <= room:
+            in_knapsack[i] = True
+            room -= weights[i]
+
+    return in_knapsack
+
+
+def repair(values, weights, capacity, in_knapsack):
+    """
+    make in_knapsack feasible by removing the least dense nodes, then fill
+    the capacity that is left with greedy_fill
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    in_knapsack = np.array(in_knapsack, dtype=bool)
+
+    excess = weights @ in_knapsack - capacity
+    for i in _by_density(values, weights, in_knapsack)[::-1]:
+        if excess <= 0:
+            break
+        in_knapsack[i] = False
+        excess -= weights[i]
+
+    return greedy_fill(values, weights, capacity, in_knapsack)
+
+
+def _by_density(values, weights, mask):
+    """indices of mask, densest first (nodes that weigh nothing come first)"""
+    items = np.flatnonzero(mask)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = np.where(weights[items] > 0, values[items] / weights[items], np.inf)
+    return items[np.argsort(-density, kind='stable')]
+
+
+def partition_by_group(groups, block_size):
+    """
+    one block per group label (e.g. the State column), groups larger than
+    block_size are cut into equal parts
+    returns:
+        (list) - index arrays of the blocks
+    """
+    groups = np.asarray(groups)
+    _, inverse = np.unique(groups, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+
+    blocks = []
+    for members in np.split(order, bounds):
+        parts = -(-len(members) // block_size)
+        blocks.extend(np.array_split(members, parts))
+    return blocks
+
+
+def partition_by_impact(values, weights, in_knapsack, block_size, num_blocks, rng):
+    """
+    the block_size*num_blocks nodes whose value density is closest to the density
+    at which the current allocation stops taking nodes, i.e. those a flip changes
+    the energy least for, dealt at random into num_blocks blocks; the others stay fixed
+    returns:
+        (list) - index arrays of the blocks
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    movable = np.flatnonzero(weights > 0)
+    if not len(movable):
+        return []
+    density = values[movable] / weights[movable]
+
+    inside = in_knapsack[movable]
+    lowest_in = density[inside].min() if inside.any() else density.max()
+    highest_out = density[~inside].max() if (~inside).any() else density.min()
+    threshold = (lowest_in + highest_out) / 2
+
+    size = min(block_size * num_blocks, len(movable))
+    selected = movable[np.argsort(np.abs(density - threshold), kind='stable')[:size]]
+    selected = rng.permutation(selected)
+    return [block for block in np.array_split(selected, -(-size // block_size)) if len(block)]
+
+
+def _budgets(weights, capacity, in_knapsack, blocks):
+    """
+    capacity of every block: the weight it holds now plus a share of the free
+    capacity proportional to the weight of its nodes outside the knapsack
+    """
+    used = np.array([weights[block] @ in_knapsack[block] for block in blocks])
+    outside = np.array([weights[block] @ ~in_knapsack[block] for block in blocks])
+    free = max(capacity - weights @ in_knapsack, 0)
+    share = outside / outside.sum() if outside.sum() > 0 else np.zeros(len(blocks))
+    # floored so the blocks together never exceed the capacity
+    return np.floor(used + free * share)
+
+
+def _solve_block(values, weights, budget, backend, num_reads, formulation):
+    """solve one sub-problem with knapsack.solve_nodes, returns the boolean mask"""
+    if weights.sum() <= budget:
+        # everything fits, no knapsack problem to solve
+        return values > 0
+    if budget < 2:
+        # too little room for the slack variables of the BQM, at most a node of weight 1 fits
+        return greedy_fill(values, weights, budget)
+
+    # positional labels: node names need not be unique across the whole instance
+    solution_set = knapsack.solve_nodes(
+        list(range(len(values))), values, weights, int(budget), num_reads=num_reads,
+        backend=backend, formulation=formulation, cache=False)
+    return solution_set.in_knapsack(0)
+
+
+def solve_decomposed(values, weights, capacity, groups=None, block_size=100, backend='neal',
+                     num_reads=1, num_workers=None, formulation='slack', max_rounds=10,
+                     patience=2, seed=None):
+    """
+    knapsack allocation of a large instance by decomposition
+    parameters:
+        values, weights - node values and weights
+        capacity - capacity available to all nodes together
+        groups - group label per node (e.g. State) to partition by; None partitions
+                 by impact, the nodes closest to the current density threshold
+        block_size - largest number of nodes in a sub-problem
+        backend, num_reads, formulation - how sub-problems are solved, see knapsack.solve_nodes
+        num_workers - number of worker processes, None uses all cores
+        max_rounds - largest number of solve and merge rounds
+        patience - stop after this many rounds in a row without improvement
+        seed - seed for the random dealing of nodes into impact blocks
+    returns:
+        (numpy.ndarray, list) - boolean mask of the nodes in the knapsack and the
+                                total value after the greedy start and every round
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+
+    in_knapsack = greedy_fill(values, weights, capacity)
+    history = [float(values @ in_knapsack)]
+    if groups is not None:
+        blocks = partition_by_group(groups, block_size)
+
+    executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        stalled = 0
+        for _ in range(max_rounds):
+            if groups is None:
+                blocks = partition_by_impact(values, weights, in_knapsack, block_size,
+                                             max(num_workers, 1), rng)
+            if not blocks:
+                break
+            budgets = _budgets(weights, capacity, in_knapsack, blocks)
+
+            tasks = ([values[block] for block in blocks], [weights[block] for block in blocks],
+                     budgets, [backend] * len(blocks), [num_reads] * len(blocks),
+                     [formulation] * len(blocks))
+            masks = executor.map(_solve_block, *tasks) if executor else map(_solve_block, *tasks)
+
+            candidate = in_knapsack.copy()
+            for block, mask in zip(blocks, masks):
+                candidate[block] = mask
+            candidate = repair(values, weights, capacity, candidate)
+
+            value = float(values @ candidate)
+            history.append(value)
+            if value > values @ in_knapsack + 1e-9:
+                in_knapsack = candidate
+                stalled = 0
+            else:
+                stalled += 1
+                if stalled >= patience:
+                    break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return in_knapsack, history
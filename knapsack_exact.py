@@ -0,0 +1,204 @@
+#exact classical solvers for the 0/1 knapsack problem behind knapsack.solve_nodes
+
+#the dynamic program is pseudo-polynomial, O(n * capacity) time and bits of memory
+#(the table of taken items is packed with numpy.packbits), and is used for integer
+#weights; branch and bound with the Dantzig (fractional) bound handles everything
+#else. Both return the proven optimum. The branch and bound search is stopped after
+#MAX_BNB_NODES search nodes; the dynamic program then takes over if the weights are
+#integer and its table has at most FALLBACK_DP_CELLS entries, otherwise the best
+#knapsack found so far is returned with a warning.
+
+from bisect import bisect_right
+from math import gcd
+from functools import reduce
+import warnings
+
+import numpy as np
+
+# search nodes of the branch and bound before it gives up (about half a second)
+MAX_BNB_NODES = 10**6
+
+# largest dynamic program table (items x capacities, one bit each) run when the
+# branch and bound gives up
+FALLBACK_DP_CELLS = 5 * 10**8
+
+
+def knapsack_dp(values, weights, capacity):
+    """
+    0/1 knapsack by dynamic programming over the capacity
+    parameters:
+        values - item values
+        weights - non-negative integer item weights
+        capacity - non-negative integer capacity
+    returns:
+        (numpy.ndarray) - boolean mask of the items in the knapsack
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=np.int64)
+    in_knapsack = np.zeros(len(values), dtype=bool)
+
+    # items that weigh nothing are taken whenever they are worth something
+    free = weights == 0
+    in_knapsack[free] = values[free] > 0
+
+    items = np.flatnonzero(~free & (values > 0) & (weights <= capacity))
+    if not len(items) or capacity <= 0:
+        return in_knapsack
+
+    # dividing by the common divisor shrinks the table without changing the problem
+    divisor = reduce(gcd, weights[items].tolist())
+    item_weights = weights[items] // divisor
+    capacity = int(capacity) // divisor
+
+    # best[c] is the largest value of the items seen so far with weight <= c;
+    # bit c of keep[k] is set when item k is taken at capacity c
+    best = np.zeros(capacity + 1)
+    keep = np.zeros((len(items), capacity // 8 + 1), dtype=np.uint8)
+    take = np.zeros(capacity + 1, dtype=bool)
+    for k, (w, v) in enumerate(zip(item_weights.tolist(), values[items].tolist())):
+        candidate = best[:capacity + 1 - w] + v
+        take[:w] = False
+        np.greater(candidate, best[w:], out=take[w:])
+        keep[k] = np.packbits(take)
+        np.maximum(best[w:], candidate, out=best[w:])
+
+    c = capacity
+    for k in range(len(items) - 1, -1, -1):
+        if (keep[k, c >> 3] >> (7 - (c & 7))) & 1:
+            in_knapsack[items[k]] = True
+            c -= item_weights[k]
+
+    return in_knapsack
+
+
+def knapsack_branch_and_bound(values, weights, capacity, max_nodes=None):
+    """
+    0/1 knapsack by depth-first branch and bound
+    parameters:
+        values - item values
+        weights - non-negative item weights
+        capacity - capacity
+        max_nodes - stop after exploring this many search nodes (None for no limit)
+    returns:
+        (numpy.ndarray, bool) - boolean mask of the items in the knapsack and
+                                whether the search finished, i.e. the mask is optimal
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    in_knapsack = np.zeros(len(values), dtype=bool)
+
+    free = weights <= 0
+    in_knapsack[free] = values[free] > 0
+
+    candidates = np.flatnonzero(~free & (values > 0) & (weights <= capacity))
+    if not len(candidates) or capacity <= 0:
+        return in_knapsack, True
+
+    # branch on items by decreasing value density so the fractional bound is tight
+    items = candidates[np.argsort(-values[candidates] / weights[candidates], kind='stable')]
+    v = values[items].tolist()
+    w = weights[items].tolist()
+    n = len(items)
+    cum_w = np.concatenate(([0.0], np.cumsum(w))).tolist()
+    cum_v = np.concatenate(([0.0], np.cumsum(v))).tolist()
+
+    def upper_bound(i, room):
+        # whole items i..k-1 fit, item k (if any) is taken fractionally
+        k = bisect_right(cum_w, room + cum_w[i], lo=i) - 1
+        bound = cum_v[k] - cum_v[i]
+        if k < n:
+            bound += (room - (cum_w[k] - cum_w[i])) * v[k] / w[k]
+        return bound
+
+    # greedy incumbent
+    x = [False] * n
+    room = capacity
+    for i in range(n):
+        if w[i] <= room:
+            x[i] = True
+            room -= w[i]
+    best_x = list(x)
+    best_value = sum(vi for vi, xi in zip(v, x) if xi)
+
+    explored = 0
+    finished = True
+    # stack of (depth, value, room, decision for item depth-1)
+    x = [False] * n
+    stack = [(0, 0.0, float(capacity), None)]
+    while stack:
+        depth, value, room, decision = stack.pop()
+        if decision is not None:
+            x[depth - 1] = decision
+
+        explored += 1
+        if max_nodes is not None and explored > max_nodes:
+            finished = False
+            break
+
+        if depth == n:
+            if value > best_value:
+                best_value = value
+                best_x = list(x)
+            continue
+
+        if value + upper_bound(depth, room) <= best_value:
+            continue
+
+        stack.append((depth + 1, value, room, False))
+        if w[depth] <= room:
+            stack.append((depth + 1, value + v[depth], room - w[depth], True))
+
+    in_knapsack[items] = best_x
+    return in_knapsack, finished
+
+
+def solve_knapsack_exact(values, weights, total_capacity, value_r=0, weight_r=0,
+                         method='auto', max_dp_cells=5 * 10**7, max_nodes=MAX_BNB_NODES):
+    """
+    proven optimum of the knapsack problem encoded by knapsack.knapsack_bqm
+
+    With the Q-Alpha adjustments the BQM maximizes sum(values*(1-value_r)*x) and
+    penalizes lagrange*(S**2 + C*S), S = sum(weights*(1-weight_r)*x) - slack,
+    C = weight_r*sum(weights). The penalty is smallest at S = -C/2, so the
+    constraint it encodes is sum(weights*(1-weight_r)*x) <= total_capacity - C/2.
+    parameters:
+        values, weights, total_capacity, value_r, weight_r - as in knapsack.knapsack_bqm
+        method - 'dp', 'bnb' or 'auto' (dp for integer weights when the table has at
+                 most max_dp_cells entries, branch and bound otherwise)
+        max_nodes - search nodes of the branch and bound before it falls back to the
+                    dynamic program (None for no limit), see FALLBACK_DP_CELLS
+    returns:
+        (numpy.ndarray) - boolean mask of the nodes in the knapsack
+    """
+    if weight_r >= 1:
+        raise ValueError("the exact backend requires weight_r < 1")
+
+    values = np.asarray(values, dtype=float) * (1 - value_r)
+    weights = np.asarray(weights, dtype=float)
+
+    C = weights.sum() * weight_r
+    # same constraint on the unscaled weights, which keeps them integer for the DP
+    capacity = (total_capacity - C / 2) / (1 - weight_r)
+    if capacity < 0:
+        return np.zeros(len(values), dtype=bool)
+
+    integer = np.all(weights == np.round(weights)) and np.all(weights >= 0)
+    cells = len(values) * (int(capacity) + 1)
+    if method == 'auto':
+        method = 'dp' if integer and cells <= max_dp_cells else 'bnb'
+
+    if method == 'dp':
+        if not integer:
+            raise ValueError("the dynamic program requires non-negative integer weights")
+        return knapsack_dp(values, weights.astype(np.int64), int(capacity))
+    elif method == 'bnb':
+        in_knapsack, finished = knapsack_branch_and_bound(values, weights, capacity, max_nodes)
+        if finished:
+            return in_knapsack
+        if integer and cells <= FALLBACK_DP_CELLS:
+            return knapsack_dp(values, weights.astype(np.int64), int(capacity))
+        warnings.warn(f"branch and bound stopped after {max_nodes} search nodes, the knapsack "
+                      f"may not be optimal", RuntimeWarning)
+        return in_knapsack
+    else:
+        raise ValueError(f"unknown method {method!r}, expected 'auto', 'dp' or 'bnb'")
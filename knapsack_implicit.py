@@ -0,0 +1,150 @@
+#implicit (rank-1) form of the knapsack hamiltonian built by knapsack.knapsack_bqm
+
+#every quadratic term of the knapsack BQM is 2*lagrange*a_i*a_j, an outer product
+#of the combined weight/slack vector a. The energy of a binary state z is therefore
+#
+#   E(z) = lagrange * S**2 + penalty_linear * S - values.z + offset,   S = a.z
+#
+#so the model only needs a, values and two constants: memory is linear in the
+#number of nodes and a single flip changes the energy by an O(1) expression of S.
+
+from math import log
+
+import numpy as np
+import dimod
+
+
+class ImplicitKnapsackModel:
+    """
+    knapsack model stored as the vectors of its rank-1 hamiltonian
+    parameters:
+        variables - labels of the city and slack variables
+        weights - combined weight vector a (slack variables enter with negative weight)
+        values - value of each variable (0 for slack variables)
+        lagrange - coefficient of S**2
+        penalty_linear - coefficient of S
+        offset - constant energy offset
+    """
+
+    def __init__(self, variables, weights, values, lagrange, penalty_linear=0.0, offset=0.0):
+        self.variables = list(variables)
+        self.weights = np.asarray(weights, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.lagrange = float(lagrange)
+        self.penalty_linear = float(penalty_linear)
+        self.offset = float(offset)
+
+        if not len(self.variables) == len(self.weights) == len(self.values):
+            raise ValueError("variables, weights and values must have the same length")
+
+    def __len__(self):
+        return len(self.variables)
+
+    @property
+    def linear(self):
+        """linear biases of the equivalent BQM"""
+        a = self.weights
+        return self.lagrange * a**2 + self.penalty_linear * a - self.values
+
+    def energies(self, samples):
+        """energies of an (num_samples, num_variables) array of binary states"""
+        samples = np.atleast_2d(np.asarray(samples, dtype=float))
+        S = samples @ self.weights
+        return self.lagrange * S**2 + self.penalty_linear * S - samples @ self.values + self.offset
+
+    def to_bqm(self):
+        """materialize the n**2 couplings as a dimod BQM"""
+        a = self.weights
+        row, col = np.triu_indices(len(a), k=1)
+        quadratic = 2 * self.lagrange * a[row] * a[col]
+
+        # Initialize BQM - use large-capacity BQM so that the problem can be
+        # scaled by the user.
+        return dimod.AdjVectorBQM.from_numpy_vectors(
+            self.linear, (row, col, quadratic), self.offset, dimod.Vartype.BINARY,
+            variable_order=self.variables)
+
+
+class RankOneAnnealingSampler:
+    """
+    simulated annealing sampler for ImplicitKnapsackModel
+
+    Each sweep visits the variables in order and applies the Metropolis rule.
+    The energy change of flipping variable i is 2*lagrange*d*S + c_i with
+    d = a_i*(1-2*z_i), so with S kept as a running sum no coupling is ever read.
+    """
+
+    parameters = {'num_reads': [], 'num_sweeps': [], 'beta_range': [],
+                  'seed': [], 'initial_states': []}
+
+    def sample(self, model, num_reads=1, num_sweeps=1000, beta_range=None, seed=None,
+               initial_states=None):
+        """
+        parameters:
+            model - ImplicitKnapsackModel
+            num_reads - number of independent anneals
+            num_sweeps - number of sweeps over all variables per anneal
+            beta_range - (hot, cold) inverse temperatures of the geometric schedule;
+                         estimated from the model biases like neal when omitted
+            seed - seed for the random number generator
+            initial_states - (num_reads, num_variables) array of binary start states
+        returns:
+            (dimod.SampleSet) - one sample per read
+        """
+        rng = np.random.default_rng(seed)
+        n = len(model)
+
+        if initial_states is None:
+            states = rng.integers(0, 2, size=(num_reads, n), dtype=np.int8)
+        else:
+            states = np.array(initial_states, dtype=np.int8, ndmin=2)
+            if states.shape != (num_reads, n):
+                states = states[np.arange(num_reads) % len(states)]
+
+        if beta_range is None:
+            beta_range = default_beta_range(model)
+        betas = np.geomspace(beta_range[0], beta_range[1], num_sweeps)
+
+        a = model.weights
+        lagrange = model.lagrange
+        for state in states:
+            for beta in betas:
+                _sweep(state, a, model.values, lagrange, model.penalty_linear, beta, rng)
+
+        return dimod.SampleSet.from_samples(
+            (states, model.variables), dimod.Vartype.BINARY, model.energies(states),
+            info={'beta_range': tuple(beta_range)})
+
+
+def _sweep(state, a, values, lagrange, penalty_linear, beta, rng):
+    """one in-place Metropolis sweep over a single binary state"""
+    sign = 1 - 2 * state.astype(float)
+    d = a * sign
+    c = lagrange * d**2 + penalty_linear * d - values * sign
+    # accept the flip when dE < -log(u)/beta, i.e. when g*S < r
+    g = (2 * lagrange * d).tolist()
+    r = (-np.log(rng.random(len(a))) / beta - c).tolist()
+
+    S = float(state @ a)
+    flipped = []
+    for i, (g_i, r_i, d_i) in enumerate(zip(g, r, d.tolist())):
+        if g_i * S < r_i:
+            S += d_i
+            flipped.append(i)
+    state[flipped] ^= 1
+
+
+def default_beta_range(model):
+    """
+    (hot, cold) inverse temperatures: a flip costing the largest possible energy
+    is accepted with probability 50% at the start and the smallest one with 1% at the end
+    """
+    a = np.abs(model.weights)
+    linear = np.abs(model.linear)
+    coupling = 2 * abs(model.lagrange) * a
+
+    max_delta = np.max(linear + coupling * (a.sum() - a))
+    nonzero = np.concatenate((linear[linear > 0], (coupling * a)[a > 0]))
+    min_delta = nonzero.min() if len(nonzero) else 1.0
+
+    return log(2) / max(max_delta, 1e-12), log(100) / max(min_delta, 1e-12)
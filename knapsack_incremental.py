@@ -0,0 +1,263 @@
+#incremental re-solve of the knapsack allocation while hospitals' data changes
+
+#Step 3 of the README re-balances the distribution mid-way when a few nodes change.
+#IncrementalKnapsackSolver keeps the knapsack model, the BQM (once a full neal solve
+#has built it) and the best sample. An update patches only the biases touched by the
+#changed nodes and resolve() re-anneals a sub-problem: the changed nodes, the slack
+#variables and the nodes closest to the current density threshold, with every other
+#node clamped to its previous value. Because the model is rank-1 (see
+#knapsack_implicit), clamped nodes only shift the penalty by a constant, so the
+#sub-problem is again an ImplicitKnapsackModel and its size follows the change.
+
+import numpy as np
+import dimod
+import neal
+
+from knapsack import knapsack_implicit_model, decode_sampleset, sample_reads
+from knapsack_implicit import ImplicitKnapsackModel, RankOneAnnealingSampler
+from instrumentation import stage
+
+
+class IncrementalKnapsackSolver:
+    """
+    knapsack allocation of knapsack.solve_nodes that is kept up to date as nodes change
+    parameters:
+        nodes, values, status, total_capacity, value_r, weight_r - as in knapsack.solve_nodes
+        lagrange - penalty strength, max(values) of the initial nodes by default; it is
+                   kept fixed across updates so that an update only touches changed nodes
+        backend - 'neal' or 'implicit', the sampler of solve and resolve
+        formulation - 'slack' or 'binary' encoding of the capacity constraint
+        neighbourhood - number of unchanged nodes re-annealed with the changed ones
+    """
+
+    def __init__(self, nodes, values, status, total_capacity, value_r=0, weight_r=0,
+                 lagrange=None, backend='neal', formulation='slack', neighbourhood=32):
+        if formulation not in ('slack', 'binary'):
+            raise ValueError(f"unsupported formulation {formulation!r} for incremental solving, "
+                             "expected 'slack' or 'binary'")
+        if backend not in ('neal', 'implicit'):
+            raise ValueError(f"unknown backend {backend!r}, expected 'neal' or 'implicit'")
+
+        self.nodes = list(nodes)
+        self.values = np.asarray(values, dtype=float)
+        self.status = np.asarray(status, dtype=float)
+        self.total_capacity = total_capacity
+        self.value_r = value_r
+        self.weight_r = weight_r
+        self.lagrange = max(values) if lagrange is None else lagrange
+        self.backend = backend
+        self.formulation = formulation
+        self.neighbourhood = neighbourhood
+
+        self._index = {node: i for i, node in enumerate(self.nodes)}
+        if len(self._index) != len(self.nodes):
+            raise ValueError("node labels must be unique")
+
+        self.model = self._build_model()
+        # best state of self.model.variables, None until the first solve
+        self.state = None
+        self._bqm = None
+        self._pending = set()
+
+    def _build_model(self):
+        return knapsack_implicit_model(self.nodes, self.values, self.status, self.total_capacity,
+                                       value_r=self.value_r, weight_r=self.weight_r,
+                                       formulation=self.formulation, lagrange=self.lagrange)
+
+    @property
+    def bqm(self):
+        """dimod BQM of the current model, built on first use and patched by every update"""
+        if self._bqm is None:
+            self._bqm = self.model.to_bqm()
+        return self._bqm
+
+    def update(self, values=None, status=None):
+        """
+        change the value and/or status of existing nodes
+        parameters:
+            values, status - dicts of node to its new value / status
+        """
+        changed = set()
+        for node, value in (values or {}).items():
+            self.values[self._index[node]] = value
+            changed.add(node)
+        for node, node_status in (status or {}).items():
+            self.status[self._index[node]] = node_status
+            changed.add(node)
+        self._apply(changed)
+
+    def add_nodes(self, nodes, values, status):
+        """add new nodes, outside the knapsack until the next resolve"""
+        nodes = list(nodes)
+        duplicates = [node for node in nodes if node in self._index]
+        if duplicates or len(set(nodes)) != len(nodes):
+            raise ValueError(f"nodes already present: {duplicates}")
+
+        for node in nodes:
+            self._index[node] = len(self.nodes)
+            self.nodes.append(node)
+        self.values = np.concatenate((self.values, np.asarray(values, dtype=float)))
+        self.status = np.concatenate((self.status, np.asarray(status, dtype=float)))
+        self._apply(set(nodes))
+
+    def remove_nodes(self, nodes):
+        """remove nodes from the problem"""
+        removed = set(nodes)
+        keep = np.array([node not in removed for node in self.nodes], dtype=bool)
+        self.nodes = [node for node in self.nodes if node not in removed]
+        self.values = self.values[keep]
+        self.status = self.status[keep]
+        self._index = {node: i for i, node in enumerate(self.nodes)}
+        self._pending -= removed
+
+        if self._bqm is not None:
+            self._bqm.remove_variables_from(removed)
+        # removing a node changes the weight sum that weight_r depends on, and frees
+        # capacity, so the slack variables are re-annealed
+        self._apply(set())
+
+    def _apply(self, changed):
+        """rebuild the O(n) model vectors and patch the BQM and state for changed nodes"""
+        old = self.model
+        new = self._build_model()
+
+        with stage('incremental_patch', changed=len(changed), variables=len(new)) as record:
+            position = {label: i for i, label in enumerate(old.variables)}
+            old_index = np.array([position.get(label, -1) for label in new.variables])
+            present = old_index >= 0
+
+            # old vectors aligned with the new variables, zero for added ones
+            old_weights = np.where(present, old.weights[old_index], 0.0)
+            old_linear = np.where(present, old.linear[old_index], 0.0)
+
+            if self._bqm is not None:
+                record['couplings'] = self._patch_bqm(new, old_weights, old_linear)
+
+            if self.state is not None:
+                self.state = np.where(present, self.state[old_index], 0).astype(np.int8)
+
+        self.model = new
+        self._pending |= changed
+
+    def _patch_bqm(self, new, old_weights, old_linear):
+        """add the bias differences between the old and the new model to the BQM"""
+        labels = new.variables
+        for label in labels:
+            if label not in self._bqm.variables:
+                self._bqm.add_variable(label, 0.0)
+
+        delta = new.linear - old_linear
+        nonzero = np.flatnonzero(delta)
+        self._bqm.add_linear_from((labels[i], delta[i]) for i in nonzero)
+
+        # every coupling is 2*lagrange*a_i*a_j, so only the rows of changed weights differ
+        a = new.weights
+        changed = np.flatnonzero(a != old_weights)
+        done = np.zeros(len(a), dtype=bool)
+        count = 0
+        for i in changed:
+            done[i] = True
+            row = 2 * new.lagrange * (a[i] * a - old_weights[i] * old_weights)
+            j = np.flatnonzero(~done)
+            self._bqm.add_interactions_from((labels[i], labels[k], row[k]) for k in j.tolist())
+            count += len(j)
+        return count
+
+    def _solution_set(self):
+        sampleset = dimod.SampleSet.from_samples(
+            (self.state, self.model.variables), dimod.Vartype.BINARY,
+            self.model.energies(self.state))
+        return decode_sampleset(sampleset, self.nodes, self.values, self.status,
+                                value_r=self.value_r)
+
+    def _keep_best(self, states, energies):
+        """replace the state by the lowest energy one of states if it is better"""
+        best = int(np.argmin(energies))
+        if self.state is None or energies[best] < self.model.energies(self.state)[0]:
+            self.state = np.asarray(states[best], dtype=np.int8)
+
+    def solve(self, num_reads=1, num_workers=1):
+        """
+        anneal the whole problem from random states (the previous best is kept if
+        nothing better is found)
+        returns:
+            (SolutionSet) - solution set as returned by knapsack.solve_nodes
+        """
+        with stage('incremental_solve', reads=num_reads, variables=len(self.model)):
+            if self.backend == 'neal':
+                sampleset = sample_reads(neal.SimulatedAnnealingSampler(), self.bqm, num_reads,
+                                         num_workers=num_workers)
+            else:
+                sampleset = sample_reads(RankOneAnnealingSampler(), self.model, num_reads,
+                                         num_workers=num_workers)
+
+            columns = [sampleset.variables.index(label) for label in self.model.variables]
+            states = sampleset.record.sample[:, columns]
+            self._keep_best(states, self.model.energies(states))
+        self._pending.clear()
+        return self._solution_set()
+
+    def resolve(self, num_reads=1):
+        """
+        re-anneal the nodes changed since the last solve together with the slack
+        variables and the neighbourhood nodes, warm started from the previous solution
+        returns:
+            (SolutionSet) - solution set as returned by knapsack.solve_nodes
+        """
+        if self.state is None:
+            return self.solve(num_reads)
+
+        free = self._free_variables()
+        with stage('incremental_resolve', reads=num_reads, variables=len(free),
+                   changed=len(self._pending)):
+            sub = self._submodel(free)
+            initial = np.tile(self.state[free], (num_reads, 1))
+            if self.backend == 'neal':
+                sampleset = neal.SimulatedAnnealingSampler().sample(
+                    sub.to_bqm(), num_reads=num_reads, initial_states=(initial, sub.variables))
+            else:
+                sampleset = RankOneAnnealingSampler().sample(sub, num_reads=num_reads,
+                                                             initial_states=initial)
+
+            columns = [sampleset.variables.index(label) for label in sub.variables]
+            states = np.tile(self.state, (num_reads, 1))
+            states[:, free] = sampleset.record.sample[:, columns]
+            self._keep_best(states, self.model.energies(states))
+        self._pending.clear()
+        return self._solution_set()
+
+    def _free_variables(self):
+        """changed nodes, slack variables and the neighbourhood closest to the density threshold"""
+        n = len(self.nodes)
+        changed = [self._index[node] for node in self._pending]
+        slack = range(n, len(self.model))
+
+        weights = self.model.weights[:n]
+        values = self.model.values[:n]
+        in_knapsack = self.state[:n] == 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = np.where(weights > 0, values / weights, np.inf)
+        finite = np.isfinite(density)
+        inside, outside = density[in_knapsack & finite], density[~in_knapsack & finite]
+        if len(inside) and len(outside):
+            threshold = (inside.min() + outside.max()) / 2
+        else:
+            threshold = np.median(density[finite]) if finite.any() else 0.0
+        distance = np.where(finite, np.abs(density - threshold), np.inf)
+        neighbours = np.argsort(distance, kind='stable')[:self.neighbourhood]
+
+        return np.unique(np.concatenate((changed, neighbours, slack)).astype(int))
+
+    def _submodel(self, free):
+        """the model restricted to the free variables, every other variable clamped to the state"""
+        model = self.model
+        fixed = np.ones(len(model), dtype=bool)
+        fixed[free] = False
+        S0 = model.weights[fixed] @ self.state[fixed]
+
+        # lagrange*(S_free + S0)**2 + penalty_linear*(S_free + S0) - values.z
+        return ImplicitKnapsackModel(
+            [model.variables[i] for i in free], model.weights[free], model.values[free],
+            model.lagrange, penalty_linear=model.penalty_linear + 2 * model.lagrange * S0,
+            offset=(model.lagrange * S0**2 + model.penalty_linear * S0
+                    - model.values[fixed] @ self.state[fixed] + model.offset))
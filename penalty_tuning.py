@@ -0,0 +1,252 @@
+#automatic penalty strengths for the knapsack and route QUBOs
+
+#a penalty that is too weak gives samples that break the constraints (over-full
+#knapsacks, routes that skip or repeat cities), one that is too strong flattens the
+#objective so that feasible samples are poor. A sweep anneals a few reads at every
+#candidate strength, in parallel, and records the feasibility rate and the mean
+#objective of the feasible reads. The chosen strength is the smallest one that is
+#feasible in at least min_feasible of the reads and whose objective is within
+#tolerance of the best reliable candidate.
+#Results are cached by the content of the problem and the sweep settings in memory
+#and, once persistence is switched on with configure(disk=True), as JSON files under
+#$QUANTUM_CHAIN_CACHE/penalties (~/.cache/quantum-chain by default), so a problem is
+#only swept once.
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from disk_cache import LRUCache, cache_dir, clear_dir, write_atomic
+
+CACHE_DIR = cache_dir('penalties')
+
+# number of sweep results kept in memory
+MEMORY_CACHE_SIZE = 256
+
+# store sweep results on disk too
+PERSIST = False
+
+# share of the reads that must be feasible for a penalty to count as reliable
+MIN_FEASIBLE = 0.9
+
+# a reliable penalty this much (relative) worse than the best reliable one is not chosen
+TOLERANCE = 0.01
+
+_memory_cache = LRUCache(MEMORY_CACHE_SIZE)
+
+
+def configure(size=None, disk=None):
+    """
+    parameters:
+        size - number of sweep results kept in memory
+        disk - whether sweep results are also stored in and looked up from CACHE_DIR
+    """
+    global MEMORY_CACHE_SIZE, PERSIST
+    if size is not None:
+        MEMORY_CACHE_SIZE = size
+        _memory_cache.resize(size)
+    if disk is not None:
+        PERSIST = disk
+
+
+def knapsack_lagrange_candidates(base):
+    """lagrange values swept around base, the formulation's default (max(values) for slack)"""
+    return (base * 4.0**np.arange(-6, 2)).tolist()
+
+
+def route_penalty_candidates(D):
+    """constraint strengths A swept for distance matrix D (B = 1), around its longest edge"""
+    return (max(float(np.max(D)), 1.0) * 2.0**np.arange(-2, 4)).tolist()
+
+
+def _problem_key(kind, arrays, settings):
+    digest = hashlib.sha1(kind.encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(json.dumps(sorted(settings.items()), default=str).encode())
+    return digest.hexdigest()
+
+
+def _cached(key):
+    result = _memory_cache.get(key)
+    if result is not None or not PERSIST:
+        return result
+    try:
+        with open(os.path.join(CACHE_DIR, key + '.json')) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _memory_cache.put(key, result)
+    return result
+
+
+def _store(key, result):
+    _memory_cache.put(key, result)
+    if PERSIST:
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(result, f)
+
+        write_atomic(os.path.join(CACHE_DIR, key + '.json'), write)
+
+
+def choose_penalty(trials, min_feasible=MIN_FEASIBLE, tolerance=TOLERANCE, maximize=True):
+    """
+    the penalty of a sweep
+    parameters:
+        trials - dicts with the penalty, its feasibility rate and the mean objective of
+                 its feasible reads (None if there are none)
+        maximize - whether a larger objective is better (knapsack value) or a smaller
+                   one (route mileage)
+    returns:
+        (float) - the smallest reliable penalty whose objective is within tolerance of
+                  the best reliable one; the most feasible (largest on ties) penalty
+                  if none is reliable
+    """
+    trials = sorted(trials, key=lambda trial: trial['penalty'])
+    reliable = [trial for trial in trials
+                if trial['feasible'] >= min_feasible and trial['objective'] is not None]
+    if not reliable:
+        return max(trials, key=lambda trial: (trial['feasible'], trial['penalty']))['penalty']
+
+    sign = 1 if maximize else -1
+    best = max(sign * trial['objective'] for trial in reliable)
+    for trial in reliable:
+        if sign * trial['objective'] >= best - tolerance * abs(best):
+            return trial['penalty']
+
+
+def _sweep(trial, arguments, candidates, num_workers):
+    """run trial(*arguments, penalty) for every candidate, in num_workers processes"""
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(candidates)))
+    if num_workers == 1:
+        return [trial(*arguments, penalty) for penalty in candidates]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(trial, *arguments, penalty) for penalty in candidates]
+        return [future.result() for future in futures]
+
+
+def _summary(penalty, feasible, objectives):
+    return {'penalty': float(penalty), 'feasible': float(np.mean(feasible)),
+            'objective': float(np.mean(objectives[feasible])) if feasible.any() else None}
+
+
+def _knapsack_trial(nodes, values, status, total_capacity, value_r, weight_r, formulation,
+                    backend, num_reads, seed, lagrange):
+    from knapsack import knapsack_implicit_model, decode_sampleset, capacity_limit
+    from knapsack_implicit import RankOneAnnealingSampler
+    import neal
+
+    model = knapsack_implicit_model(nodes, values, status, total_capacity, value_r=value_r,
+                                    weight_r=weight_r, formulation=formulation, lagrange=lagrange)
+    if backend == 'neal':
+        sampleset = neal.SimulatedAnnealingSampler().sample(model.to_bqm(), num_reads=num_reads,
+                                                            seed=seed)
+    else:
+        sampleset = RankOneAnnealingSampler().sample(model, num_reads=num_reads, seed=seed)
+    solution_set = decode_sampleset(sampleset, nodes, values, status, value_r=value_r)
+
+    limit = capacity_limit(status, total_capacity, weight_r)
+    return _summary(lagrange, solution_set.used_capacities <= limit + 1e-9, solution_set.total_values)
+
+
+def tune_knapsack_lagrange(nodes, values, status, total_capacity, value_r=0, weight_r=0,
+                           formulation='slack', backend='implicit', candidates=None, num_reads=16,
+                           num_workers=None, min_feasible=MIN_FEASIBLE, seed=None, cache=True):
+    """
+    lagrange for knapsack.knapsack_bqm by a sweep over candidates
+    parameters:
+        nodes, values, status, total_capacity, value_r, weight_r, formulation - as in
+            knapsack.solve_nodes
+        backend - 'neal' or 'implicit', the sampler of the sweep
+        candidates - lagrange values to try, see knapsack_lagrange_candidates
+        num_reads - reads per candidate
+        num_workers - number of processes the candidates are spread over, None uses all cores
+        cache - reuse the result of an earlier sweep of the same problem and settings
+    returns:
+        (float, list) - the chosen lagrange and one dict per candidate with its
+                        feasibility rate and mean value of the feasible reads
+    """
+    from knapsack import knapsack_implicit_model
+
+    if backend not in ('neal', 'implicit'):
+        raise ValueError(f"unknown backend {backend!r}, expected 'neal' or 'implicit'")
+    if candidates is None:
+        base = knapsack_implicit_model(nodes, values, status, total_capacity, value_r=value_r,
+                                       weight_r=weight_r, formulation=formulation).lagrange
+        candidates = knapsack_lagrange_candidates(base)
+
+    key = _problem_key('knapsack', (values, status), dict(
+        nodes='\x00'.join(map(str, nodes)), total_capacity=float(total_capacity),
+        value_r=float(value_r), weight_r=float(weight_r), formulation=formulation, backend=backend,
+        candidates=list(map(float, candidates)), num_reads=num_reads, min_feasible=min_feasible))
+    result = _cached(key) if cache else None
+    if result is None:
+        arguments = (list(nodes), list(values), list(status), total_capacity, value_r, weight_r,
+                     formulation, backend, num_reads, seed)
+        trials = _sweep(_knapsack_trial, arguments, list(candidates), num_workers)
+        result = {'penalty': choose_penalty(trials, min_feasible), 'trials': trials}
+        if cache:
+            _store(key, result)
+    return result['penalty'], result['trials']
+
+
+def _route_trial(D, num_reads, seed, A):
+    from route_qubo import route_bqm, decode_route, route_mileage
+    import neal
+
+    n = len(D)
+    sampleset = neal.SimulatedAnnealingSampler().sample(route_bqm(D, A, 1), num_reads=num_reads,
+                                                        seed=seed)
+    columns = [sampleset.variables.index(v) for v in range(n * n)]
+    routes = [decode_route(sample, n) for sample in sampleset.record.sample[:, columns]]
+    feasible = np.array([sorted(route) == list(range(n)) for route in routes], dtype=bool)
+    mileage = np.array([route_mileage(D, route) if ok else np.inf
+                        for route, ok in zip(routes, feasible)])
+    return _summary(A, feasible, mileage)
+
+
+def tune_route_penalty(D, candidates=None, num_reads=16, num_workers=None,
+                       min_feasible=MIN_FEASIBLE, seed=None, cache=True):
+    """
+    constraint strength A of route_qubo.route_bqm (with B = 1) by a sweep over candidates
+    parameters:
+        D - distance matrix of the route
+        candidates - values of A to try, see route_penalty_candidates
+        num_reads - reads per candidate
+        num_workers - number of processes the candidates are spread over, None uses all cores
+        cache - reuse the result of an earlier sweep of the same problem and settings
+    returns:
+        (float, list) - the chosen A and one dict per candidate with its feasibility
+                        rate and mean mileage of the feasible reads
+    """
+    D = np.asarray(D, dtype=float)
+    if candidates is None:
+        candidates = route_penalty_candidates(D)
+
+    key = _problem_key('route', (D,), dict(candidates=list(map(float, candidates)),
+                                           num_reads=num_reads, min_feasible=min_feasible))
+    result = _cached(key) if cache else None
+    if result is None:
+        if len(D) < 2:
+            trials = [{'penalty': float(A), 'feasible': 1.0, 'objective': 0.0} for A in candidates]
+        else:
+            trials = _sweep(_route_trial, (D, num_reads, seed), list(candidates), num_workers)
+        result = {'penalty': choose_penalty(trials, min_feasible, maximize=False), 'trials': trials}
+        if cache:
+            _store(key, result)
+    return result['penalty'], result['trials']
+
+
+def clear_cache(disk=False):
+    """empty the in-memory cache and, with disk=True, remove the stored sweeps"""
+    _memory_cache.clear()
+    if disk:
+        clear_dir(CACHE_DIR, '.json')
@@ -0,0 +1,217 @@
+#map rendering for the delivery routes
+
+#boundary geometries (the USA outline from Natural Earth, the states of
+#states_21basic.zip) are read with geopandas once, reduced to their polygon rings in
+#longitude/latitude and cached: in memory, and on disk as .npz files under
+#$QUANTUM_CHAIN_CACHE/basemaps (~/.cache/quantum-chain by default). Later maps are
+#drawn from the cached arrays with matplotlib alone. render_routes draws any number
+#of routes reusing one figure, and render_async runs it in a background process so
+#the solver loop does not wait for the plots.
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+
+import numpy as np
+
+from disk_cache import cache_dir, clear_dir, write_atomic
+
+CACHE_DIR = cache_dir('basemaps')
+
+STATES_ZIP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'states_21basic.zip')
+
+# map extent (longitude, latitude) of the continental US
+USA_EXTENT = (-130, -65, 20, 55)
+
+_executor = None
+_pending = []
+
+
+class Basemap:
+    """
+    polygon rings of a boundary file
+    parameters:
+        coords - (n, 2) longitude/latitude of all ring vertices, ring after ring
+        offsets - start of every ring in coords, followed by len(coords)
+        labels - region (country or state abbreviation) of every ring
+    """
+
+    def __init__(self, coords, offsets, labels):
+        self.coords = np.asarray(coords, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=str)
+
+    def rings(self, regions=None):
+        """vertex arrays of the rings, only those of the given regions if any"""
+        selected = range(len(self.labels))
+        if regions is not None:
+            selected = np.flatnonzero(np.isin(self.labels, list(regions)))
+        return [self.coords[self.offsets[k]:self.offsets[k + 1]] for k in selected]
+
+    def save(self, path):
+        np.savez(path, coords=self.coords, offsets=self.offsets, labels=self.labels)
+
+
+def _read_boundaries(name):
+    """(rings, labels) of a boundary file, read with geopandas"""
+    import geopandas
+
+    if name == 'usa':
+        world = geopandas.read_file(geopandas.datasets.get_path('naturalearth_lowres'))
+        regions = world[world.name == 'United States of America']
+        labels = regions['name']
+    elif name == 'states':
+        regions = geopandas.read_file('zip://' + STATES_ZIP)
+        labels = regions['STATE_ABBR']
+    else:
+        raise ValueError(f"unknown basemap {name!r}, expected 'usa' or 'states'")
+
+    if regions.crs is not None:
+        regions = regions.to_crs('EPSG:4326')
+
+    rings, ring_labels = [], []
+    for label, geometry in zip(labels, regions.geometry):
+        polygons = geometry.geoms if geometry.geom_type == 'MultiPolygon' else [geometry]
+        for polygon in polygons:
+            rings.append(np.asarray(polygon.exterior.coords)[:, :2])
+            ring_labels.append(label)
+    return rings, ring_labels
+
+
+@lru_cache(maxsize=None)
+def basemap(name='usa'):
+    """
+    cached boundaries
+    parameters:
+        name - 'usa' (Natural Earth outline) or 'states' (states_21basic.zip)
+    returns:
+        (Basemap)
+    """
+    path = os.path.join(CACHE_DIR, name + '.npz')
+    try:
+        with np.load(path) as data:
+            return Basemap(data['coords'], data['offsets'], data['labels'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    rings, labels = _read_boundaries(name)
+    offsets = np.cumsum([0] + [len(ring) for ring in rings])
+    result = Basemap(np.concatenate(rings), offsets, labels)
+    write_atomic(path, result.save)
+    return result
+
+
+def draw_basemap(ax, name='usa', regions=None):
+    """draw the boundaries of basemap(name) (optionally only some regions) into ax"""
+    from matplotlib.collections import PolyCollection
+
+    ax.add_collection(PolyCollection(basemap(name).rings(regions), facecolors='white',
+                                     edgecolors='black', linewidths=0.8))
+
+
+def draw_route(ax, route, cities, color=None, label_prefix=''):
+    """
+    draw a route (path, stops, start and end) into ax
+    parameters:
+        route - city names in the order they are visited
+        cities - dict of city name to (latitude, longitude), longitude positive west
+    """
+    if not route:
+        return
+    points = np.array([[-cities[city][1], cities[city][0]] for city in route])
+    ax.plot(points[:, 0], points[:, 1], color=color, label=label_prefix + 'Path')
+    ax.scatter(points[:, 0], points[:, 1], color='blue', zorder=3, label=label_prefix + 'To Visit')
+    ax.scatter(points[:1, 0], points[:1, 1], color='green', zorder=4, label=label_prefix + 'Start')
+    ax.scatter(points[-1:, 0], points[-1:, 1], color='red', zorder=4, label=label_prefix + 'End')
+
+
+def _new_map(figure, cities, name, extent):
+    ax = figure.add_subplot()
+    draw_basemap(ax, name)
+    points = np.array([[-lon, lat] for lat, lon in cities.values()])
+    ax.scatter(points[:, 0], points[:, 1], color='gray', zorder=2, label='All cites')
+
+    ax.set_xlim(xmin=extent[0], xmax=extent[1])
+    ax.set_ylim(ymin=extent[2], ymax=extent[3])
+    ax.set_yticks([])
+    ax.set_xticks([])
+    ax.set_aspect(1.2)
+    return ax
+
+
+def render_routes(routes, cities, filenames=None, combined_filename=None, colors=None,
+                  name='usa', extent=USA_EXTENT):
+    """
+    save a map of each route and/or one map with all of them
+    parameters:
+        routes - list of routes, each a list of city names in visiting order
+        cities - dict of city name to (latitude, longitude), longitude positive west
+        filenames - one file per route (None for no per-route maps)
+        combined_filename - file for a single map with every route (None for none)
+        colors - path color of every route on the combined map
+        name - basemap, see basemap
+    returns:
+        (list) - names of the files written
+    """
+    import matplotlib
+    matplotlib.use("agg")
+    import matplotlib.pyplot as plt
+
+    written = []
+    figure = plt.figure()
+    for route, filename in zip(routes, filenames or []):
+        ax = _new_map(figure, cities, name, extent)
+        draw_route(ax, route, cities)
+        ax.legend()
+        figure.savefig(filename)
+        written.append(filename)
+        figure.clear()
+
+    if combined_filename:
+        ax = _new_map(figure, cities, name, extent)
+        for k, route in enumerate(routes):
+            color = colors[k] if colors else None
+            draw_route(ax, route, cities, color=color, label_prefix=f'{k}: ')
+        figure.savefig(combined_filename)
+        written.append(combined_filename)
+
+    plt.close(figure)
+    return written
+
+
+def render_async(*args, **kwargs):
+    """
+    render_routes in a background process
+    returns:
+        (concurrent.futures.Future) - resolves to the names of the files written
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    future = _executor.submit(render_routes, *args, **kwargs)
+    _pending.append(future)
+    return future
+
+
+def wait_for_renders():
+    """
+    block until every render_async job is done
+    returns:
+        (list) - names of the files written
+    """
+    global _executor
+    written = []
+    for future in _pending:
+        written.extend(future.result())
+    _pending.clear()
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    return written
+
+
+def clear_cache(disk=False):
+    """forget the loaded basemaps and, with disk=True, remove the cached .npz files"""
+    basemap.cache_clear()
+    if disk:
+        clear_dir(CACHE_DIR, '.npz')
@@ -0,0 +1,136 @@
+#classical local search for delivery tours
+
+#nearest-neighbour construction followed by 2-opt and Or-opt moves until neither
+#improves the tour. Every pass scores all candidate moves at once from the distance
+#matrix with NumPy and applies the best one. The tour is used on its own for large
+#routes and, one-hot encoded, as the initial state of the route QUBO annealer.
+
+import numpy as np
+
+
+def tour_length(D, tour):
+    """length of the closed tour"""
+    tour = np.asarray(tour)
+    if len(tour) < 2:
+        return 0.0
+    return float(np.asarray(D)[tour, np.roll(tour, -1)].sum())
+
+
+def nearest_neighbor_tour(D, start=0):
+    """greedy tour that always moves to the closest unvisited city"""
+    D = np.asarray(D, dtype=float)
+    n = len(D)
+    visited = np.zeros(n, dtype=bool)
+    tour = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        distances = np.where(visited, np.inf, D[tour[-1]])
+        tour.append(int(np.argmin(distances)))
+        visited[tour[-1]] = True
+    return np.array(tour)
+
+
+def two_opt(D, tour, tol=1e-9):
+    """
+    best-improvement 2-opt: replace edges (a_i, b_i), (a_j, b_j) by (a_i, a_j), (b_i, b_j)
+    by reversing the tour between them, while that shortens the tour
+    """
+    D = np.asarray(D, dtype=float)
+    tour = np.array(tour)
+    n = len(tour)
+    if n < 4:
+        return tour
+
+    # moves that are not a proper 2-opt exchange: j <= i+1, and the two
+    # edges sharing the city at position 0
+    invalid = np.tril(np.ones((n, n), dtype=bool), 1)
+    invalid[0, n - 1] = True
+
+    while True:
+        a = tour
+        b = np.roll(tour, -1)
+        edge = D[a, b]
+        delta = D[a[:, None], a[None, :]] + D[b[:, None], b[None, :]] - edge[:, None] - edge[None, :]
+        delta[invalid] = 0
+        i, j = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[i, j] >= -tol:
+            return tour
+        tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+
+
+def or_opt(D, tour, max_segment=3, tol=1e-9):
+    """
+    best-improvement Or-opt: move a segment of 1..max_segment consecutive cities,
+    possibly reversed, between two other neighbouring cities while that shortens the tour
+    """
+    D = np.asarray(D, dtype=float)
+    tour = np.array(tour)
+    n = len(tour)
+
+    while True:
+        best = (-tol, None)
+        for length in range(1, min(max_segment, n - 3) + 1):
+            starts = np.arange(n - length + 1)
+            first = tour[starts]
+            last = tour[starts + length - 1]
+            prev = tour[starts - 1]
+            after = tour[(starts + length) % n]
+            removal_gain = D[prev, first] + D[last, after] - D[prev, after]
+
+            # insert between c = tour[k] and d = tour[k+1] for every edge k
+            c = tour
+            d = np.roll(tour, -1)
+            forward = D[c[None, :], first[:, None]] + D[last[:, None], d[None, :]]
+            backward = D[c[None, :], last[:, None]] + D[first[:, None], d[None, :]]
+            insertion = np.minimum(forward, backward) - D[c, d][None, :]
+            delta = insertion - removal_gain[:, None]
+
+            # edges touching the segment: k = start-1 .. start+length-1
+            k = (starts[:, None] + np.arange(-1, length)[None, :]) % n
+            np.put_along_axis(delta, k, np.inf, axis=1)
+
+            s, e = np.unravel_index(np.argmin(delta), delta.shape)
+            if delta[s, e] < best[0]:
+                reverse = backward[s, e] < forward[s, e]
+                best = (delta[s, e], (starts[s], length, e, reverse))
+
+        if best[1] is None:
+            return tour
+
+        start, length, edge, reverse = best[1]
+        segment = tour[start:start + length]
+        if reverse:
+            segment = segment[::-1]
+        c = tour[edge]
+        rest = np.concatenate((tour[:start], tour[start + length:]))
+        position = int(np.flatnonzero(rest == c)[0]) + 1
+        tour = np.concatenate((rest[:position], segment, rest[position:]))
+
+
+def solve_tour(D, tour=None):
+    """
+    local-search tour: nearest neighbour (unless a tour is given), then 2-opt and
+    Or-opt alternately until neither improves it
+    returns:
+        (numpy.ndarray) - city index at every position of the tour
+    """
+    D = np.asarray(D, dtype=float)
+    if len(D) == 0:
+        return np.array([], dtype=int)
+    tour = nearest_neighbor_tour(D) if tour is None else np.array(tour)
+
+    length = tour_length(D, tour)
+    while True:
+        tour = or_opt(D, two_opt(D, tour))
+        new_length = tour_length(D, tour)
+        if new_length >= length - 1e-9:
+            return tour
+        length = new_length
+
+
+def tour_to_sample(tour):
+    """one-hot route QUBO state of a tour: variable v*n + j is 1 when city v is at position j"""
+    n = len(tour)
+    sample = np.zeros((n, n), dtype=np.int8)
+    sample[np.asarray(tour), np.arange(n)] = 1
+    return sample.ravel()
@@ -0,0 +1,78 @@
+#travelling salesman QUBO for a single delivery route
+
+#variable v*n + j is 1 when city v is visited at position j of the tour.
+#The QUBO is emitted as COO arrays holding only its non-zero terms, computed in
+#bulk from the distance matrix: O(n**3) terms instead of the (n*n)**2 dictionary
+#entries of a dense QUBO, so routes of 50-100 stops fit in memory.
+
+import numpy as np
+import dimod
+
+
+def route_qubo_vectors(D, A, B=1):
+    """
+    build the route QUBO as numpy vectors
+    parameters:
+        D - n x n distance matrix of the cities on the route
+        A - strength of the one-city-per-position / one-position-per-city constraints
+        B - weight of the distance objective
+    returns:
+        (linear, (row, col, quadratic), offset) - as accepted by
+        dimod.BinaryQuadraticModel.from_numpy_vectors
+    """
+    D = np.asarray(D, dtype=float)
+    n = len(D)
+    index = np.arange(n * n).reshape(n, n)  # index[v, j]
+
+    # both constraints contribute -A to every variable
+    linear = np.full(n * n, -2.0 * A)
+
+    # Constraint that each row (city) has exactly one 1 and that each col
+    # (position) has exactly one 1; 4*A as the dense QUBO held 2*A in both
+    # the (a, b) and the (b, a) entry
+    j, k = np.triu_indices(n, k=1)
+    same_city = (index[:, j].ravel(), index[:, k].ravel())
+    same_position = (index[j, :].ravel(), index[k, :].ravel())
+
+    # Objective that minimizes distance: city u at position j followed by
+    # city v at position j+1, for every pair with a non-zero distance
+    u, v = np.nonzero(D)
+    positions = np.arange(n)
+    distance_row = index[u[:, None], positions[None, :]].ravel()
+    distance_col = index[v[:, None], ((positions + 1) % n)[None, :]].ravel()
+    distance = np.repeat(B * D[u, v], n)
+
+    row = np.concatenate((same_city[0], same_position[0], distance_row))
+    col = np.concatenate((same_city[1], same_position[1], distance_col))
+    quadratic = np.concatenate((np.full(2 * len(same_city[0]), 4.0 * A), distance))
+
+    return linear, (row, col, quadratic), 0.0
+
+
+def route_bqm(D, A, B=1):
+    """route QUBO of route_qubo_vectors as a dimod BQM"""
+    linear, quadratic, offset = route_qubo_vectors(D, A, B)
+    return dimod.BinaryQuadraticModel.from_numpy_vectors(
+        linear, quadratic, offset, dimod.Vartype.BINARY)
+
+
+def decode_route(sample, n):
+    """
+    route of a QUBO sample
+    parameters:
+        sample - length n*n 0/1 vector ordered by variable index
+        n - number of cities
+    returns:
+        (list) - city index at every position, -1 where no city was selected
+    """
+    x = np.asarray(sample).reshape(n, n)
+    return np.where(x.any(axis=0), x.argmax(axis=0), -1).tolist()
+
+
+def route_mileage(D, route):
+    """length of the closed tour, skipping positions without a city"""
+    route = [v for v in route if v >= 0]
+    if len(route) < 2:
+        return 0.0
+    route = np.asarray(route)
+    return float(np.asarray(D)[route, np.roll(route, -1)].sum())
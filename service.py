@@ -0,0 +1,387 @@
+#local solver service for the dashboard
+
+#a long-running asyncio HTTP/JSON server around knapsack.solve_nodes and the delivery
+#routing of Optimized_Routes, so that a request does not pay for the imports and the
+#sampler start-up of a one-shot knapsack.py or Optimized_Routes.py process. The
+#solvers run in a process pool that is started and warmed up (modules imported, a
+#tiny problem solved) with the server and kept for its lifetime. Concurrent requests
+#for the same problem share one solve: the first one submits it to the pool under
+#the SHA-1 of its settings and later ones wait for the same result. Routes are
+#streamed as JSON lines, one per delivery group as soon as its route is solved.
+#Only the standard library is used for HTTP (HTTP/1.1 with keep-alive, no TLS), so
+#the service is meant for localhost; CORS is open for the React dev server.
+#
+#  GET  /health       {"status": "ok", "workers": ...}
+#  GET  /stats        requests, coalesced requests and p50/p99 latency per endpoint
+#  POST /solve_nodes  {"nodes": [...], "values": [...], "status": [...],
+#                      "total_capacity": ..., optional solve_nodes settings}
+#                     -> {"solutions": solution set of solve_nodes}
+#  POST /routes       {"points": [[latitude, longitude positive west], ...], "vehicles": 3,
+#                      optional cluster and route settings}
+#                     -> application/x-ndjson: a "clusters" line, one "route" line per
+#                        group in the order they finish and a "done" line
+#
+#to start it:> python ./service.py --port 8080 --workers 0
+#load test:> python -m benchmarks.service_load
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+ENDPOINTS = ('/health', '/stats', '/solve_nodes', '/routes')
+
+# largest request body accepted, in bytes
+MAX_BODY = 16 * 2**20
+
+# latencies kept per endpoint for the percentiles of /stats
+LATENCY_WINDOW = 10000
+
+# optional settings accepted by /solve_nodes, passed on to solve_nodes
+SOLVE_NODES_OPTIONS = ('value_r', 'weight_r', 'num_reads', 'backend', 'formulation', 'lagrange',
+                       'time_limit')
+
+# settings of /routes: request field to keyword of Optimized_Routes.cluster
+CLUSTER_OPTIONS = {'vehicles': 'num_groups', 'cluster_method': 'method', 'cluster_reads': 'num_reads',
+                   'balance': 'balance', 'vehicle_capacity': 'capacity'}
+
+# settings of /routes passed on to Optimized_Routes.route_group
+ROUTE_OPTIONS = ('method', 'num_reads', 'penalty', 'time_limit')
+
+
+class _HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+## solver processes
+
+def _warm_up():
+    """pool initializer: import the solvers and solve a tiny problem of each kind"""
+    import knapsack
+    import Optimized_Routes
+
+    knapsack.solve_nodes(['a', 'b', 'c'], [3, 2, 1], [2, 2, 1], 3, cache=False)
+    Optimized_Routes.route_group([(0.0, 0.0), (1.0, 1.0), (2.0, 0.0)])
+    Optimized_Routes.cluster([(0.0, 0.0), (1.0, 1.0), (2.0, 0.0)], num_reads=1, num_groups=2)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _solve_nodes(nodes, values, status, total_capacity, options):
+    from knapsack import solve_nodes
+    return solve_nodes(nodes, values, status, total_capacity, **options)
+
+
+def _cluster(points, options):
+    from Optimized_Routes import cluster
+    return cluster([tuple(point) for point in points], **options)
+
+
+def _route(points, options):
+    from Optimized_Routes import route_group
+    route, mileage, energy = route_group([tuple(point) for point in points], **options)
+    return route, float(mileage), None if energy is None else float(energy)
+
+
+## requests
+
+def _key(kind, *parts):
+    """content hash of a pool task, identical for identical problems and settings"""
+    return hashlib.sha1(json.dumps([kind, parts], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _options(request, names):
+    return {name: request[name] for name in names if request.get(name) is not None}
+
+
+def _require(request, *names):
+    missing = [name for name in names if name not in request]
+    if missing:
+        raise _HTTPError(400, f"missing fields: {', '.join(missing)}")
+    return [request[name] for name in names]
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {'count': 0, 'p50': None, 'p99': None}
+    p50, p99 = np.percentile(np.fromiter(latencies, float), [50, 99]).tolist()
+    return {'count': len(latencies), 'p50': p50, 'p99': p99}
+
+
+class SolverService:
+    """
+    the HTTP service with its warm solver pool
+    parameters:
+        num_workers - solver processes, None uses all cores
+    """
+
+    def __init__(self, num_workers=None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self._executor = None
+        self._server = None
+        # key of a pool task to the future every identical request waits on
+        self._inflight = {}
+        self._latencies = {}
+        self._counts = {'requests': 0, 'coalesced': 0, 'errors': 0}
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """start and warm up the solver processes and listen on host:port (0 picks a free port)"""
+        self._executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_warm_up)
+        loop = asyncio.get_running_loop()
+        # one task per worker makes the pool start all of them now, not on the first requests
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ping)
+                               for _ in range(self.num_workers)))
+        self._server = await asyncio.start_server(self._connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    async def serve_forever(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        host, port = await self.start(host, port)
+        print(f"solver service on http://{host}:{port} with {self.num_workers} workers")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    def _submit(self, key, function, *args):
+        """run function(*args) in the pool, or join the identical task already running"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self._counts['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # a client that goes away must not cancel the task the others wait on
+        return asyncio.shield(future)
+
+    def stats(self):
+        return dict(self._counts, workers=self.num_workers, inflight=len(self._inflight),
+                    latency={path: _percentiles(latencies)
+                             for path, latencies in self._latencies.items()})
+
+    ## endpoints
+
+    async def solve_nodes(self, request):
+        nodes, values, status, total_capacity = _require(request, 'nodes', 'values', 'status',
+                                                         'total_capacity')
+        if not len(nodes) == len(values) == len(status):
+            raise _HTTPError(400, "nodes, values and status must have the same length")
+        options = _options(request, SOLVE_NODES_OPTIONS)
+        key = _key('solve_nodes', nodes, values, status, total_capacity, options)
+        # the compact SolutionSet crosses the process boundary, the dictionaries are built here
+        solutions = await self._submit(key, _solve_nodes, nodes, values, status, total_capacity,
+                                       options)
+        return {'solutions': solutions.to_dicts()}
+
+    async def routes(self, request):
+        """yields the lines of the /routes stream"""
+        points, = _require(request, 'points')
+        points = [tuple(map(float, point)) for point in points]
+        cluster_options = {CLUSTER_OPTIONS[name]: value
+                           for name, value in _options(request, CLUSTER_OPTIONS).items()}
+        route_options = _options(request, ROUTE_OPTIONS)
+        start = time.perf_counter()
+
+        groups = await self._submit(_key('cluster', points, cluster_options), _cluster, points,
+                                    cluster_options)
+        yield {'type': 'clusters', 'groups': groups}
+
+        # one pool task per group, streamed in the order they finish
+        async def route(color, members):
+            return color, members, await self._submit(_key('route', members, route_options), _route,
+                                                      members, route_options)
+
+        tasks = [route(color, members) for color, members in groups.items() if members]
+        for finished in asyncio.as_completed(tasks):
+            color, members, (route, mileage, energy) = await finished
+            yield {'type': 'route', 'group': color, 'route': route,
+                   'points': [members[v] for v in route], 'mileage': mileage, 'energy': energy}
+        yield {'type': 'done', 'groups': len(tasks), 'elapsed': time.perf_counter() - start}
+
+    ## HTTP
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _HTTPError as error:
+                    await _respond(writer, error.status, {'error': str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, keep_alive, body = request
+                await self._dispatch(writer, method, path, keep_alive, body)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer, method, path, keep_alive, body):
+        start = time.perf_counter()
+        self._counts['requests'] += 1
+        try:
+            if method == 'OPTIONS':
+                await _respond(writer, 204, None, keep_alive)
+            elif method == 'GET' and path == '/health':
+                await _respond(writer, 200, {'status': 'ok', 'workers': self.num_workers}, keep_alive)
+            elif method == 'GET' and path == '/stats':
+                await _respond(writer, 200, self.stats(), keep_alive)
+            elif method == 'POST' and path == '/solve_nodes':
+                await _respond(writer, 200, await self.solve_nodes(_json(body)), keep_alive)
+            elif method == 'POST' and path == '/routes':
+                await _stream(writer, self.routes(_json(body)), keep_alive)
+            elif path in ENDPOINTS:
+                raise _HTTPError(405, f"{method} not allowed on {path}")
+            else:
+                raise _HTTPError(404, f"no endpoint {path}")
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as error:
+            self._counts['errors'] += 1
+            if isinstance(error, _HTTPError):
+                status = error.status
+            elif isinstance(error, (ValueError, TypeError, KeyError)):
+                # invalid settings, rejected by the solvers
+                status = 400
+            else:
+                status = 500
+            await _respond(writer, status, {'error': f"{type(error).__name__}: {error}"
+                                            if status == 500 else str(error)}, keep_alive)
+        # unknown paths share one entry, so that they cannot grow the statistics
+        latencies = self._latencies.setdefault(path if path in ENDPOINTS else 'other',
+                                               deque(maxlen=LATENCY_WINDOW))
+        latencies.append(time.perf_counter() - start)
+
+
+def _json(body):
+    try:
+        request = json.loads(body or b'{}')
+    except ValueError as error:
+        raise _HTTPError(400, f"invalid JSON: {error}") from None
+    if not isinstance(request, dict):
+        raise _HTTPError(400, "a JSON object expected")
+    return request
+
+
+async def _read_request(reader):
+    """(method, path, keep_alive, body) of the next request, None when the client is done"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise _HTTPError(400, "malformed request line") from None
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise _HTTPError(400, "invalid Content-Length")
+    if length > MAX_BODY:
+        raise _HTTPError(413, f"request body over {MAX_BODY} bytes")
+    body = await reader.readexactly(length) if length else b''
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return method.upper(), urlsplit(target).path, keep_alive, body
+
+
+def _head(status, headers, keep_alive):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+             'Access-Control-Allow-Origin: *',
+             'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+             'Access-Control-Allow-Headers: Content-Type',
+             'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def _respond(writer, status, payload, keep_alive):
+    body = b'' if payload is None else json.dumps(payload).encode()
+    headers = {'Content-Length': len(body)}
+    if payload is not None:
+        headers['Content-Type'] = 'application/json'
+    writer.write(_head(status, headers, keep_alive) + body)
+    await writer.drain()
+
+
+async def _stream(writer, lines, keep_alive):
+    """send every dict of the async iterator lines as one JSON line, in chunked encoding"""
+    started = False
+    try:
+        async for line in lines:
+            if not started:
+                writer.write(_head(200, {'Content-Type': 'application/x-ndjson',
+                                         'Transfer-Encoding': 'chunked'}, keep_alive))
+                started = True
+            data = (json.dumps(line) + '\n').encode()
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        raise
+    except Exception as error:
+        if not started:
+            raise
+        # the status line is sent already: report the error in the stream
+        data = (json.dumps({'type': 'error', 'error': str(error)}) + '\n').encode()
+        writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+def main():
+    """ CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="HTTP/JSON service solving knapsack allocations and delivery routes")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument('--port', '-p', type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help="Number of solver processes kept warm (0 for all cores)")
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(SolverService(args.workers or None).serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
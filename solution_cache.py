@@ -0,0 +1,114 @@
+#content-addressed cache of knapsack.solve_nodes results
+
+#a solution set is stored under the SHA-1 of everything that determines it: the
+#nodes, values, status, total capacity, value_r, weight_r and the sampler settings.
+#Results are kept in a bounded in-memory LRU and, once persistence is switched on
+#with configure(disk=True), as JSON files under $QUANTUM_CHAIN_CACHE/solutions
+#(~/.cache/quantum-chain by default) so that they outlive the process.
+#Callers that need a fresh anneal pass cache=False to solve_nodes.
+#The solution_set.SolutionSet objects are kept as they are: their arrays are read-only
+#and every dictionary they hand out is new, so callers cannot change a cached result.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from disk_cache import LRUCache, cache_dir, clear_dir, write_atomic
+from solution_set import SolutionSet
+
+CACHE_DIR = cache_dir('solutions')
+
+# bump when the layout of the solution sets changes
+FORMAT_VERSION = 2
+
+# number of solution sets kept in memory
+MEMORY_CACHE_SIZE = 128
+
+# store solution sets on disk too
+PERSIST = False
+
+_memory_cache = LRUCache(MEMORY_CACHE_SIZE)
+_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+
+def configure(size=None, disk=None):
+    """
+    parameters:
+        size - number of solution sets kept in memory
+        disk - whether solution sets are also stored in and looked up from CACHE_DIR
+    """
+    global MEMORY_CACHE_SIZE, PERSIST
+    if size is not None:
+        MEMORY_CACHE_SIZE = size
+        _memory_cache.resize(size)
+    if disk is not None:
+        PERSIST = disk
+
+
+def solution_key(nodes, values, status, total_capacity, value_r=0, weight_r=0, **settings):
+    """stable hash of a solve_nodes problem; settings are the sampler settings (backend, num_reads, ...)"""
+    digest = hashlib.sha1()
+    digest.update(str(FORMAT_VERSION).encode())
+    digest.update('\x00'.join(map(str, nodes)).encode())
+    for array in (values, status):
+        digest.update(b'\x01')
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    digest.update(json.dumps([float(total_capacity), float(value_r), float(weight_r),
+                              sorted(settings.items())], default=str).encode())
+    return digest.hexdigest()
+
+
+def get(key):
+    """cached solution set of key, or None"""
+    solution_set = _memory_cache.get(key)
+    if solution_set is not None:
+        _stats['hits'] += 1
+        return solution_set
+
+    if PERSIST:
+        try:
+            with open(os.path.join(CACHE_DIR, key + '.json')) as f:
+                solution_set = SolutionSet.from_json(json.load(f))
+        except (OSError, ValueError, KeyError):
+            pass
+        else:
+            _stats['disk_hits'] += 1
+            _memory_cache.put(key, solution_set)
+            return solution_set
+
+    _stats['misses'] += 1
+    return None
+
+
+def put(key, solution_set):
+    """store solution_set, a SolutionSet, under key"""
+    _memory_cache.put(key, solution_set)
+    if PERSIST:
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(solution_set.to_json(), f, default=_json_default)
+
+        write_atomic(os.path.join(CACHE_DIR, key + '.json'), write)
+
+
+def _json_default(value):
+    # numpy scalars in node labels
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def cache_info():
+    """hit, disk hit and miss counts and the memory cache size"""
+    return dict(_stats, size=len(_memory_cache), maxsize=_memory_cache.maxsize, persist=PERSIST)
+
+
+def clear_cache(disk=False):
+    """empty the in-memory cache, reset the statistics and, with disk=True, remove the stored files"""
+    _memory_cache.clear()
+    for name in _stats:
+        _stats[name] = 0
+    if disk:
+        clear_dir(CACHE_DIR, '.json')
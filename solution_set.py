@@ -0,0 +1,182 @@
+#compact knapsack solution sets
+
+#a solution set holds every read of a knapsack solve, lowest energy first. Instead of
+#one dictionary per read with lists of the open and closed node labels, SolutionSet
+#keeps the node labels once and the reads as a bit matrix packed with numpy.packbits
+#(reads x ceil(nodes/8) bytes), next to numpy vectors of the energies, total values
+#and used capacities. 1000 reads of 5000 nodes take 0.6 MB instead of the tens of MB
+#of the label lists, and pickle (e.g. from a worker process) as a few flat arrays.
+#The arrays are read-only, so a solution set can be shared (see solution_cache).
+#
+#Indexing and iteration give the dictionaries of decode_sampleset as before, built
+#when they are asked for: solution_set[0]['open_cities'] still works. to_arrow exports
+#the vectors and the packed bits without copying them; the node labels are stored in
+#the schema metadata.
+
+import base64
+import json
+
+import numpy as np
+
+# schema metadata key of the node labels in to_arrow tables
+NODES_METADATA = b'quantum_chain.nodes'
+
+
+def _frozen(array, dtype):
+    array = np.ascontiguousarray(array, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet export requires pyarrow") from None
+    return pyarrow
+
+
+class SolutionSet:
+    """
+    the reads of a knapsack solve, lowest energy first
+    parameters:
+        nodes - node labels, shared by all reads
+        bits - reads x ceil(len(nodes)/8) uint8 matrix, numpy.packbits of the in-knapsack
+               indicator of every read along the nodes
+        energies, total_values, used_capacities - one entry per read
+    """
+
+    def __init__(self, nodes, bits, energies, total_values, used_capacities):
+        self.nodes = np.empty(len(nodes), dtype=object)
+        self.nodes[:] = list(nodes)
+        self.nodes.flags.writeable = False
+        self.bits = _frozen(bits, np.uint8).reshape(len(energies), (len(self.nodes) + 7) // 8)
+        self.energies = _frozen(energies, float)
+        self.total_values = _frozen(total_values, float)
+        self.used_capacities = _frozen(used_capacities, np.int64)
+
+    @classmethod
+    def from_samples(cls, samples, energies, nodes, values, status, value_r=0):
+        """
+        solution set of binary samples
+        parameters:
+            samples - reads x nodes 0/1 matrix, columns in the order of nodes
+            energies - energy of every read; the reads are sorted by it
+            values, status - value and status of every node
+            value_r - see knapsack.knapsack_bqm, the share of the value of closed nodes counted
+        """
+        samples = np.asarray(samples).reshape(len(energies), len(nodes))
+        energies = np.asarray(energies, dtype=float)
+
+        # do sorting from lowest to highest energy (solution_indicator)
+        order = np.argsort(energies, kind='stable')
+        samples = samples[order]
+        energies = energies[order]
+
+        values = np.asarray(values, dtype=float)
+        status = np.asarray(status, dtype=float)
+        total_values = samples @ values + (1 - samples) @ values * value_r
+        used_capacities = np.rint(samples @ status).astype(np.int64)
+        return cls(nodes, np.packbits(samples == 1, axis=1), energies, total_values, used_capacities)
+
+    @classmethod
+    def from_dicts(cls, solutions, nodes):
+        """solution set of the dictionaries of decode_sampleset (in their order) over nodes"""
+        position = {node: i for i, node in enumerate(nodes)}
+        in_knapsack = np.zeros((len(solutions), len(position)), dtype=bool)
+        for k, solution in enumerate(solutions):
+            in_knapsack[k, [position[node] for node in solution['open_cities']]] = True
+        return cls(nodes, np.packbits(in_knapsack, axis=1),
+                   [solution['solution_indicator'] for solution in solutions],
+                   [solution['total_value'] for solution in solutions],
+                   [solution['used_capacity'] for solution in solutions])
+
+    def __len__(self):
+        return len(self.energies)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return SolutionSet(self.nodes, self.bits[k], self.energies[k], self.total_values[k],
+                               self.used_capacities[k])
+        if not -len(self) <= k < len(self):
+            raise IndexError(f"solution {k} out of range for {len(self)} reads")
+        in_knapsack = self.in_knapsack(k)
+        return {
+            'open_cities': self.nodes[in_knapsack].tolist(),
+            'closed_cities': self.nodes[~in_knapsack].tolist(),
+            'solution_indicator': float(self.energies[k]),
+            'total_value': float(self.total_values[k]),
+            'used_capacity': int(self.used_capacities[k]),
+        }
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def __repr__(self):
+        return f"<SolutionSet of {len(self)} reads over {len(self.nodes)} nodes>"
+
+    def in_knapsack(self, k=None):
+        """
+        in-knapsack indicator of read k, or of every read
+        returns:
+            (numpy.ndarray) - bool vector over the nodes, or a reads x nodes matrix when k is None
+        """
+        bits = self.bits if k is None else self.bits[k]
+        return np.unpackbits(bits, axis=-1, count=len(self.nodes)).astype(bool)
+
+    def to_dicts(self):
+        """the solution set as a list of dictionaries, as decode_sampleset used to return it"""
+        return list(self)
+
+    def to_json(self):
+        """JSON-serializable dict of the solution set, see from_json"""
+        return {'nodes': self.nodes.tolist(), 'bits': base64.b64encode(self.bits.tobytes()).decode(),
+                'energies': self.energies.tolist(), 'total_values': self.total_values.tolist(),
+                'used_capacities': self.used_capacities.tolist()}
+
+    @classmethod
+    def from_json(cls, record):
+        bits = np.frombuffer(base64.b64decode(record['bits']), dtype=np.uint8)
+        return cls(record['nodes'], bits, record['energies'], record['total_values'],
+                   record['used_capacities'])
+
+    def to_arrow(self):
+        """
+        pyarrow Table with one row per read: energy, total_value, used_capacity and the
+        packed in_knapsack bits (fixed size binary); the node labels are JSON in the
+        schema metadata. The columns share the memory of the arrays.
+        """
+        pa = _pyarrow()
+        width = self.bits.shape[1]
+        bits = pa.Array.from_buffers(pa.binary(width), len(self), [None, pa.py_buffer(self.bits)])
+        table = pa.table({'energy': self.energies, 'total_value': self.total_values,
+                          'used_capacity': self.used_capacities, 'in_knapsack': bits})
+        nodes = json.dumps(self.nodes.tolist(), default=lambda value: value.item())
+        return table.replace_schema_metadata({NODES_METADATA: nodes.encode()})
+
+    @classmethod
+    def from_arrow(cls, table):
+        """solution set of a to_arrow table, e.g. read back from Parquet"""
+        nodes = json.loads((table.schema.metadata or {})[NODES_METADATA])
+        width = (len(nodes) + 7) // 8
+        column = table.column('in_knapsack').combine_chunks()
+        if width:
+            bits = np.frombuffer(column.buffers()[1], dtype=np.uint8, count=len(column) * width,
+                                 offset=column.offset * width)
+        else:
+            bits = np.zeros((len(column), 0), dtype=np.uint8)
+        return cls(nodes, bits, table.column('energy').to_numpy(),
+                   table.column('total_value').to_numpy(), table.column('used_capacity').to_numpy())
+
+    def to_parquet(self, path):
+        """write the to_arrow table to a Parquet file, see read_parquet"""
+        _pyarrow()
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path)
+        return path
+
+    @classmethod
+    def read_parquet(cls, path):
+        _pyarrow()
+        import pyarrow.parquet as pq
+        return cls.from_arrow(pq.read_table(path))
@@ -0,0 +1,255 @@
+#nearest alternative delivery sites for en-route re-routing
+
+#Step 3 of the README sends a shipment whose vaccine quality degrades to a nearby
+#hospital that can still take it. SiteIndex answers k-nearest and within-radius
+#queries over the candidate sites, filtered by their remaining capacity, for one
+#vehicle or a whole fleet at once. Sites are stored as unit vectors on the sphere in
+#a scipy cKDTree: the straight-line (chord) distance between unit vectors grows with
+#the great-circle distance, so tree neighbours are haversine neighbours, and chord
+#lengths are converted to miles exactly (distances.R is the Earth radius).
+#Capacity changes only touch an array. Inserted sites go to a small buffer that is
+#searched by brute force and deleted sites are masked out; the tree is rebuilt once
+#the buffer and the deleted sites exceed REBUILD_FRACTION of the indexed ones.
+#
+#python spatial_index.py H_Beds.csv uscities.csv 38.63 90.2 -k 5 --min-capacity 500
+
+import argparse
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from distances import R
+
+# rebuild the tree when inserted plus deleted sites exceed this fraction of it
+REBUILD_FRACTION = 0.25
+
+
+def unit_vectors(coordinates):
+    """(n, 3) points on the unit sphere of (latitude, longitude) pairs in degrees"""
+    coordinates = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    lat, lon = coordinates[:, 0], coordinates[:, 1]
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_miles(chord):
+    return 2 * R * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0))
+
+
+def miles_to_chord(miles):
+    return 2 * math.sin(min(miles / (2 * R), math.pi / 2))
+
+
+class SiteIndex:
+    """
+    candidate delivery sites with their remaining capacity
+    parameters:
+        sites - unique site labels (e.g. the node labels of ingest.read_hospital_nodes)
+        coordinates - (latitude, longitude) of every site; queries must use the same
+                      longitude sign convention (the cities dicts use positive west)
+        capacity - remaining capacity of every site, 0 by default
+    """
+
+    def __init__(self, sites, coordinates, capacity=None, rebuild_fraction=REBUILD_FRACTION):
+        self.sites = list(sites)
+        self._position = {site: i for i, site in enumerate(self.sites)}
+        if len(self._position) != len(self.sites):
+            raise ValueError("site labels must be unique")
+
+        self.vectors = unit_vectors(coordinates)
+        if len(self.vectors) != len(self.sites):
+            raise ValueError("one coordinate pair per site expected")
+        self.capacity = (np.zeros(len(self.sites)) if capacity is None
+                         else np.asarray(capacity, dtype=float).copy())
+        self.alive = np.ones(len(self.sites), dtype=bool)
+        self.rebuild_fraction = rebuild_fraction
+        self._rebuild()
+
+    @classmethod
+    def from_nodes(cls, nodes, coordinates, capacity='status'):
+        """
+        index of knapsack nodes
+        parameters:
+            nodes - DataFrame of ingest.read_hospital_nodes
+            coordinates - dict of node to (latitude, longitude), see geocoding.geocode_nodes;
+                          nodes without coordinates are left out
+            capacity - column of nodes used as the remaining capacity
+        """
+        found = nodes['node'].isin(list(coordinates)).to_numpy()
+        nodes = nodes[found]
+        return cls(nodes['node'].tolist(), [coordinates[node] for node in nodes['node']],
+                   nodes[capacity].to_numpy())
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def __contains__(self, site):
+        return site in self._position
+
+    def _rebuild(self):
+        """drop the deleted sites and index every remaining one in a new tree"""
+        if not self.alive.all():
+            keep = np.flatnonzero(self.alive)
+            self.sites = [self.sites[i] for i in keep]
+            self.vectors = self.vectors[keep]
+            self.capacity = self.capacity[keep]
+            self.alive = self.alive[keep]
+            self._position = {site: i for i, site in enumerate(self.sites)}
+        self._tree = cKDTree(self.vectors) if len(self.sites) else None
+        # sites [0, _indexed) are in the tree, the rest is the insert buffer
+        self._indexed = len(self.sites)
+
+    def _maybe_rebuild(self):
+        stale = (len(self.sites) - self._indexed) + int((~self.alive[:self._indexed]).sum())
+        if stale > self.rebuild_fraction * max(self._indexed, 1):
+            self._rebuild()
+
+    def insert(self, sites, coordinates, capacity):
+        """add new sites"""
+        sites = list(sites)
+        duplicates = [site for site in sites if site in self._position]
+        if duplicates or len(set(sites)) != len(sites):
+            raise ValueError(f"sites already present: {duplicates}")
+
+        for site in sites:
+            self._position[site] = len(self.sites)
+            self.sites.append(site)
+        self.vectors = np.concatenate((self.vectors, unit_vectors(coordinates)))
+        self.capacity = np.concatenate((self.capacity, np.asarray(capacity, dtype=float)))
+        self.alive = np.concatenate((self.alive, np.ones(len(sites), dtype=bool)))
+        self._maybe_rebuild()
+
+    def delete(self, sites):
+        """remove sites"""
+        for site in sites:
+            self.alive[self._position.pop(site)] = False
+        self._maybe_rebuild()
+
+    def update_capacity(self, capacity):
+        """
+        parameters:
+            capacity - dict of site to its new remaining capacity
+        """
+        for site, value in capacity.items():
+            self.capacity[self._position[site]] = value
+
+    def nearest(self, points, k=1, min_capacity=0):
+        """
+        the k nearest sites with at least min_capacity remaining
+        parameters:
+            points - one (latitude, longitude) pair or a sequence of them (e.g. a fleet)
+        returns:
+            (list) - (site, miles) pairs, nearest first; one such list per point when
+                     a sequence of points is given
+        """
+        single = np.ndim(points) == 1
+        vectors = unit_vectors(points)
+        eligible = self.alive & (self.capacity >= min_capacity)
+
+        chords, candidates = self._tree_nearest(vectors, k, eligible)
+        buffered = np.arange(self._indexed, len(self.sites))
+        buffered = buffered[eligible[buffered]]
+
+        results = []
+        for row, vector in enumerate(vectors):
+            chord, candidate = chords[row], candidates[row]
+            if len(buffered):
+                chord = np.concatenate((chord, np.linalg.norm(self.vectors[buffered] - vector, axis=1)))
+                candidate = np.concatenate((candidate, buffered))
+            order = np.argsort(chord, kind='stable')[:k]
+            results.append(self._pairs(candidate[order], chord[order]))
+        return results[0] if single else results
+
+    def _tree_nearest(self, vectors, k, eligible):
+        """per point, the chords and positions of its k nearest eligible indexed sites"""
+        m = len(vectors)
+        chords = [np.empty(0)] * m
+        candidates = [np.empty(0, dtype=int)] * m
+        if self._tree is None or k < 1:
+            return chords, candidates
+
+        # ask the tree for more neighbours than needed and widen the search for the
+        # points where the capacity filter left fewer than k
+        todo = np.arange(m)
+        fetch = min(self._indexed, 2 * k)
+        while len(todo):
+            chord, index = self._tree.query(vectors[todo], k=fetch)
+            chord, index = chord.reshape(len(todo), -1), index.reshape(len(todo), -1)
+            valid = eligible[np.minimum(index, self._indexed - 1)] & (index < self._indexed)
+            done = (valid.sum(axis=1) >= k) | (fetch >= self._indexed)
+            for row in np.flatnonzero(done):
+                keep = np.flatnonzero(valid[row])[:k]
+                chords[todo[row]] = chord[row, keep]
+                candidates[todo[row]] = index[row, keep]
+            todo = todo[~done]
+            fetch = min(self._indexed, 4 * fetch)
+        return chords, candidates
+
+    def within(self, points, miles, min_capacity=0):
+        """
+        every site within miles with at least min_capacity remaining
+        parameters:
+            points - one (latitude, longitude) pair or a sequence of them
+        returns:
+            (list) - (site, miles) pairs, nearest first; one such list per point when
+                     a sequence of points is given
+        """
+        single = np.ndim(points) == 1
+        vectors = unit_vectors(points)
+        eligible = self.alive & (self.capacity >= min_capacity)
+        radius = miles_to_chord(miles)
+
+        if self._tree is not None:
+            neighbours = self._tree.query_ball_point(vectors, radius)
+        else:
+            neighbours = [[] for _ in vectors]
+        buffered = np.arange(self._indexed, len(self.sites))
+        buffered = buffered[eligible[buffered]]
+
+        results = []
+        for row, vector in enumerate(vectors):
+            candidate = np.asarray(neighbours[row], dtype=int)
+            candidate = np.concatenate((candidate[eligible[candidate]], buffered))
+            chord = np.linalg.norm(self.vectors[candidate] - vector, axis=1)
+            inside = chord <= radius
+            candidate, chord = candidate[inside], chord[inside]
+            order = np.argsort(chord, kind='stable')
+            results.append(self._pairs(candidate[order], chord[order]))
+        return results[0] if single else results
+
+    def _pairs(self, positions, chords):
+        return list(zip([self.sites[i] for i in positions], chord_to_miles(chords).tolist()))
+
+
+def main():
+    """ CLI
+    """
+    import geocoding
+    from ingest import read_hospital_nodes
+
+    parser = argparse.ArgumentParser(description="Nearest hospitals with remaining capacity")
+    parser.add_argument('data', help="hospital file in the H_Beds.csv schema (see ingest)")
+    parser.add_argument('uscities', help="simplemaps uscities.csv, see geocoding")
+    parser.add_argument('latitude', type=float)
+    parser.add_argument('longitude', type=float, help="positive west")
+    parser.add_argument('-k', type=int, default=5, help="Number of sites")
+    parser.add_argument('--radius', type=float, help="All sites within this many miles instead")
+    parser.add_argument('--min-capacity', type=float, default=0,
+                        help="Smallest remaining capacity (the node status) of a site")
+
+    args = parser.parse_args()
+
+    nodes = read_hospital_nodes(args.data)
+    index = SiteIndex.from_nodes(nodes, geocoding.geocode_nodes(nodes, geocoding.load_index(args.uscities)))
+    point = (args.latitude, args.longitude)
+    if args.radius is not None:
+        sites = index.within(point, args.radius, min_capacity=args.min_capacity)
+    else:
+        sites = index.nearest(point, k=args.k, min_capacity=args.min_capacity)
+    for site, miles in sites:
+        print(f"{site}: {miles:.1f} miles")
+
+
+if __name__ == '__main__':
+    main()
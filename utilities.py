@@ -15,31 +15,11 @@
 # Handy functions that are not necessary for the conceptual understanding of
 # this code example
 
-from collections import defaultdict
-
 import matplotlib
 matplotlib.use("agg")
 import matplotlib.pyplot as plt
 
 
-def get_groupings(sample):
-    """Grab selected items and group them by color"""
-    colored_points = defaultdict(list)
-
-    for label, bool_val in sample.items():
-        # Skip over items that were not selected
-        if not bool_val:
-            continue
-
-        # Parse selected items
-        # Note: label look like "<x_coord>,<y_coord>_<color>"
-        coord, color = label.split("_")
-        coord_tuple = tuple(map(float, coord.split(",")))
-        colored_points[color].append(coord_tuple)
-
-    return dict(colored_points)
-
-
 def visualize_groupings(groupings_dict, filename):
     """
     Args:
@@ -53,8 +33,11 @@ def visualize_groupings(groupings_dict, filename):
             continue
 
         # Populate plot
-        point_style = color + "o"
-        plt.plot(*zip(*points), point_style)
+        # Note: groups that are not named by a color get the next color of the cycle
+        if matplotlib.colors.is_color_like(color):
+            plt.plot(*zip(*points), "o", color=color)
+        else:
+            plt.plot(*zip(*points), "o")
 
     plt.savefig(filename)
 